@@ -15,6 +15,10 @@ def get_user_role(user):
         return None
     if getattr(user, 'is_superuser', False):
         return ROLE_ADMIN
+    # Use prefetched groups when available (e.g. prefetch_related('user__groups'))
+    prefetched = getattr(user, '_prefetched_objects_cache', {}).get('groups')
+    if prefetched is not None:
+        return ROLE_AGENT if any(group.name == ROLE_AGENT for group in prefetched) else ROLE_USER
     try:
         if user.groups.filter(name=ROLE_AGENT).exists():
             return ROLE_AGENT
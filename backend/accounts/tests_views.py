@@ -82,3 +82,17 @@ class AccountsViewTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('total_users', response.data)
+
+    def test_admin_user_stats_groups_signups_by_month(self):
+        from django.utils import timezone
+        last_month = timezone.now().replace(day=1) - timezone.timedelta(days=1)
+        User.objects.filter(pk=self.user.pk).update(date_joined=last_month)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse('accounts:user-management-stats'))
+
+        monthly = response.data['monthly_signups']
+        self.assertEqual(len(monthly), 6)
+        self.assertEqual(monthly[0], {'month': timezone.now().strftime('%b'), 'count': 2})
+        self.assertEqual(monthly[1], {'month': last_month.strftime('%b'), 'count': 1})
+        self.assertEqual(sum(item['count'] for item in monthly), 3)
@@ -16,6 +16,7 @@ from rest_framework.exceptions import ValidationError
 from django.db import transaction
 from .permissions import IsAdmin, IsAgent
 from datetime import timedelta
+from utils.time_buckets import bucket_counts, fill_buckets
 from .models import Profile
 from properties.models import AgentProfile, Property
 from .serializers import UserSerializer, UserProfileSerializer, AgentProfileSerializer
@@ -104,19 +105,18 @@ class UserManagementViewSet(viewsets.ReadOnlyModelViewSet):
                 date_joined__gte=timezone.now() - timedelta(days=30)
             ).count(),
         }
-        # Monthly signup stats (last 6 months approximate)
-        monthly_stats = []
-        for i in range(6):
-            month_start = timezone.now() - timedelta(days=30 * i)
-            month_end = month_start + timedelta(days=30)
-            count = User.objects.filter(
-                date_joined__gte=month_start,
-                date_joined__lt=month_end
-            ).count()
-            monthly_stats.append({
-                'month': month_start.strftime('%b'),
-                'count': count
-            })
+        # Monthly signup stats (current and previous 5 calendar months, newest first)
+        today = timezone.localdate()
+        six_months_ago = today.replace(day=1)
+        for _ in range(5):
+            six_months_ago = (six_months_ago - timedelta(days=1)).replace(day=1)
+        signups = bucket_counts(
+            User.objects.filter(date_joined__date__gte=six_months_ago), 'date_joined', 'month'
+        )
+        monthly_stats = [
+            {'month': month.strftime('%b'), 'count': count}
+            for month, count in reversed(fill_buckets(signups, six_months_ago, today, 'month'))
+        ]
 
         stats['monthly_signups'] = monthly_stats
 
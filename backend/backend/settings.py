@@ -255,6 +255,13 @@ GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 GOOGLE_MAPS_GEOCODE_TIMEOUT = int(os.getenv('GOOGLE_MAPS_GEOCODE_TIMEOUT', 5))
 REDIS_URL = os.getenv('REDIS_URL')
 
+# Buffered property view counting (see properties/view_tracking.py)
+PROPERTY_VIEW_FLUSH_INTERVAL = int(os.getenv('PROPERTY_VIEW_FLUSH_INTERVAL', 10))
+PROPERTY_VIEW_FLUSH_THRESHOLD = int(os.getenv('PROPERTY_VIEW_FLUSH_THRESHOLD', 500))
+
+# Worker threads resizing uploaded property photos (see properties/media.py)
+MEDIA_PROCESSING_WORKERS = int(os.getenv('MEDIA_PROCESSING_WORKERS', 2))
+
 # Message Encryption Configuration
 # Generate key with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
 from cryptography.fernet import Fernet
@@ -269,6 +276,16 @@ if not MESSAGE_ENCRYPTION_KEY:
         logger = logging.getLogger(__name__)
         logger.warning("Using temporary encryption key. Set MESSAGE_ENCRYPTION_KEY in .env for persistence.")
 
+# Store encrypted messages without a plaintext copy (see encrypt_message_storage).
+# Only honoured with a persistent MESSAGE_ENCRYPTION_KEY: under a temporary key
+# the ciphertext would be unreadable after a restart or from another worker.
+MESSAGE_ENCRYPTED_ONLY = os.getenv('MESSAGE_ENCRYPTED_ONLY', 'False').lower() in ('true', '1', 'yes')
+if MESSAGE_ENCRYPTED_ONLY and not os.getenv('MESSAGE_ENCRYPTION_KEY'):
+    raise ValueError("MESSAGE_ENCRYPTED_ONLY requires MESSAGE_ENCRYPTION_KEY to be set")
+
+# Decrypted messages kept in memory per process (see communications.encryption)
+MESSAGE_DECRYPT_CACHE_SIZE = int(os.getenv('MESSAGE_DECRYPT_CACHE_SIZE', '10000'))
+
 
 # M-Pesa Payment Integration (Daraja API)
 DAR_AFFILIATE_CONSUMER_KEY = os.getenv('DAR_AFFILIATE_CONSUMER_KEY')
@@ -277,6 +294,14 @@ DAR_SHORTCODE = os.getenv('DAR_SHORTCODE')
 DAR_PASSKEY = os.getenv('DAR_PASSKEY')
 MPESA_API_BASE = os.getenv('MPESA_API_BASE', 'https://sandbox.safaricom.co.ke')
 MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL')
+# Keep-alive connections to Daraja per worker, and retries for failed requests (see utils/mpesa_daraja.py)
+MPESA_HTTP_POOL_SIZE = int(os.getenv('MPESA_HTTP_POOL_SIZE', 10))
+MPESA_HTTP_RETRIES = int(os.getenv('MPESA_HTTP_RETRIES', 3))
+# Daraja status queries per second shared by all workers, seconds between on-demand
+# queries for one payment, and age of pending payments swept by `manage.py reconcile_payments`
+MPESA_STATUS_QUERY_RATE = int(os.getenv('MPESA_STATUS_QUERY_RATE', 5))
+MPESA_STATUS_QUERY_INTERVAL = int(os.getenv('MPESA_STATUS_QUERY_INTERVAL', 30))
+MPESA_RECONCILE_MIN_AGE = int(os.getenv('MPESA_RECONCILE_MIN_AGE', 60))
 
 # Twilio SMS Integration
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
@@ -400,6 +425,22 @@ if REDIS_URL:
 else:
     CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
 
+# Seconds a WebSocket connection counts as online without a heartbeat (see communications/presence.py)
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', 60))
+
+# Seconds WebSocket handshakes reuse resolved users and conversation membership
+WS_AUTH_CACHE_TTL = int(os.getenv('WS_AUTH_CACHE_TTL', 30))
+
+# Notification outbox (see communications/outbox.py); processed by `manage.py process_notifications`
+NOTIFICATION_CHANNEL_CONCURRENCY = {
+    'email': int(os.getenv('NOTIFICATION_EMAIL_CONCURRENCY', 4)),
+    'sms': int(os.getenv('NOTIFICATION_SMS_CONCURRENCY', 2)),
+    'push': int(os.getenv('NOTIFICATION_PUSH_CONCURRENCY', 8)),
+}
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 6))
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv('NOTIFICATION_RETRY_BASE_SECONDS', 30))
+NOTIFICATION_RETRY_MAX_SECONDS = int(os.getenv('NOTIFICATION_RETRY_MAX_SECONDS', 3600))
+
 
 # Internationalization
 LANGUAGE_CODE = 'en'
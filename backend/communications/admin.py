@@ -15,11 +15,13 @@ class ConversationAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['id', 'conversation', 'sender', 'text_preview', 'read_at', 'has_attachment', 'created_at']
     list_filter = ['read_at', 'created_at']
-    search_fields = ['sender__username', 'text', 'conversation__user__username', 'conversation__agent__username']
+    # Message text is stored encrypted, so it cannot be searched in the database
+    search_fields = ['sender__username', 'conversation__user__username', 'conversation__agent__username']
     readonly_fields = ['created_at']
     
     def text_preview(self, obj):
-        return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
+        text = obj.decrypted_text
+        return text[:50] + '...' if len(text) > 50 else text
     text_preview.short_description = 'Text Preview'
     
     def has_attachment(self, obj):
@@ -0,0 +1,131 @@
+"""
+Short-lived, per-process cache for WebSocket connection setup.
+
+Every handshake resolves the JWT's user and then checks conversation
+membership. Both answers change rarely, so they are kept in memory for
+``WS_AUTH_CACHE_TTL`` seconds (default 30) and shared by
+``JWTAuthMiddleware`` and the consumers. A reconnecting client then opens
+its sockets without touching the database.
+
+Entries are dropped when the user or conversation is saved or deleted in
+this process (see communications.signals). Other workers pick the change up
+within the TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import Conversation
+
+User = get_user_model()
+
+MAX_ENTRIES = 10000
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_users = TTLCache()
+_conversations = TTLCache()
+
+
+def _ttl():
+    return getattr(settings, 'WS_AUTH_CACHE_TTL', 30)
+
+
+def cached_user(user_id):
+    """Return the cached user for ``user_id`` without querying, or None."""
+    return _users.get(user_id)
+
+
+def get_user(user_id):
+    """
+    Return the active user ``user_id``, or None if there is none.
+
+    The profile and groups are loaded with it, so serializing the user as a
+    message sender (name, role, avatar) needs no further queries.
+    """
+    user = _users.get(user_id)
+    if user is None:
+        user = User.objects.select_related('profile').prefetch_related('groups').filter(
+            id=user_id, is_active=True
+        ).first()
+        if user is None:
+            return None
+        _users.set(user_id, user, _ttl())
+    return user
+
+
+def get_conversation(conversation_id):
+    """
+    Return ``{'user_id', 'agent_id', 'is_active'}`` for a conversation, or
+    None if it does not exist.
+    """
+    conversation = _conversations.get(conversation_id)
+    if conversation is None:
+        conversation = Conversation.objects.filter(id=conversation_id).values(
+            'user_id', 'agent_id', 'is_active'
+        ).first()
+        if conversation is None:
+            return None
+        _conversations.set(conversation_id, conversation, _ttl())
+    return conversation
+
+
+def mark_conversation_active(conversation_id):
+    """Set ``is_active`` on a conversation, skipping the write if it is already set."""
+    conversation = get_conversation(conversation_id)
+    if conversation is None or conversation['is_active']:
+        return False
+    Conversation.objects.filter(id=conversation_id, is_active=False).update(is_active=True)
+    _conversations.set(conversation_id, {**conversation, 'is_active': True}, _ttl())
+    return True
+
+
+def forget_user(user_id):
+    _users.delete(user_id)
+
+
+def forget_conversation(conversation_id):
+    _conversations.delete(conversation_id)
+
+
+def clear():
+    _users.clear()
+    _conversations.clear()
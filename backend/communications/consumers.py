@@ -1,14 +1,16 @@
+import asyncio
 import json
 import logging
+import time
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from communications.models import Conversation, Message, MessageNotification
-from communications.serializers import MessageSerializer
-from communications.notification_service import get_notification_service
+from communications import connection_cache, presence
+from communications.models import Conversation, MessageNotification
+from communications.messaging import send_chat_message
 from communications.throttles import WebSocketRateLimit
+from properties import payments
 from rest_framework.exceptions import Throttled
 
 logger = logging.getLogger(__name__)
@@ -16,7 +18,7 @@ User = get_user_model()
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
-    """Consumer for real-time notifications"""
+    """Consumer for real-time notifications, payment status and the user's online presence"""
     
     async def connect(self):
         user = self.scope["user"]
@@ -28,10 +30,15 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         # Add user to their personal notification group
         self.group_name = f"notifications_{user.id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        # ...and to the status updates of their payments
+        self.payment_group_name = payments.payment_group(user.id)
+        await self.channel_layer.group_add(self.payment_group_name, self.channel_name)
         await self.accept()
         
         # Set User Online
-        await self.set_user_status(user, True)
+        if await sync_to_async(presence.connect, thread_sensitive=False)(user.id, self.channel_name):
+            await self.broadcast_status(user.id, True)
+        self.heartbeat_task = asyncio.ensure_future(self.keep_alive(user.id))
 
     async def disconnect(self, close_code):
         user = self.scope["user"]
@@ -41,50 +48,88 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
+        if hasattr(self, 'payment_group_name'):
+            await self.channel_layer.group_discard(self.payment_group_name, self.channel_name)
+        if hasattr(self, 'heartbeat_task'):
+            self.heartbeat_task.cancel()
         
-        # Set User Offline
+        # Set User Offline once their last connection closes
         if not user.is_anonymous:
-            await self.set_user_status(user, False)
+            if await sync_to_async(presence.disconnect, thread_sensitive=False)(user.id, self.channel_name):
+                await self.broadcast_status(user.id, False)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Any frame from the client (e.g. {"type": "heartbeat"}) refreshes presence.
+
+        {"type": "payment_status", "payment_id": <id>} also replies with the
+        payment's current status, for sockets opened after it was resolved.
+        """
+        user_id = self.scope["user"].id
+        await self.refresh_presence(user_id)
+        try:
+            data = json.loads(text_data) if text_data else {}
+        except json.JSONDecodeError:
+            return
+        if isinstance(data, dict) and data.get('type') == 'payment_status':
+            await self.send_payment_status(user_id, data.get('payment_id'))
+
+    async def send_payment_status(self, user_id, payment_id):
+        try:
+            payment_id = int(payment_id)
+        except (TypeError, ValueError):
+            return
+        payment = await database_sync_to_async(payments.get_status_for_user)(payment_id, user_id)
+        if payment is not None:
+            await self.send(text_data=json.dumps({'type': 'payment_status', 'payment': payment}))
+
+    async def keep_alive(self, user_id):
+        """Refresh presence while the socket is open; stops with the worker"""
+        while True:
+            await asyncio.sleep(presence.presence_ttl() / 3)
+            await self.refresh_presence(user_id)
+
+    async def refresh_presence(self, user_id):
+        if await sync_to_async(presence.heartbeat, thread_sensitive=False)(user_id, self.channel_name):
+            await self.broadcast_status(user_id, True)
+
+    async def broadcast_status(self, user_id, is_online):
+        """Publish an online/offline transition once, to chats watching this user"""
+        await self.channel_layer.group_send(
+            presence.presence_group(user_id),
+            {
+                'type': 'user_status',
+                'user_id': user_id,
+                'is_online': is_online
+            }
+        )
 
     async def notification_message(self, event):
         """Send notification to WebSocket"""
         message = event["message"]
         await self.send(text_data=json.dumps(message))
-    
-    @database_sync_to_async
-    def set_user_status(self, user, is_online):
-        try:
-            profile = user.profile
-            profile.is_online = is_online
-            profile.save()
-            
-            # Broadcast to active conversations (Simplified logic)
-            # Find conversations where this user is a participant
-            conversations = Conversation.objects.filter(
-                Q(user=user) | Q(agent=user),
-                is_active=True
-            )
-            
-            channel_layer = get_channel_layer()
-            for conv in conversations:
-                async_to_sync(channel_layer.group_send)(
-                    f'chat_{conv.id}',
-                    {
-                        'type': 'user_status',
-                        'user_id': user.id,
-                        'is_online': is_online
-                    }
-                )
-        except Exception as e:
-            logger.error(f"Error setting user status: {e}")
+
+    async def payment_status(self, event):
+        """Send a resolved payment's status to WebSocket"""
+        await self.send(text_data=json.dumps({'type': 'payment_status', 'payment': event['payment']}))
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for real-time chat"""
     
+    # Repeated "still typing" events are re-broadcast at most this often (seconds)
+    typing_refresh_interval = 3
+    # Read receipts arriving within this many seconds of a flush are coalesced
+    read_receipt_flush_interval = 1
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.rate_limiter = WebSocketRateLimit(max_messages=10, window=10)
+        self.is_typing = False
+        self.typing_sent_at = 0
+        self.read_high_water = 0
+        self.pending_read_id = None
+        self.read_flush_task = None
     
     async def connect(self):
         """Handle WebSocket connection"""
@@ -102,11 +147,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Join room group
+        # Join room group, and follow the other participant's presence
         await self.channel_layer.group_add(
             self.conversation_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            presence.presence_group(self.other_user_id),
+            self.channel_name
+        )
         
         await self.accept()
         
@@ -114,22 +163,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.mark_conversation_active()
         
         # Send initial status of other participant
-        status_data = await self.get_initial_status()
-        if status_data:
-            await self.send(text_data=json.dumps({
-                'type': 'user_status',
-                'user_id': status_data['user_id'],
-                'is_online': status_data['is_online']
-            }))
+        is_online = await sync_to_async(presence.is_online, thread_sensitive=False)(self.other_user_id)
+        await self.send(text_data=json.dumps({
+            'type': 'user_status',
+            'user_id': self.other_user_id,
+            'is_online': is_online
+        }))
         
         logger.info(f"User {self.user.username} connected to conversation {self.conversation_id}")
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if getattr(self, 'other_user_id', None):
+            # Don't leave the other side showing a typing indicator
+            if self.is_typing:
+                await self.handle_typing({'is_typing': False})
+            if self.read_flush_task is not None:
+                self.read_flush_task.cancel()
+            await self.flush_read_receipts()
         await self.channel_layer.group_discard(
             self.conversation_group_name,
             self.channel_name
         )
+        if getattr(self, 'other_user_id', None):
+            await self.channel_layer.group_discard(
+                presence.presence_group(self.other_user_id),
+                self.channel_name
+            )
         logger.info(f"User {self.user.username} disconnected from conversation {self.conversation_id}")
     
     async def receive(self, text_data):
@@ -154,9 +214,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def handle_message(self, data):
         """Handle new message with rate limiting"""
         try:
-            # Check rate limit first
-            await self.check_rate_limit()
-            
             text = data.get('text', '').strip()
             # If front-end sends 'content', support that too for compatibility
             if not text:
@@ -165,26 +222,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not text:
                 return
             
-            # Save message to database
-            message = await self.save_message(text)
-            
-            # Serialize and broadcast
-            # We need to manually serialize simple data to avoid sync calls in serializer if possible, 
-            # or wrap serializer in sync_to_async.
-            message_data = await self.serialize_message(message)
+            # Rate limit, persist and build both broadcasts in one thread hop
+            sent = await self.send_chat_message(text)
+            if sent is None:
+                await self.send_error("Failed to send message")
+                return
             
             # Broadcast to group
             await self.channel_layer.group_send(
                 self.conversation_group_name,
                 {
                     'type': 'chat.message',
-                    'message': message_data,
+                    'message': sent.payload,
                     'sender_id': self.user.id,
                 }
             )
-            
-            # Send notifications to other participants
-            await self.notify_participants(message)
+            await self.channel_layer.group_send(
+                f"notifications_{sent.recipient.id}",
+                {
+                    "type": "notification.message",
+                    "message": sent.notification,
+                }
+            )
             
         except Throttled as e:
             logger.warning(f"Rate limit exceeded for user {self.user.id} in conversation {self.conversation_id}")
@@ -194,8 +253,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Failed to send message")
     
     async def handle_typing(self, data):
-        """Handle typing indicator"""
-        is_typing = data.get('is_typing', False)
+        """
+        Handle typing indicator
+        
+        Clients emit one event per keystroke; only changes of state, and a
+        refresh of "still typing" every ``typing_refresh_interval`` seconds,
+        are broadcast.
+        """
+        is_typing = bool(data.get('is_typing', False))
+        now = time.monotonic()
+        if is_typing == self.is_typing and (
+            not is_typing or now - self.typing_sent_at < self.typing_refresh_interval
+        ):
+            return
+        self.is_typing = is_typing
+        self.typing_sent_at = now
         
         await self.channel_layer.group_send(
             self.conversation_group_name,
@@ -208,12 +280,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
     
     async def handle_read_receipt(self, data):
-        """Handle message read receipt"""
-        message_id = data.get('message_id')
-        if message_id:
-            success = await self.mark_message_read(message_id)
-            if success:
-                await self.broadcast_read_receipt(message_id)
+        """
+        Handle message read receipt
+        
+        Receipts are folded into a "read up to message X" high-water mark.
+        The first one is persisted and broadcast right away; any arriving
+        in the next ``read_receipt_flush_interval`` seconds go out together.
+        """
+        try:
+            message_id = int(data.get('message_id'))
+        except (TypeError, ValueError):
+            return
+        if message_id <= max(self.read_high_water, self.pending_read_id or 0):
+            return
+        self.pending_read_id = message_id
+        if self.read_flush_task is None or self.read_flush_task.done():
+            await self.flush_read_receipts()
+            self.read_flush_task = asyncio.ensure_future(self.flush_read_receipts_later())
+    
+    async def flush_read_receipts_later(self):
+        await asyncio.sleep(self.read_receipt_flush_interval)
+        await self.flush_read_receipts()
+    
+    async def flush_read_receipts(self):
+        """Persist and broadcast the pending read high-water mark"""
+        message_id, self.pending_read_id = self.pending_read_id, None
+        if message_id is None:
+            return
+        self.read_high_water = message_id
+        if await self.mark_read_up_to(message_id):
+            await self.broadcast_read_receipt(message_id)
     
     # Event handlers
     async def chat_message(self, event):
@@ -253,68 +349,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def verify_participant(self):
         """Verify user is a participant in the conversation"""
-        try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            return self.user == conversation.user or self.user == conversation.agent
-        except Conversation.DoesNotExist:
+        conversation = connection_cache.get_conversation(int(self.conversation_id))
+        if conversation is None:
             return False
-    
-    @database_sync_to_async
-    def save_message(self, text):
-        """Save message to database"""
-        message = Message.objects.create(
-            conversation_id=self.conversation_id,
-            sender=self.user,
-            text=text,
+        if self.user.id not in (conversation['user_id'], conversation['agent_id']):
+            return False
+        self.other_user_id = (
+            conversation['agent_id'] if conversation['user_id'] == self.user.id else conversation['user_id']
         )
-        return message
-
+        return True
+    
     @database_sync_to_async
-    def serialize_message(self, message):
-         return MessageSerializer(message).data
+    def send_chat_message(self, text):
+        """Check the rate limit, then save the message and its notifications"""
+        self.rate_limiter.allow_message(self.user.id, self.conversation_id)
+        return send_chat_message(int(self.conversation_id), self.user, text)
     
     @database_sync_to_async
     def mark_conversation_active(self):
-        """Mark conversation as active"""
-        try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            conversation.is_active = True
-            conversation.save()
-        except Conversation.DoesNotExist:
-            logger.error(f"Conversation {self.conversation_id} not found")
+        """Mark conversation as active (no write when it already is)"""
+        connection_cache.mark_conversation_active(int(self.conversation_id))
     
     @database_sync_to_async
-    def mark_message_read(self, message_id):
-        """Mark message as read"""
-        try:
-            # We are marking a message as read by THIS user.
-            # So updating notification OR setting read_at if not set?
-            # Model has read_at on message (single time?) or MessageNotification per user.
-            # strict Message model has read_at.
-            # I should update read_at if I am the recipient.
-            
-            message = Message.objects.get(id=message_id)
-            if message.sender != self.user and not message.read_at:
-                from django.utils import timezone
-                message.read_at = timezone.now()
-                message.read_at = timezone.now()
-                message.save()
-                
-            notification = MessageNotification.objects.filter(
-                message_id=message_id,
-                user=self.user
-            ).first()
-            
-            if notification:
-                notification.is_read = True
-                notification.save()
-                return True
-            return False
-        except Message.DoesNotExist:
-            return False
+    def mark_read_up_to(self, message_id):
+        """Mark everything received up to ``message_id`` as read, in one pass"""
+        from communications.read_state import mark_read_up_to
+        conversation = Conversation(id=int(self.conversation_id))
+        marked = mark_read_up_to(conversation, self.user, message_id)
+        notified = MessageNotification.objects.filter(
+            user=self.user,
+            message__conversation_id=conversation.id,
+            message_id__lte=message_id,
+            is_read=False
+        ).update(is_read=True)
+        return bool(marked or notified)
     
     async def broadcast_read_receipt(self, message_id):
-        """Broadcast read receipt to group"""
+        """Broadcast that ``user`` has read everything up to ``message_id``"""
         await self.channel_layer.group_send(
             self.conversation_group_name,
             {
@@ -330,79 +401,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'type': 'read_receipt',
             'message_id': event['message_id'],
             'user_id': event['user_id'],
+            'up_to': True,
         }))
     
-    @database_sync_to_async
-    def get_other_participant(self):
-        """Get other participant in conversation"""
-        try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            return conversation.agent if conversation.user == self.user else conversation.user
-        except Conversation.DoesNotExist:
-            return None
-    
-    async def notify_participants(self, message):
-        """Send notifications to other participants"""
-        try:
-            other_participant = await self.get_other_participant()
-            if not other_participant:
-                return
-
-            notification_service = get_notification_service()
-            
-            # Create notification record - wrap in async
-            await self._create_notification(other_participant, message)
-            
-            # Send multi-channel notification
-            if notification_service:
-                from asgiref.sync import sync_to_async
-                content_preview = message.text[:100] if message.text else "Attachment"
-                await sync_to_async(notification_service.notify_new_message)(
-                    other_participant,
-                    self.user.get_full_name() or self.user.username,
-                    content_preview,
-                    channels=['push', 'email'],
-                    conversation_id=self.conversation_id
-                )
-        except Exception as e:
-            logger.error(f"Error notifying participants: {e}")
-    
-    @database_sync_to_async
-    def get_initial_status(self):
-        try:
-            conversation = Conversation.objects.get(id=self.conversation_id)
-            other = conversation.agent if conversation.user == self.user else conversation.user
-            
-            # Check profile status
-            is_online = False
-            if hasattr(other, 'profile'):
-                is_online = other.profile.is_online
-                
-            # Send to self (sync wrapper needed if calling async send from sync context? No, this is async method called from async)
-            # But wait, send_initial_status is decorated with database_sync_to_async, so it runs in thread.
-            # I cannot call await self.send() from inside it easily without async_to_sync which is messy.
-            # Better: make it return status, then send in connect.
-            return {
-                'user_id': other.id,
-                'is_online': is_online
-            }
-        except Exception:
-            return None
-
-    @database_sync_to_async
-    def _create_notification(self, participant, message):
-        """Create notification record"""
-        MessageNotification.objects.create(
-            user=participant,
-            message=message,
-            is_read=False,
-        )
-    
-    @database_sync_to_async
-    def check_rate_limit(self):
-        """Check WebSocket rate limit"""
-        return self.rate_limiter.allow_message(self.user.id, self.conversation_id)
-    
     async def send_error(self, error_message):
         """Send error message to client"""
         await self.send(text_data=json.dumps({
@@ -1,12 +1,21 @@
 """Message encryption utilities for secure message storage"""
 
+from collections import OrderedDict
 from cryptography.fernet import Fernet, InvalidToken
 from django.conf import settings
 import base64
+import hashlib
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+DECRYPTION_FAILED = "[Encrypted message - decryption failed]"
+
+# Fernet tokens start with version byte 0x80, which urlsafe base64 renders as
+# "gA". Legacy rows wrapped the token in a second base64 layer ("Z0FB...").
+FERNET_TOKEN_PREFIX = "gA"
+
 
 class MessageEncryption:
     """Encrypt and decrypt message content using Fernet symmetric encryption"""
@@ -25,6 +34,11 @@ class MessageEncryption:
             self.cipher = Fernet(key)
         except Exception as e:
             raise ValueError(f"Invalid MESSAGE_ENCRYPTION_KEY: {e}")
+
+        # Bounded LRU of decrypted plaintext keyed by (message id, ciphertext digest)
+        self.cache_size = getattr(settings, 'MESSAGE_DECRYPT_CACHE_SIZE', 10000)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
     
     def encrypt(self, text: str) -> str:
         """
@@ -34,14 +48,13 @@ class MessageEncryption:
             text: Plain text message to encrypt
             
         Returns:
-            Base64 encoded encrypted text
+            Fernet token (already URL-safe base64)
         """
         if not text:
             return ""
         
         try:
-            encrypted = self.cipher.encrypt(text.encode('utf-8'))
-            return base64.b64encode(encrypted).decode('ascii')
+            return self.cipher.encrypt(text.encode('utf-8')).decode('ascii')
         except Exception as e:
             logger.error(f"Encryption error: {e}")
             raise
@@ -51,7 +64,7 @@ class MessageEncryption:
         Decrypt message text
         
         Args:
-            encrypted_text: Base64 encoded encrypted text
+            encrypted_text: Fernet token, or a legacy base64-wrapped token
             
         Returns:
             Decrypted plain text
@@ -60,15 +73,77 @@ class MessageEncryption:
             return ""
         
         try:
-            decoded = base64.b64decode(encrypted_text.encode('ascii'))
-            decrypted = self.cipher.decrypt(decoded)
+            decrypted = self.cipher.decrypt(self.unwrap(encrypted_text))
             return decrypted.decode('utf-8')
         except InvalidToken:
             logger.error("Decryption failed: Invalid token or corrupted data")
-            return "[Encrypted message - decryption failed]"
+            return DECRYPTION_FAILED
         except Exception as e:
             logger.error(f"Decryption error: {e}")
-            return "[Encrypted message - decryption failed]"
+            return DECRYPTION_FAILED
+
+    @staticmethod
+    def unwrap(encrypted_text: str) -> bytes:
+        """
+        Return the raw Fernet token for stored ciphertext
+
+        Args:
+            encrypted_text: Fernet token, or a legacy base64-wrapped token
+
+        Returns:
+            Fernet token bytes
+        """
+        if encrypted_text.startswith(FERNET_TOKEN_PREFIX):
+            return encrypted_text.encode('ascii')
+        return base64.b64decode(encrypted_text.encode('ascii'))
+
+    def decrypt_many(self, items) -> dict:
+        """
+        Decrypt a batch of message texts, reusing previously decrypted ones
+
+        Args:
+            items: Iterable of (message_id, encrypted_text) pairs
+
+        Returns:
+            Dict mapping message_id to decrypted plain text
+        """
+        results = {}
+        misses = []
+        with self._cache_lock:
+            for message_id, encrypted_text in items:
+                if not encrypted_text:
+                    results[message_id] = ""
+                    continue
+                key = (message_id, hashlib.blake2b(encrypted_text.encode('ascii'), digest_size=16).digest())
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[message_id] = self._cache[key]
+                else:
+                    misses.append((message_id, key, encrypted_text))
+
+        if not misses:
+            return results
+
+        decrypted = []
+        for message_id, key, encrypted_text in misses:
+            text = self.decrypt(encrypted_text)
+            results[message_id] = text
+            # Failures are not cached so a fixed key or repaired row is picked up
+            if text != DECRYPTION_FAILED:
+                decrypted.append((key, text))
+
+        with self._cache_lock:
+            for key, text in decrypted:
+                self._cache[key] = text
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def clear_cache(self):
+        """Drop all cached plaintext"""
+        with self._cache_lock:
+            self._cache.clear()
 
 
 # Global encryptor instance (singleton pattern)
@@ -86,3 +161,21 @@ def get_encryptor():
     if _encryptor is None:
         _encryptor = MessageEncryption()
     return _encryptor
+
+
+def decrypt_messages(messages):
+    """
+    Decrypt a batch of Message instances in one pass
+
+    Stores the plain text on each instance so ``Message.decrypted_text``
+    does not decrypt again while serializing.
+
+    Args:
+        messages: Iterable of Message instances
+    """
+    encrypted = [m for m in messages if m.is_encrypted and m.text_encrypted]
+    if not encrypted:
+        return
+    texts = get_encryptor().decrypt_many((m.pk, m.text_encrypted) for m in encrypted)
+    for message in encrypted:
+        message._decrypted = (message.text_encrypted, texts[message.pk])
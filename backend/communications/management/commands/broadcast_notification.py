@@ -0,0 +1,83 @@
+"""
+Django management command to send an announcement to a filtered audience.
+
+Recipients are streamed in batches through NotificationService.notify_many,
+so large audiences are written with bulk inserts:
+    python manage.py broadcast_notification --title "Maintenance" \\
+        --message "The site will be down at 22:00" --role agent --city Nairobi
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from accounts.roles import ROLE_AGENT, ROLE_USER
+from communications.notification_service import get_notification_service
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Send a notification to all users, or to agents/users, optionally limited to a city'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--title', required=True, help='Notification title')
+        parser.add_argument('--message', required=True, help='Notification body')
+        parser.add_argument(
+            '--type',
+            default='update',
+            help='Notification type (default: update)',
+        )
+        parser.add_argument(
+            '--role',
+            choices=['all', ROLE_AGENT, ROLE_USER],
+            default='all',
+            help='Audience: all active users, agents only or non-agent users only (default: all)',
+        )
+        parser.add_argument(
+            '--city',
+            help='Only users with a listing in this city (agents) or a visit booked there (users)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of notifications written per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the audience',
+        )
+
+    def get_audience(self, role, city):
+        users = User.objects.filter(is_active=True)
+        if role == ROLE_AGENT:
+            users = users.filter(groups__name=ROLE_AGENT)
+        elif role == ROLE_USER:
+            users = users.exclude(groups__name=ROLE_AGENT).exclude(is_superuser=True)
+        if city:
+            if role == ROLE_AGENT:
+                users = users.filter(properties__city__iexact=city)
+            elif role == ROLE_USER:
+                users = users.filter(visits_requested__property__city__iexact=city)
+            else:
+                users = users.filter(
+                    Q(properties__city__iexact=city) | Q(visits_requested__property__city__iexact=city)
+                )
+        return users.order_by('pk').values_list('pk', flat=True).distinct()
+
+    def handle(self, *args, **options):
+        audience = self.get_audience(options['role'], options['city'])
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'✓ Would notify {audience.count()} users'))
+            return
+
+        created = get_notification_service().notify_many(
+            audience,
+            title=options['title'],
+            message=options['message'],
+            notification_type=options['type'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Sent notification to {created} users'))
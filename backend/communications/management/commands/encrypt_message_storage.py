@@ -0,0 +1,94 @@
+"""
+Django management command to move messages to encrypted-only storage.
+
+Streams messages in primary key order, one batch per transaction:
+    - plaintext-only rows are encrypted
+    - legacy ciphertext (Fernet token wrapped in a second base64 layer) is
+      rewritten as the bare token
+    - ciphertext the current key cannot decrypt is re-encrypted from ``text``
+      when a plaintext copy exists, and the row is skipped otherwise
+    - the plaintext ``text`` column is cleared
+
+Safe to re-run; rows already in the compact format are left alone.
+    python manage.py encrypt_message_storage --batch-size 2000
+"""
+import binascii
+
+from cryptography.fernet import InvalidToken
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from communications.encryption import get_encryptor
+from communications.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Encrypt message plaintext, drop the redundant base64 layer and clear the plaintext column'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of messages read and written per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without writing',
+        )
+
+    def handle(self, *args, **options):
+        encryptor = get_encryptor()
+        batch_size = options['batch_size']
+        last_id = 0
+        scanned = rewritten = failed = 0
+
+        while True:
+            rows = list(
+                Message.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', 'text', 'text_encrypted', 'is_encrypted')[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            scanned += len(rows)
+
+            updates = []
+            for pk, text, text_encrypted, is_encrypted in rows:
+                if is_encrypted and text_encrypted:
+                    token = self._readable_token(encryptor, text_encrypted)
+                    if token is None:
+                        # Never clear the plaintext of a row we cannot decrypt
+                        if not text:
+                            failed += 1
+                            continue
+                        token = encryptor.encrypt(text)
+                elif text:
+                    token = encryptor.encrypt(text)
+                else:
+                    continue
+                if token == text_encrypted and not text:
+                    continue
+                updates.append(Message(pk=pk, text='', text_encrypted=token, is_encrypted=True))
+
+            if updates and not options['dry_run']:
+                with transaction.atomic():
+                    Message.objects.bulk_update(updates, ['text', 'text_encrypted', 'is_encrypted'])
+            rewritten += len(updates)
+
+        verb = 'Would rewrite' if options['dry_run'] else 'Rewrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Scanned {scanned} messages. {verb} {rewritten}, skipped {failed} with unreadable ciphertext'
+        ))
+
+    @staticmethod
+    def _readable_token(encryptor, text_encrypted):
+        """Bare Fernet token for stored ciphertext, or None if the current key cannot decrypt it"""
+        try:
+            token = encryptor.unwrap(text_encrypted)
+            encryptor.cipher.decrypt(token)
+        except (binascii.Error, InvalidToken, UnicodeEncodeError, ValueError):
+            return None
+        return token.decode('ascii')
@@ -0,0 +1,53 @@
+"""
+Django management command to send queued email, SMS and push notifications.
+Run under a process manager:
+    python manage.py process_notifications --loop --interval 2
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from communications.outbox import CHANNELS, process_due
+
+
+class Command(BaseCommand):
+    help = 'Send due notifications from the outbox, retrying failed deliveries with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep sending until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds between batches when running with --loop (default: 2)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Maximum number of deliveries claimed per channel per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--channel',
+            action='append',
+            choices=CHANNELS,
+            help='Only process this channel (repeatable; default: all channels)',
+        )
+
+    def handle(self, *args, **options):
+        channels = options['channel'] or CHANNELS
+        while True:
+            counts = process_due(limit=options['batch_size'], channels=channels)
+            if any(counts.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"✓ Sent {counts['sent']}, retrying {counts['retrying']}, failed {counts['failed']}"
+                ))
+            if not options['loop']:
+                break
+            # Drain a backlog without sleeping between full batches
+            if not any(counts.values()):
+                time.sleep(options['interval'])
@@ -0,0 +1,75 @@
+"""
+Single-hop send path for WebSocket chat messages.
+
+``send_chat_message`` does everything a new message needs from the
+database in one call and one transaction: it stores the Message (which
+bumps the recipient's read state) and creates its MessageNotification and
+Notification rows. It then returns the payloads to broadcast.
+
+Sender and recipient come from communications.connection_cache with
+profile and groups loaded, so building the payloads costs no queries.
+Email and push alerts are queued in the same transaction and sent by the
+outbox worker (see communications.outbox).
+"""
+from collections import namedtuple
+
+from django.db import transaction
+
+from . import connection_cache
+from .models import Conversation, Message, MessageNotification, Notification
+from .notification_service import get_notification_service
+from .serializers import MessageSerializer, NotificationSerializer
+
+SentMessage = namedtuple('SentMessage', ['message', 'payload', 'recipient', 'notification'])
+
+
+def send_chat_message(conversation_id, sender, text):
+    """
+    Persist ``text`` from ``sender`` in a conversation and build its broadcasts.
+
+    Returns a SentMessage with the Message, its serialized ``payload`` for the
+    chat group, the recipient, and the serialized Notification for the
+    recipient's notification group. The recipient's email/push alerts are
+    queued with the message. Returns None if the conversation no longer
+    exists or ``sender`` is not a participant.
+    """
+    participants = connection_cache.get_conversation(conversation_id)
+    if participants is None or sender.id not in (participants['user_id'], participants['agent_id']):
+        return None
+    recipient_id = participants['agent_id'] if participants['user_id'] == sender.id else participants['user_id']
+    recipient = connection_cache.get_user(recipient_id)
+    if recipient is None:
+        return None
+
+    # Signal handlers read message.conversation and its participants;
+    # hand them the cached users instead of letting them query.
+    conversation = Conversation(
+        id=conversation_id,
+        user=sender if participants['user_id'] == sender.id else recipient,
+        agent=sender if participants['agent_id'] == sender.id else recipient,
+        is_active=participants['is_active'],
+    )
+    sender_name = sender.get_full_name() or sender.username
+
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender=sender, text=text)
+        MessageNotification.objects.create(user=recipient, message=message, is_read=False)
+        notification = Notification.objects.create(
+            user=recipient,
+            type='message',
+            title=f"New Message from {sender_name}",
+            message=text[:100],
+            data={'sender_name': sender_name},
+            related_object_id=conversation_id,
+            related_object_type='conversation'
+        )
+        get_notification_service().queue_message_alerts(
+            recipient, sender_name, text[:100], channels=['push', 'email']
+        )
+
+    return SentMessage(
+        message=message,
+        payload=MessageSerializer(message).data,
+        recipient=recipient,
+        notification=NotificationSerializer(notification).data,
+    )
@@ -1,20 +1,21 @@
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
+from . import connection_cache
 
-User = get_user_model()
-
-@database_sync_to_async
-def get_user(token_key):
+async def get_user(token_key):
     try:
         access_token = AccessToken(token_key)
         user_id = access_token['user_id']
-        return User.objects.get(id=user_id)
-    except (InvalidToken, TokenError, User.DoesNotExist):
+    except (InvalidToken, TokenError, KeyError):
         return AnonymousUser()
+    # Reconnects within the cache TTL resolve the user without a DB round trip
+    user = connection_cache.cached_user(user_id)
+    if user is None:
+        user = await database_sync_to_async(connection_cache.get_user)(user_id)
+    return user or AnonymousUser()
 
 class JWTAuthMiddleware:
     """
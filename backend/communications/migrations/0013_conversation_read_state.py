@@ -0,0 +1,65 @@
+# Generated by Django 5.1 on 2026-10-17 03:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def backfill_read_states(apps, schema_editor):
+    Conversation = apps.get_model('communications', 'Conversation')
+    Message = apps.get_model('communications', 'Message')
+    ConversationReadState = apps.get_model('communications', 'ConversationReadState')
+
+    # Per (conversation, sender): unread messages and the latest read one
+    totals = {
+        (row['conversation_id'], row['sender_id']): row
+        for row in Message.objects.values('conversation_id', 'sender_id').annotate(
+            unread=Count('id', filter=Q(read_at__isnull=True)),
+            last_read=Max('id', filter=Q(read_at__isnull=False)),
+        ).order_by()
+    }
+
+    states = []
+    for conversation in Conversation.objects.only('id', 'user_id', 'agent_id').iterator(chunk_size=1000):
+        for reader_id, sender_id in (
+            (conversation.user_id, conversation.agent_id),
+            (conversation.agent_id, conversation.user_id),
+        ):
+            row = totals.get((conversation.id, sender_id), {})
+            states.append(ConversationReadState(
+                conversation_id=conversation.id,
+                user_id=reader_id,
+                unread_count=row.get('unread', 0),
+                last_read_message_id=row.get('last_read'),
+            ))
+        if len(states) >= 1000:
+            ConversationReadState.objects.bulk_create(states, ignore_conflicts=True)
+            states = []
+    ConversationReadState.objects.bulk_create(states, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0012_feed_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='communications.conversation')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='communications.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('conversation', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
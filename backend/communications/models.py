@@ -3,6 +3,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
 
 User = get_user_model()
@@ -28,10 +29,30 @@ class Conversation(models.Model):
         return f"Conversation: {self.user.username} - {self.agent.username} ({self.property.title if self.property else 'No Property'})"
 
 
+class PlaintextField(models.TextField):
+    """
+    Message plaintext column.
+
+    In encrypted-only mode an encrypted message is written with this column
+    blank, while the instance attribute keeps the text for post_save receivers
+    and callers.
+    """
+
+    def pre_save(self, model_instance, add):
+        if model_instance.is_encrypted and getattr(settings, 'MESSAGE_ENCRYPTED_ONLY', False):
+            return ''
+        return super().pre_save(model_instance, add)
+
+    def deconstruct(self):
+        # Storage is unchanged, so migrations keep seeing a plain TextField
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.TextField', args, kwargs
+
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
-    text = models.TextField()  # Legacy plaintext field
+    text = PlaintextField()  # Legacy plaintext field
     text_encrypted = models.TextField(null=True, blank=True)  # Encrypted message content
     is_encrypted = models.BooleanField(default=False)  # Flag to indicate if message is encrypted
     attachment = models.FileField(upload_to='message_attachments/', null=True, blank=True)
@@ -45,6 +66,10 @@ class Message(models.Model):
     class Meta:
         ordering = ['created_at']
         app_label = 'communications'
+        indexes = [
+            # Backs keyset pagination of message history
+            models.Index(fields=['conversation', 'created_at', 'id'], name='msg_conv_created_id_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         """Auto-encrypt message text on save"""
@@ -54,21 +79,29 @@ class Message(models.Model):
                 encryptor = get_encryptor()
                 self.text_encrypted = encryptor.encrypt(self.text)
                 self.is_encrypted = True
+                self._decrypted = (self.text_encrypted, self.text)
             except Exception as e:
                 # Log error but don't fail the save
                 import logging
                 logger = logging.getLogger(__name__)
                 logger.error(f"Failed to encrypt message: {e}")
+
         super().save(*args, **kwargs)
     
     @property
     def decrypted_text(self):
         """Get decrypted message text"""
         if self.is_encrypted and self.text_encrypted:
+            # Filled in bulk by communications.encryption.decrypt_messages
+            cached = getattr(self, '_decrypted', None)
+            if cached and cached[0] == self.text_encrypted:
+                return cached[1]
             try:
                 from .encryption import get_encryptor
                 encryptor = get_encryptor()
-                return encryptor.decrypt(self.text_encrypted)
+                text = encryptor.decrypt_many([(self.pk, self.text_encrypted)])[self.pk]
+                self._decrypted = (self.text_encrypted, text)
+                return text
             except Exception as e:
                 import logging
                 logger = logging.getLogger(__name__)
@@ -80,6 +113,30 @@ class Message(models.Model):
         return f"Message from {self.sender.username}"
 
 
+class ConversationReadState(models.Model):
+    """
+    Per-participant read position in a conversation.
+
+    ``unread_count`` is kept in step with messages from the other participant
+    whose ``read_at`` is unset (see communications.read_state), so inbox
+    badges are a lookup instead of a scan over Message.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_states')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'communications'
+        unique_together = ('conversation', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in conversation {self.conversation_id}: {self.unread_count} unread"
+
+
 class MessageNotification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='message_notifications')
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
@@ -114,8 +171,54 @@ class Notification(models.Model):
     class Meta:
         ordering = ['-created_at']
         app_label = 'communications'
+        indexes = [
+            # Backs keyset pagination of a user's notification feed
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.type}: {self.title}"
 
 
+
+
+class NotificationDelivery(models.Model):
+    """
+    Outbox row for one email, SMS or push notification.
+
+    Rows are written alongside the event that triggers them and sent by the
+    ``process_notifications`` worker (see communications.outbox), so request
+    and WebSocket latency never waits on third-party APIs.
+    """
+    CHANNEL_CHOICES = [
+        ('email', 'Email'),
+        ('sms', 'SMS'),
+        ('push', 'Push'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='notification_deliveries')
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=255)  # Email address, phone number or device token
+    content = models.JSONField()  # Keyword arguments for the channel's send()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'communications'
+        indexes = [
+            # Backs the worker's "due deliveries per channel" scan
+            models.Index(fields=['channel', 'status', 'next_attempt_at'], name='delivery_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} to {self.recipient} ({self.status})"
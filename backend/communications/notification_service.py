@@ -1,6 +1,8 @@
 """
 Notification services using third-party providers
 """
+import asyncio
+import itertools
 import os
 from typing import Optional, List
 from django.conf import settings
@@ -11,51 +13,65 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class ChannelUnavailable(Exception):
+    """A notification channel is not configured, so retrying cannot help"""
+
+
 class EmailNotificationService:
     """Send emails using SendGrid"""
     
+    channel = 'email'
+    
     @staticmethod
-    def send_message_notification(recipient_email: str, sender_name: str, message_preview: str):
-        """Send email notification for new message"""
-        try:
-            subject = f"New message from {sender_name}"
-            html_message = render_to_string('notifications/new_message.html', {
+    def message_notification(sender_name: str, message_preview: str) -> dict:
+        """Render the email for a new message"""
+        return {
+            'subject': f"New message from {sender_name}",
+            'body': f"New message from {sender_name}: {message_preview}",
+            'html_message': render_to_string('notifications/new_message.html', {
                 'sender_name': sender_name,
                 'message_preview': message_preview,
                 'action_url': f"{settings.FRONTEND_URL}/messages"
-            })
-            
-            send_mail(
-                subject,
-                f"New message from {sender_name}: {message_preview}",
-                settings.DEFAULT_FROM_EMAIL,
-                [recipient_email],
-                html_message=html_message,
-                fail_silently=True,
-            )
+            }),
+        }
+    
+    @staticmethod
+    def conversation_alert(property_title: str, participant_name: str) -> dict:
+        """Render the email for a new conversation"""
+        return {
+            'subject': f"New inquiry about {property_title}",
+            'body': f"New inquiry about {property_title} from {participant_name}",
+            'html_message': render_to_string('notifications/new_conversation.html', {
+                'property_title': property_title,
+                'participant_name': participant_name,
+                'action_url': f"{settings.FRONTEND_URL}/messages"
+            }),
+        }
+    
+    @staticmethod
+    def send(recipient_email: str, subject: str, body: str, html_message: Optional[str] = None):
+        """Send one rendered email; raises on failure"""
+        send_mail(
+            subject,
+            body,
+            settings.DEFAULT_FROM_EMAIL,
+            [recipient_email],
+            html_message=html_message,
+            fail_silently=False,
+        )
+    
+    def send_message_notification(self, recipient_email: str, sender_name: str, message_preview: str):
+        """Send email notification for new message"""
+        try:
+            self.send(recipient_email, **self.message_notification(sender_name, message_preview))
             logger.info(f"Email notification sent to {recipient_email}")
         except Exception as e:
             logger.error(f"Failed to send email notification: {e}")
     
-    @staticmethod
-    def send_conversation_alert(recipient_email: str, property_title: str, participant_name: str):
+    def send_conversation_alert(self, recipient_email: str, property_title: str, participant_name: str):
         """Send email alert for new conversation"""
         try:
-            subject = f"New inquiry about {property_title}"
-            html_message = render_to_string('notifications/new_conversation.html', {
-                'property_title': property_title,
-                'participant_name': participant_name,
-                'action_url': f"{settings.FRONTEND_URL}/messages"
-            })
-            
-            send_mail(
-                subject,
-                f"New inquiry about {property_title} from {participant_name}",
-                settings.DEFAULT_FROM_EMAIL,
-                [recipient_email],
-                html_message=html_message,
-                fail_silently=True,
-            )
+            self.send(recipient_email, **self.conversation_alert(property_title, participant_name))
             logger.info(f"Conversation alert sent to {recipient_email}")
         except Exception as e:
             logger.error(f"Failed to send conversation alert: {e}")
@@ -64,6 +80,8 @@ class EmailNotificationService:
 class SMSNotificationService:
     """Send SMS using Twilio"""
     
+    channel = 'sms'
+    
     def __init__(self):
         try:
             from twilio.rest import Client
@@ -76,37 +94,43 @@ class SMSNotificationService:
             logger.error(f"Failed to initialize Twilio: {e}")
             self.client = None
     
+    @staticmethod
+    def message_alert(sender_name: str, message_preview: str) -> dict:
+        """Render the SMS for a new message"""
+        return {'body': f"New message from {sender_name}: {message_preview[:50]}..."}
+    
+    @staticmethod
+    def conversation_alert(property_title: str) -> dict:
+        """Render the SMS for a new conversation"""
+        return {'body': f"New inquiry about {property_title}. Check SmartDalali app for details."}
+    
+    def send(self, phone_number: str, body: str):
+        """Send one SMS; raises on failure"""
+        if not self.client:
+            raise ChannelUnavailable("Twilio not configured")
+        self.client.messages.create(
+            body=body,
+            from_=self.from_number,
+            to=phone_number
+        )
+    
     def send_message_alert(self, phone_number: str, sender_name: str, message_preview: str):
         """Send SMS alert for new message"""
-        if not self.client:
-            logger.warning("Twilio not configured")
-            return
-        
         try:
-            message_body = f"New message from {sender_name}: {message_preview[:50]}..."
-            self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=phone_number
-            )
+            self.send(phone_number, **self.message_alert(sender_name, message_preview))
             logger.info(f"SMS sent to {phone_number}")
+        except ChannelUnavailable:
+            logger.warning("Twilio not configured")
         except Exception as e:
             logger.error(f"Failed to send SMS: {e}")
     
     def send_conversation_alert(self, phone_number: str, property_title: str):
         """Send SMS alert for new conversation"""
-        if not self.client:
-            logger.warning("Twilio not configured")
-            return
-        
         try:
-            message_body = f"New inquiry about {property_title}. Check SmartDalali app for details."
-            self.client.messages.create(
-                body=message_body,
-                from_=self.from_number,
-                to=phone_number
-            )
+            self.send(phone_number, **self.conversation_alert(property_title))
             logger.info(f"Conversation SMS sent to {phone_number}")
+        except ChannelUnavailable:
+            logger.warning("Twilio not configured")
         except Exception as e:
             logger.error(f"Failed to send SMS: {e}")
 
@@ -114,6 +138,8 @@ class SMSNotificationService:
 class PushNotificationService:
     """Send push notifications using Firebase"""
     
+    channel = 'push'
+    
     def __init__(self):
         try:
             import firebase_admin
@@ -126,50 +152,59 @@ class PushNotificationService:
             logger.error(f"Failed to initialize Firebase: {e}")
             self.messaging = None
     
+    @staticmethod
+    def message_notification(sender_name: str, message_preview: str) -> dict:
+        """Render the push notification for a new message"""
+        return {
+            'title': f"Message from {sender_name}",
+            'body': message_preview[:100],
+            'data': {
+                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
+                'type': 'message',
+            },
+        }
+    
+    @staticmethod
+    def conversation_notification(property_title: str, participant_name: str) -> dict:
+        """Render the push notification for a new conversation"""
+        return {
+            'title': "New inquiry",
+            'body': f"{participant_name} inquired about {property_title}",
+            'data': {
+                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
+                'type': 'conversation',
+                'property_title': property_title,
+            },
+        }
+    
+    def send(self, device_token: str, title: str, body: str, data: Optional[dict] = None):
+        """Send one push notification; raises on failure"""
+        if not self.messaging:
+            raise ChannelUnavailable("Firebase not configured")
+        message = self.messaging.Message(
+            notification=self.messaging.Notification(title=title, body=body),
+            data=data or {},
+            token=device_token,
+        )
+        return self.messaging.send(message)
+    
     def send_message_notification(self, device_token: str, sender_name: str, message_preview: str):
         """Send push notification for new message"""
-        if not self.messaging:
-            logger.warning("Firebase not configured")
-            return
-        
         try:
-            message = self.messaging.Message(
-                notification=self.messaging.Notification(
-                    title=f"Message from {sender_name}",
-                    body=message_preview[:100],
-                ),
-                data={
-                    'click_action': 'FLUTTER_NOTIFICATION_CLICK',
-                    'type': 'message',
-                },
-                token=device_token,
-            )
-            response = self.messaging.send(message)
+            response = self.send(device_token, **self.message_notification(sender_name, message_preview))
             logger.info(f"Push notification sent: {response}")
+        except ChannelUnavailable:
+            logger.warning("Firebase not configured")
         except Exception as e:
             logger.error(f"Failed to send push notification: {e}")
     
     def send_conversation_notification(self, device_token: str, property_title: str, participant_name: str):
         """Send push notification for new conversation"""
-        if not self.messaging:
-            logger.warning("Firebase not configured")
-            return
-        
         try:
-            message = self.messaging.Message(
-                notification=self.messaging.Notification(
-                    title=f"New inquiry",
-                    body=f"{participant_name} inquired about {property_title}",
-                ),
-                data={
-                    'click_action': 'FLUTTER_NOTIFICATION_CLICK',
-                    'type': 'conversation',
-                    'property_title': property_title,
-                },
-                token=device_token,
-            )
-            response = self.messaging.send(message)
+            response = self.send(device_token, **self.conversation_notification(property_title, participant_name))
             logger.info(f"Conversation push notification sent: {response}")
+        except ChannelUnavailable:
+            logger.warning("Firebase not configured")
         except Exception as e:
             logger.error(f"Failed to send conversation notification: {e}")
 
@@ -229,25 +264,87 @@ class NotificationService:
         except Exception as e:
             logger.error(f"Error creating DB notification: {e}")
 
-        # 3. Send External Notifications
+        # 3. Queue External Notifications
+        self.queue_message_alerts(user, sender_name, message_preview, channels)
+
+    def queue_message_alerts(
+        self,
+        user,
+        sender_name: str,
+        message_preview: str,
+        channels: Optional[List[str]] = None
+    ):
+        """
+        Queue the email/SMS/push part of a new-message notification
+        channels: ['email', 'sms', 'push']
+        """
+        if channels is None:
+            channels = ['email', 'push']
+
+        from communications.outbox import delivery, enqueue
+
+        deliveries = []
+        if 'email' in channels and user.email:
+            deliveries.append(delivery(
+                'email', user.email, self.email.message_notification(sender_name, message_preview), user
+            ))
+        if 'sms' in channels and hasattr(user, 'profile') and user.profile.phone_number:
+            deliveries.append(delivery(
+                'sms', user.profile.phone_number, self.sms.message_alert(sender_name, message_preview), user
+            ))
+        if 'push' in channels and hasattr(user, 'device_tokens'):
+            content = self.push.message_notification(sender_name, message_preview)
+            deliveries.extend(delivery('push', token.token, content, user) for token in user.device_tokens.all())
         try:
-            if 'email' in channels and user.email:
-                self.email.send_message_notification(
-                    user.email, sender_name, message_preview
-                )
-            
-            if 'sms' in channels and hasattr(user, 'profile') and user.profile.phone_number:
-                self.sms.send_message_alert(
-                    user.profile.phone_number, sender_name, message_preview
-                )
-            
-            if 'push' in channels and hasattr(user, 'device_tokens'):
-                for token in user.device_tokens.all():
-                    self.push.send_message_notification(
-                        token.token, sender_name, message_preview
-                    )
+            return enqueue(deliveries)
         except Exception as e:
-            logger.error(f"Error sending external notifications: {e}")
+            logger.error(f"Error queueing external notifications: {e}")
+            return []
+
+    def queue_conversation_alerts(
+        self,
+        user,
+        property_title: str,
+        participant_name: str,
+        channels: Optional[List[str]] = None
+    ):
+        """
+        Queue the email/SMS/push part of a new-conversation notification
+        channels: ['email', 'sms', 'push']
+        """
+        if channels is None:
+            channels = ['email', 'push']
+
+        from communications.outbox import delivery, enqueue
+
+        deliveries = []
+        if 'email' in channels and user.email:
+            deliveries.append(delivery(
+                'email', user.email, self.email.conversation_alert(property_title, participant_name), user
+            ))
+        if 'sms' in channels and hasattr(user, 'profile') and user.profile.phone_number:
+            deliveries.append(delivery(
+                'sms', user.profile.phone_number, self.sms.conversation_alert(property_title), user
+            ))
+        if 'push' in channels and hasattr(user, 'device_tokens'):
+            content = self.push.conversation_notification(property_title, participant_name)
+            deliveries.extend(delivery('push', token.token, content, user) for token in user.device_tokens.all())
+        try:
+            return enqueue(deliveries)
+        except Exception as e:
+            logger.error(f"Error queueing conversation notifications: {e}")
+            return []
+
+    def queue_sms(self, user, body: str):
+        """Queue a free-form SMS to ``user``'s profile phone number"""
+        from communications.outbox import delivery, enqueue
+
+        phone_number = user.profile.phone_number if hasattr(user, 'profile') else None
+        try:
+            return enqueue([delivery('sms', phone_number, {'body': body}, user)])
+        except Exception as e:
+            logger.error(f"Error queueing SMS: {e}")
+            return []
     
     def notify_new_conversation(
         self,
@@ -290,25 +387,8 @@ class NotificationService:
         except Exception as e:
              logger.error(f"Error creating DB notification: {e}")
         
-        try:
-            if 'email' in channels and user.email:
-                self.email.send_conversation_alert(
-                    user.email, property_title, participant_name
-                )
-            
-            if 'sms' in channels and hasattr(user, 'profile') and user.profile.phone_number:
-                self.sms.send_conversation_alert(
-                    user.profile.phone_number, property_title
-                )
-            
-            if 'push' in channels and hasattr(user, 'device_tokens'):
-                for token in user.device_tokens.all():
-                    self.push.send_conversation_notification(
-                        token.token, property_title, participant_name
-                    )
-        except Exception as e:
-            logger.error(f"Error sending conversation notifications: {e}")
-            
+        self.queue_conversation_alerts(user, property_title, participant_name, channels)
+
     def notify_generic(
         self,
         user,
@@ -352,6 +432,110 @@ class NotificationService:
             logger.error(f"Error sending generic notification: {e}")
             return None
 
+    def notify_many(
+        self,
+        users,
+        title: str,
+        message: str,
+        notification_type: str = 'update',
+        related_object_id: int = None,
+        related_object_type: str = None,
+        data: dict = None,
+        batch_size: int = 1000
+    ) -> int:
+        """
+        Send the same notification to many users
+
+        ``users`` may be users or user ids (a queryset of either is streamed).
+        Each batch is written with one bulk_create. The notification is
+        serialized once, and only users with a live notification socket are
+        sent the real-time update, with those sends issued concurrently.
+        Returns the number of notifications created.
+        """
+        from communications.models import Notification
+        from communications.presence import online_users
+        from communications.serializers import NotificationSerializer
+
+        serializer = NotificationSerializer()
+        template = serializer.to_representation(Notification(
+            type=notification_type,
+            title=title,
+            message=message,
+            related_object_id=related_object_id,
+            related_object_type=related_object_type,
+            data=data
+        ))
+        created_at_field = serializer.fields['created_at']
+
+        if hasattr(users, 'iterator'):
+            users = users.iterator(chunk_size=batch_size)
+        user_ids = (getattr(user, 'pk', user) for user in users)
+
+        created = 0
+        while True:
+            batch = list(itertools.islice(user_ids, batch_size))
+            if not batch:
+                break
+            try:
+                notifications = Notification.objects.bulk_create([
+                    Notification(
+                        user_id=user_id,
+                        type=notification_type,
+                        title=title,
+                        message=message,
+                        related_object_id=related_object_id,
+                        related_object_type=related_object_type,
+                        data=data
+                    )
+                    for user_id in batch
+                ])
+            except Exception as e:
+                logger.error(f"Error creating bulk notifications: {e}")
+                continue
+            created += len(notifications)
+
+            online = online_users(batch)
+            self.broadcast_many([
+                (
+                    f"notifications_{n.user_id}",
+                    {
+                        "type": "notification.message",
+                        "message": {
+                            **template,
+                            'id': str(n.id),
+                            'user': n.user_id,
+                            'created_at': created_at_field.to_representation(n.created_at),
+                        }
+                    }
+                )
+                for n in notifications if n.user_id in online
+            ])
+        return created
+
+    @staticmethod
+    def broadcast_many(events):
+        """Send (group, event) pairs through the channel layer concurrently"""
+        from channels.layers import get_channel_layer
+        from asgiref.sync import async_to_sync
+
+        channel_layer = get_channel_layer()
+        if not channel_layer or not events:
+            return
+
+        async def send_all():
+            results = await asyncio.gather(
+                *(channel_layer.group_send(group, event) for group, event in events),
+                return_exceptions=True
+            )
+            failures = [r for r in results if isinstance(r, Exception)]
+            if failures:
+                logger.error(f"Failed to broadcast {len(failures)} of {len(events)} notifications: {failures[0]}")
+
+        try:
+            async_to_sync(send_all)()
+        except Exception as e:
+            logger.error(f"Error broadcasting notifications: {e}")
+
 
 # Singleton instance
 _notification_service = None
@@ -0,0 +1,142 @@
+"""
+Durable outbox for email, SMS and push notifications.
+
+Callers render the notification and ``enqueue`` a NotificationDelivery row
+per recipient and channel, in the same transaction as the event that
+triggered it. ``process_due`` (run by the ``process_notifications`` worker
+declared in ``Procfile``) claims due rows per channel and sends them. Nothing
+is delivered unless that worker runs. Each channel gets its own thread pool
+sized by ``NOTIFICATION_CHANNEL_CONCURRENCY``, so a slow SMS provider cannot
+starve email.
+
+Failed sends are retried with exponential backoff and jitter, up to
+``NOTIFICATION_MAX_ATTEMPTS``. Channels that are not configured fail at
+once. A claimed row is leased for ``CLAIM_LEASE`` seconds, and rows left
+behind by a crashed worker become due again when the lease runs out.
+"""
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import NotificationDelivery
+from .notification_service import ChannelUnavailable, get_notification_service
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('email', 'sms', 'push')
+CLAIM_LEASE = 300
+DEFAULT_CONCURRENCY = {'email': 4, 'sms': 2, 'push': 8}
+
+
+def _concurrency(channel):
+    return getattr(settings, 'NOTIFICATION_CHANNEL_CONCURRENCY', DEFAULT_CONCURRENCY).get(channel, 1)
+
+
+def _max_attempts():
+    return getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 6)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before retry number ``attempts`` (exponential, with jitter)"""
+    base = getattr(settings, 'NOTIFICATION_RETRY_BASE_SECONDS', 30)
+    cap = getattr(settings, 'NOTIFICATION_RETRY_MAX_SECONDS', 3600)
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def delivery(channel, recipient, content, user=None):
+    """Build an unsaved delivery of rendered ``content`` to ``recipient``"""
+    return NotificationDelivery(user=user, channel=channel, recipient=recipient, content=content)
+
+
+def enqueue(deliveries):
+    """Save deliveries for the worker; skips any without a recipient"""
+    deliveries = [d for d in deliveries if d.recipient]
+    if deliveries:
+        NotificationDelivery.objects.bulk_create(deliveries)
+    return deliveries
+
+
+def _claim(channel, limit):
+    """Atomically take up to ``limit`` due deliveries of ``channel``"""
+    now = timezone.now()
+    due = Q(status='pending') | Q(status='sending')  # 'sending' rows are due once their lease expires
+    with transaction.atomic():
+        ids = list(
+            NotificationDelivery.objects.select_for_update(skip_locked=True)
+            .filter(due, channel=channel, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        NotificationDelivery.objects.filter(id__in=ids).update(
+            status='sending', next_attempt_at=now + timedelta(seconds=CLAIM_LEASE)
+        )
+    return list(NotificationDelivery.objects.filter(id__in=ids))
+
+
+def _send(service, item):
+    try:
+        service.send(item.recipient, **item.content)
+        return None
+    except Exception as e:
+        return e
+
+
+def _record(item, error):
+    now = timezone.now()
+    if error is None:
+        item.status = 'sent'
+        item.sent_at = now
+        item.last_error = ''
+    else:
+        item.attempts += 1
+        item.last_error = f"{type(error).__name__}: {error}"
+        if isinstance(error, ChannelUnavailable) or item.attempts >= _max_attempts():
+            item.status = 'failed'
+            logger.error(f"Giving up on {item.channel} delivery {item.id}: {item.last_error}")
+        else:
+            item.status = 'pending'
+            item.next_attempt_at = now + timedelta(seconds=retry_delay(item.attempts))
+            logger.warning(f"Retrying {item.channel} delivery {item.id} later: {item.last_error}")
+    return item
+
+
+def process_due(limit=100, channels=CHANNELS):
+    """
+    Send up to ``limit`` due deliveries per channel
+
+    Returns:
+        Dict of ``{'sent': n, 'retrying': n, 'failed': n}``
+    """
+    service = get_notification_service()
+    batches = {channel: _claim(channel, limit) for channel in channels}
+    pools = {
+        channel: ThreadPoolExecutor(max_workers=_concurrency(channel))
+        for channel, items in batches.items() if items
+    }
+    try:
+        # Channels send concurrently, each within its own limit
+        futures = [
+            (item, pools[channel].submit(_send, getattr(service, channel), item))
+            for channel, items in batches.items() for item in items
+        ]
+        finished = [_record(item, future.result()) for item, future in futures]
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    if finished:
+        NotificationDelivery.objects.bulk_update(
+            finished, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+    for item in finished:
+        counts['retrying' if item.status == 'pending' else item.status] += 1
+    return counts
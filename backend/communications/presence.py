@@ -0,0 +1,173 @@
+"""
+Online presence for WebSocket users.
+
+Each open notification socket is a *connection* of its user. A user is
+online while at least one connection has sent a heartbeat within
+``PRESENCE_TTL`` seconds, so several tabs count once and a crashed worker's
+sockets expire on their own instead of leaving users online forever.
+
+- With ``REDIS_URL`` set, connections live in one sorted set per user
+  (member = channel name, score = expiry time), shared by every ASGI worker.
+- Without Redis, an in-process store is used instead.
+
+``connect`` and ``disconnect`` report whether the user went online or
+offline. Only those transitions are broadcast, once, to the user's
+``presence_<id>`` group, which chats with that user subscribe to. Nothing is
+written to the database.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CONNECTIONS_KEY = 'presence:user:{}'
+
+
+def presence_ttl():
+    return getattr(settings, 'PRESENCE_TTL', 60)
+
+
+def presence_group(user_id):
+    """Channel-layer group that receives ``user_status`` events for ``user_id``."""
+    return f'presence_{user_id}'
+
+
+class LocalPresenceStore:
+    """Thread-safe in-process store used when Redis is not configured."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def _live(self, user_id, now):
+        connections = self._connections.get(user_id, {})
+        for connection_id, expires_at in list(connections.items()):
+            if expires_at <= now:
+                del connections[connection_id]
+        if not connections:
+            self._connections.pop(user_id, None)
+        return connections
+
+    def connect(self, user_id, connection_id, ttl):
+        now = time.monotonic()
+        with self._lock:
+            was_online = bool(self._live(user_id, now))
+            self._connections.setdefault(user_id, {})[connection_id] = now + ttl
+            return not was_online
+
+    def disconnect(self, user_id, connection_id):
+        now = time.monotonic()
+        with self._lock:
+            connections = self._live(user_id, now)
+            if connections.pop(connection_id, None) is None:
+                return False
+            return not self._live(user_id, now)
+
+    def online(self, user_ids):
+        now = time.monotonic()
+        with self._lock:
+            return {user_id for user_id in user_ids if self._live(user_id, now)}
+
+
+class RedisPresenceStore:
+    """Store shared by all workers, backed by one sorted set per user."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def connect(self, user_id, connection_id, ttl):
+        now = time.time()
+        key = CONNECTIONS_KEY.format(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zcard(key)
+        pipe.zadd(key, {connection_id: now + ttl})
+        pipe.expire(key, int(ttl) + 1)
+        _, live_before, _, _ = pipe.execute()
+        return live_before == 0
+
+    def disconnect(self, user_id, connection_id):
+        now = time.time()
+        key = CONNECTIONS_KEY.format(user_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zrem(key, connection_id)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zcard(key)
+        removed, _, live_after = pipe.execute()
+        return bool(removed) and live_after == 0
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(CONNECTIONS_KEY.format(user_id), now, '+inf')
+        return {user_id for user_id, live in zip(user_ids, pipe.execute()) if live}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_presence_store():
+    """Return the process-wide presence store (Redis when configured)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
+
+
+def _create_store():
+    if getattr(settings, 'REDIS_URL', None):
+        try:
+            from django_redis import get_redis_connection
+            return RedisPresenceStore(get_redis_connection('default'))
+        except Exception as e:
+            logger.warning(f"Redis presence store unavailable, using in-process store: {e}")
+    return LocalPresenceStore()
+
+
+def connect(user_id, connection_id):
+    """Register a connection; returns True if ``user_id`` just came online."""
+    try:
+        return get_presence_store().connect(user_id, connection_id, presence_ttl())
+    except Exception as e:
+        logger.error(f"Failed to record presence for user {user_id}: {e}")
+        return False
+
+
+def heartbeat(user_id, connection_id):
+    """
+    Keep a connection alive for another ``PRESENCE_TTL`` seconds.
+
+    Re-registers connections that already expired (e.g. a stalled worker),
+    returning True if that brought ``user_id`` back online.
+    """
+    return connect(user_id, connection_id)
+
+
+def disconnect(user_id, connection_id):
+    """Drop a connection; returns True if ``user_id`` just went offline."""
+    try:
+        return get_presence_store().disconnect(user_id, connection_id)
+    except Exception as e:
+        logger.error(f"Failed to clear presence for user {user_id}: {e}")
+        return False
+
+
+def is_online(user_id):
+    return user_id in online_users([user_id])
+
+
+def online_users(user_ids):
+    """Return the subset of ``user_ids`` that currently have a live connection."""
+    try:
+        return get_presence_store().online(user_ids)
+    except Exception as e:
+        logger.error(f"Failed to read presence: {e}")
+        return set()
@@ -0,0 +1,106 @@
+"""
+Maintenance of ConversationReadState counters.
+
+Every change goes through a single conditional UPDATE with F() expressions,
+so concurrent senders and readers never lose increments:
+
+- a new message increments the recipient's ``unread_count``;
+- marking messages read sets ``read_at`` and decrements the counter by the
+  number of rows that actually changed, moving ``last_read_message`` forward.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import ConversationReadState, Message
+
+
+def _other_participant_id(conversation, user_id):
+    return conversation.agent_id if conversation.user_id == user_id else conversation.user_id
+
+
+def ensure_read_states(conversation):
+    """Create the read-state rows for both participants of ``conversation``."""
+    ConversationReadState.objects.bulk_create(
+        [
+            ConversationReadState(conversation=conversation, user_id=conversation.user_id),
+            ConversationReadState(conversation=conversation, user_id=conversation.agent_id),
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _update_state(conversation_id, user_id, **changes):
+    updated = ConversationReadState.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    ).update(**changes)
+    if updated:
+        return
+    # Conversations created before read states existed get their row lazily
+    try:
+        with transaction.atomic():
+            ConversationReadState.objects.create(conversation_id=conversation_id, user_id=user_id)
+    except IntegrityError:
+        pass
+    ConversationReadState.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    ).update(**changes)
+
+
+def record_new_message(message):
+    """Count ``message`` as unread for the participant who didn't send it."""
+    recipient_id = _other_participant_id(message.conversation, message.sender_id)
+    _update_state(message.conversation_id, recipient_id, unread_count=F('unread_count') + 1)
+
+
+def _mark_read(conversation, user, messages, now=None):
+    unread = messages.filter(read_at__isnull=True).exclude(sender=user)
+    last_read_id = unread.aggregate(last=Max('id'))['last']
+    marked = unread.update(read_at=now or timezone.now())
+    if not marked:
+        return 0
+    _update_state(
+        conversation.id,
+        user.id,
+        unread_count=Greatest(F('unread_count') - marked, Value(0)),
+        last_read_message_id=Greatest(Coalesce(F('last_read_message_id'), Value(0)), Value(last_read_id)),
+    )
+    return marked
+
+
+def mark_conversation_read(conversation, user):
+    """Mark every message ``user`` received in ``conversation`` as read."""
+    return _mark_read(conversation, user, conversation.messages.all())
+
+
+def mark_messages_read(conversation, user, messages):
+    """
+    Mark the given Message instances ``user`` received in ``conversation`` as
+    read, setting ``read_at`` on the instances too.
+    """
+    now = timezone.now()
+    received = [m for m in messages if m.read_at is None and m.sender_id != user.id]
+    if not received:
+        return 0
+    marked = _mark_read(conversation, user, conversation.messages.filter(pk__in=[m.pk for m in received]), now)
+    for message in received:
+        message.read_at = now
+    return marked
+
+
+def mark_read_up_to(conversation, user, message_id):
+    """Mark every message ``user`` received in ``conversation`` up to ``message_id`` as read."""
+    return _mark_read(conversation, user, conversation.messages.filter(pk__lte=message_id))
+
+
+def mark_message_read(message, user):
+    """Mark a single received message as read; returns True if it changed."""
+    return bool(_mark_read(message.conversation, user, Message.objects.filter(pk=message.pk)))
+
+
+def unread_total(user, **filters):
+    """Total unread messages for ``user`` across conversations matching ``filters``."""
+    return ConversationReadState.objects.filter(user=user, **filters).aggregate(
+        total=Sum('unread_count')
+    )['total'] or 0
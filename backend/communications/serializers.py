@@ -1,5 +1,8 @@
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
-from .models import Conversation, Message, MessageNotification, Notification
+from .encryption import decrypt_messages
+from .models import Conversation, ConversationReadState, Message, MessageNotification, Notification
 from accounts.models import Profile
 from accounts.roles import get_user_role
 
@@ -9,11 +12,21 @@ from accounts.roles import get_user_role
 class MinimalMessageSerializer(serializers.ModelSerializer):
     """Minimal serializer for reply_to field"""
     sender_name = serializers.CharField(source='sender.username', read_only=True)
+    text = serializers.CharField(source='decrypted_text', read_only=True)
     
     class Meta:
         model = Message
         fields = ['id', 'sender_name', 'text', 'attachment', 'created_at']
 
+class MessageListSerializer(serializers.ListSerializer):
+    """Decrypts the whole page of messages in one batch before serializing"""
+
+    def to_representation(self, data):
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        decrypt_messages(messages)
+        return super().to_representation(messages)
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender_name = serializers.CharField(source='sender.username', read_only=True)
     sender_role = serializers.SerializerMethodField()
@@ -27,6 +40,7 @@ class MessageSerializer(serializers.ModelSerializer):
         model = Message
         fields = ['id', 'sender', 'sender_name', 'sender_role', 'sender_avatar', 'text', 'attachment', 'read_at', 'is_deleted', 'created_at', 'reply_to', 'reply_to_id']
         read_only_fields = ['sender', 'read_at', 'is_deleted', 'created_at']
+        list_serializer_class = MessageListSerializer
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -88,6 +102,39 @@ class ConversationSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['user', 'agent', 'created_at', 'updated_at']
     
+    @staticmethod
+    def prepare_inbox_queryset(queryset, user):
+        """
+        Annotate and prefetch everything the serializer reads for ``user``.
+
+        Adds the unread count (from ConversationReadState), the property's first image
+        (Subquery) and the latest message not hidden by ``user`` (one sliced
+        prefetch for all conversations), so listing an inbox costs a constant
+        number of queries regardless of how many conversations it holds.
+        """
+        from properties.models import MediaProperty
+
+        first_image = MediaProperty.objects.filter(
+            property=OuterRef('property_id')
+        ).order_by('id').values('Images')[:1]
+        unread_count = ConversationReadState.objects.filter(
+            conversation=OuterRef('pk'), user=user
+        ).values('unread_count')[:1]
+        last_message = Message.objects.exclude(hidden_by=user).select_related(
+            'sender'
+        ).order_by('-created_at', '-id')[:1]
+
+        return queryset.select_related(
+            'user__profile', 'agent__profile', 'property'
+        ).prefetch_related(
+            'user__groups',
+            'agent__groups',
+            Prefetch('messages', queryset=last_message, to_attr='prefetched_last_message'),
+        ).annotate(
+            annotated_unread_count=Coalesce(Subquery(unread_count), 0),
+            annotated_property_image=Subquery(first_image),
+        )
+
     def get_other_participant(self, obj):
         request = self.context.get('request')
         if request and request.user:
@@ -103,17 +150,18 @@ class ConversationSerializer(serializers.ModelSerializer):
         return None
     
     def get_last_message(self, obj):
-        # We need to optimize this to avoid N+1 queries ideally, but for now logic:
-        request = self.context.get('request')
-        qs = obj.messages.all()
-        if request and request.user:
-            qs = qs.exclude(hidden_by=request.user)
-            
-        last_msg = qs.order_by('-created_at').first()
+        if hasattr(obj, 'prefetched_last_message'):
+            last_msg = obj.prefetched_last_message[0] if obj.prefetched_last_message else None
+        else:
+            request = self.context.get('request')
+            qs = obj.messages.all()
+            if request and request.user:
+                qs = qs.exclude(hidden_by=request.user)
+            last_msg = qs.order_by('-created_at').first()
         if last_msg:
             return {
                 'id': last_msg.id,
-                'text': last_msg.text,
+                'text': last_msg.decrypted_text,
                 'sender_id': last_msg.sender.id,
                 'sender_name': last_msg.sender.username,
                 'created_at': last_msg.created_at,
@@ -122,14 +170,14 @@ class ConversationSerializer(serializers.ModelSerializer):
         return None
     
     def get_unread_count(self, obj):
+        if hasattr(obj, 'annotated_unread_count'):
+            return obj.annotated_unread_count
         request = self.context.get('request')
         if request and request.user:
-            # Assuming is_read boolean exists on Message, wait, I removed it in models refactor above?
-            # User requirement: Message(id, conversation, sender, text, attachment, created_at, read_at)
-            # So I should filter by read_at__isnull=True.
-            # But wait, MessageNotification also exists.
-            # Let's check Message model again. I put read_at.
-            # I will use read_at logic.
+            # Read-state counter; count messages for conversations without one
+            state = obj.read_states.filter(user=request.user).first()
+            if state is not None:
+                return state.unread_count
             return obj.messages.filter(read_at__isnull=True).exclude(sender=request.user).count()
         return 0
     
@@ -138,6 +186,14 @@ class ConversationSerializer(serializers.ModelSerializer):
         if not obj.property:
             return None
         
+        if hasattr(obj, 'annotated_property_image'):
+            if not obj.annotated_property_image:
+                return None
+            from properties.models import MediaProperty
+            url = MediaProperty._meta.get_field('Images').storage.url(obj.annotated_property_image)
+            request = self.context.get('request')
+            return request.build_absolute_uri(url) if request else url
+        
         try:
             # Get first MediaProperty image
             first_media = obj.property.MediaProperty.first()
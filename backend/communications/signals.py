@@ -2,7 +2,8 @@
 Django signals for Twilio notification triggers
 Handles event-based SMS/WhatsApp notifications
 """
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta
@@ -13,6 +14,36 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+@receiver([post_save, post_delete], sender=get_user_model())
+def forget_cached_user(sender, instance, **kwargs):
+    """Drop the WebSocket handshake cache entry of a changed user"""
+    from .connection_cache import forget_user
+    forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Conversation)
+def forget_cached_conversation(sender, instance, **kwargs):
+    """Drop the WebSocket membership cache entry of a changed conversation"""
+    from .connection_cache import forget_conversation
+    forget_conversation(instance.pk)
+
+
+@receiver(post_save, sender=Conversation)
+def create_read_states(sender, instance, created, **kwargs):
+    """Give both participants a read-state row when a conversation starts"""
+    if created:
+        from .read_state import ensure_read_states
+        ensure_read_states(instance)
+
+
+@receiver(post_save, sender=Message)
+def count_unread_message(sender, instance, created, **kwargs):
+    """Increment the recipient's unread counter for every new message"""
+    if created:
+        from .read_state import record_new_message
+        record_new_message(instance)
+
+
 @receiver(post_save, sender=Message)
 def trigger_twilio_on_new_message(sender, instance, created, **kwargs):
     """
@@ -32,13 +63,14 @@ def trigger_twilio_on_new_message(sender, instance, created, **kwargs):
             recipient.profile.phone_number and 
             getattr(recipient.profile, 'sms_notifications_enabled', False)):
             
-            # Send SMS notification
-            notification_service.sms.send_message_alert(
-                recipient.profile.phone_number,
+            # Queue SMS notification for the outbox worker
+            notification_service.queue_message_alerts(
+                recipient,
                 instance.sender.get_full_name() or instance.sender.username,
-                instance.text[:100]
+                instance.text[:100],
+                channels=['sms']
             )
-            logger.info(f"Twilio SMS sent to {recipient.username} for message {instance.id}")
+            logger.info(f"Twilio SMS queued for {recipient.username} for message {instance.id}")
     
     except Exception as e:
         logger.error(f"Error sending Twilio notification: {e}")
@@ -66,11 +98,11 @@ def trigger_twilio_on_new_conversation(sender, instance, created, **kwargs):
                 getattr(participant.profile, 'sms_notifications_enabled', False)):
                 
                 property_title = instance.property.title if instance.property else "a property"
-                notification_service.sms.send_conversation_alert(
-                    participant.profile.phone_number,
-                    property_title
+                notification_service.queue_sms(
+                    participant,
+                    notification_service.sms.conversation_alert(property_title)['body']
                 )
-                logger.info(f"Twilio conversation alert sent to {participant.username}")
+                logger.info(f"Twilio conversation alert queued for {participant.username}")
     
     except Exception as e:
         logger.error(f"Error sending Twilio conversation alert: {e}")
@@ -114,12 +146,10 @@ def check_agent_response_timeout():
                 property_title = conversation.property.title if conversation.property else "a property"
                 message = f"⚠️ Urgent: User waiting for response on {property_title}. Reply now!"
                 
-                notification_service.sms.send_message_alert(
-                    participant.profile.phone_number,
-                    "SmartDalali Alert",
-                    message
+                notification_service.queue_message_alerts(
+                    participant, "SmartDalali Alert", message, channels=['sms']
                 )
-                logger.info(f"Timeout alert sent to agent {participant.username}")
+                logger.info(f"Timeout alert queued for agent {participant.username}")
 
 
 def send_booking_confirmation(user, booking_details):
@@ -142,12 +172,8 @@ def send_booking_confirmation(user, booking_details):
                 f"See you there!"
             )
             
-            notification_service.sms.send_message_alert(
-                user.profile.phone_number,
-                "SmartDalali",
-                message
-            )
-            logger.info(f"Booking confirmation sent to {user.username}")
+            notification_service.queue_message_alerts(user, "SmartDalali", message, channels=['sms'])
+            logger.info(f"Booking confirmation queued for {user.username}")
     
     except Exception as e:
         logger.error(f"Error sending booking confirmation: {e}")
@@ -166,12 +192,8 @@ def send_price_negotiation_alert(user, property_title, offer_amount):
             
             message = f"💰 New offer on {property_title}: {offer_amount}. Check app for details."
             
-            notification_service.sms.send_message_alert(
-                user.profile.phone_number,
-                "SmartDalali",
-                message
-            )
-            logger.info(f"Price negotiation alert sent to {user.username}")
+            notification_service.queue_message_alerts(user, "SmartDalali", message, channels=['sms'])
+            logger.info(f"Price negotiation alert queued for {user.username}")
     
     except Exception as e:
         logger.error(f"Error sending price negotiation alert: {e}")
@@ -237,10 +259,8 @@ def notify_on_visit_change(sender, instance, created, **kwargs):
                  # Send Email/SMS if needed
                 if notification_service:
                     # Generic alert or specific visit status alert
-                     notification_service.sms.send_message_alert(
-                        target_user.profile.phone_number if hasattr(target_user, 'profile') else None,
-                        "SmartDalali",
-                        message
+                     notification_service.queue_message_alerts(
+                        target_user, "SmartDalali", message, channels=['sms']
                     )
 
             elif instance.status == 'cancelled':
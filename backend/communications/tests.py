@@ -3,7 +3,7 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
-from communications.models import Conversation, Message
+from communications.models import Conversation, Message, Notification
 from accounts.models import Profile
 
 class CommunicationsViewTests(TestCase):
@@ -49,7 +49,7 @@ class CommunicationsViewTests(TestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Message.objects.count(), 1)
-        self.assertEqual(Message.objects.first().text, 'Hello Agent')
+        self.assertEqual(Message.objects.first().decrypted_text, 'Hello Agent')
 
     def test_get_messages(self):
         # Create some messages
@@ -78,3 +78,140 @@ class CommunicationsViewTests(TestCase):
         response = self.client.get(url)
         # View catches Http404/Exception and returns 400
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_notification_cursor_pagination(self):
+        for index in range(3):
+            Notification.objects.create(user=self.user, title=f"N{index}", message="m", type="update")
+        Notification.objects.create(user=self.agent, title="Other", message="m", type="update")
+
+        self.client.force_authenticate(user=self.user)
+        url = reverse('notification-list')
+        first = self.client.get(url, {'cursor': '', 'page_size': 2})
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual([n['title'] for n in first.data['results']], ['N2', 'N1'])
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual([n['title'] for n in second.data['results']], ['N0'])
+        self.assertIsNone(second.data['next'])
+
+        # Limit/offset clients are unaffected
+        legacy = self.client.get(url)
+        self.assertEqual(legacy.data['count'], 3)
+
+    def _seed_inbox(self, count):
+        for index in range(count):
+            other = User.objects.create_user(username=f'client{Conversation.objects.count()}')
+            conversation = Conversation.objects.create(user=other, agent=self.agent)
+            Message.objects.create(conversation=conversation, sender=other, text=f'Hello {index}')
+            Message.objects.create(conversation=conversation, sender=other, text=f'Latest {index}')
+
+    def test_conversation_list_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.force_authenticate(user=self.agent)
+        url = reverse('conversation-list')
+        self._seed_inbox(2)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self._seed_inbox(8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+        inbox = {item['id']: item for item in response.data}
+        latest = Conversation.objects.exclude(pk=self.conversation.pk).order_by('-id').first()
+        self.assertEqual(inbox[latest.id]['unread_count'], 2)
+        self.assertEqual(inbox[latest.id]['last_message']['text'], 'Latest 7')
+        self.assertEqual(inbox[latest.id]['other_participant']['role'], 'user')
+        self.assertIsNone(inbox[self.conversation.id]['last_message'])
+
+    def test_conversation_list_cursor_pagination(self):
+        self._seed_inbox(3)
+        self.client.force_authenticate(user=self.agent)
+        url = reverse('conversation-list')
+
+        first = self.client.get(url, {'cursor': '', 'page_size': 3})
+        self.assertEqual(len(first.data['results']), 3)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertIsNone(second.data['next'])
+        seen = [c['id'] for c in first.data['results'] + second.data['results']]
+        self.assertEqual(sorted(seen), sorted(Conversation.objects.values_list('id', flat=True)))
+
+    def test_read_state_tracks_unread_messages(self):
+        from communications.models import ConversationReadState
+
+        first = Message.objects.create(conversation=self.conversation, sender=self.agent, text="One")
+        Message.objects.create(conversation=self.conversation, sender=self.agent, text="Two")
+        Message.objects.create(conversation=self.conversation, sender=self.user, text="Reply")
+
+        state = ConversationReadState.objects.get(conversation=self.conversation, user=self.user)
+        self.assertEqual(state.unread_count, 2)
+        self.assertEqual(
+            ConversationReadState.objects.get(conversation=self.conversation, user=self.agent).unread_count, 1
+        )
+
+        self.client.force_authenticate(user=self.user)
+        self.client.post(reverse('message-mark-read', args=[first.id]))
+        state.refresh_from_db()
+        self.assertEqual((state.unread_count, state.last_read_message_id), (1, first.id))
+
+        self.client.post(reverse('conversation-mark-read', args=[self.conversation.id]))
+        state.refresh_from_db()
+        self.assertEqual(state.unread_count, 0)
+        self.assertEqual(self.client.get(reverse('conversation-unread-count')).data['unread_count'], 0)
+        inbox = self.client.get(reverse('conversation-list')).data
+        self.assertEqual(inbox[0]['unread_count'], 0)
+
+    def test_message_history_windows(self):
+        from communications.models import ConversationReadState
+
+        messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.agent, text=f"Message {i}")
+            for i in range(7)
+        ]
+        self.client.force_authenticate(user=self.user)
+        url = reverse('conversation-messages', args=[self.conversation.id])
+
+        latest = self.client.get(url, {'limit': 3})
+        self.assertEqual([m['text'] for m in latest.data], ['Message 4', 'Message 5', 'Message 6'])
+        self.assertEqual(latest['X-Has-More'], 'true')
+        self.assertTrue(all(m['read_at'] for m in latest.data))
+        # Only the returned window is marked read
+        state = ConversationReadState.objects.get(conversation=self.conversation, user=self.user)
+        self.assertEqual(state.unread_count, 4)
+
+        older = self.client.get(url, {'limit': 3, 'before': latest.data[0]['id']})
+        self.assertEqual([m['text'] for m in older.data], ['Message 1', 'Message 2', 'Message 3'])
+        oldest = self.client.get(url, {'limit': 3, 'before': older.data[0]['id']})
+        self.assertEqual([m['text'] for m in oldest.data], ['Message 0'])
+        self.assertEqual(oldest['X-Has-More'], 'false')
+
+        newer = self.client.get(url, {'since': messages[4].id})
+        self.assertEqual([m['text'] for m in newer.data], ['Message 5', 'Message 6'])
+        self.assertEqual(newer['X-Has-More'], 'false')
+
+        self.assertEqual(self.client.get(url, {'before': 1, 'since': 1}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'before': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_message_history_query_count_is_independent_of_length(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.force_authenticate(user=self.user)
+        url = reverse('conversation-messages', args=[self.conversation.id])
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, sender=self.user, text=f"Mine {i}")
+        with CaptureQueriesContext(connection) as short:
+            self.client.get(url, {'limit': 5})
+
+        for i in range(40):
+            Message.objects.create(conversation=self.conversation, sender=self.user, text=f"Mine {i}")
+        with CaptureQueriesContext(connection) as long:
+            response = self.client.get(url, {'limit': 5})
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(len(long.captured_queries), len(short.captured_queries))
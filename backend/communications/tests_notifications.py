@@ -0,0 +1,201 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Profile
+from communications import outbox
+from communications.models import Conversation, NotificationDelivery
+from communications.notification_service import ChannelUnavailable
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', email='user1@test.com', password='testpassword123')
+        self.agent = User.objects.create_user(username='agent1', email='agent1@test.com', password='testpassword123')
+        for u in [self.user, self.agent]:
+            if not hasattr(u, 'profile'):
+                Profile.objects.create(user=u)
+        self.conversation = Conversation.objects.create(user=self.user, agent=self.agent)
+
+    def _send_message(self, text='Hello Agent'):
+        self.client.force_authenticate(user=self.user)
+        url = reverse('conversation-send-message', args=[self.conversation.id])
+        return self.client.post(url, {'text': text}, format='json')
+
+    def test_sending_a_message_queues_email_instead_of_sending_it(self):
+        response = self._send_message()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        delivery = NotificationDelivery.objects.get(channel='email')
+        self.assertEqual(delivery.recipient, 'agent1@test.com')
+        self.assertEqual(delivery.user, self.agent)
+        self.assertEqual(delivery.status, 'pending')
+
+    def test_process_due_sends_and_marks_sent(self):
+        self._send_message()
+
+        counts = outbox.process_due()
+
+        self.assertEqual(counts, {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['agent1@test.com'])
+        delivery = NotificationDelivery.objects.get(channel='email')
+        self.assertEqual(delivery.status, 'sent')
+        self.assertIsNotNone(delivery.sent_at)
+
+        # Nothing is sent twice
+        self.assertEqual(outbox.process_due(), {'sent': 0, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_send_is_retried_later(self):
+        self._send_message()
+
+        with patch('communications.notification_service.EmailNotificationService.send',
+                   side_effect=ConnectionError('SMTP down')):
+            counts = outbox.process_due()
+
+        self.assertEqual(counts['retrying'], 1)
+        delivery = NotificationDelivery.objects.get(channel='email')
+        self.assertEqual(delivery.status, 'pending')
+        self.assertEqual(delivery.attempts, 1)
+        self.assertIn('SMTP down', delivery.last_error)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+
+        # Not due yet
+        self.assertEqual(outbox.process_due()['sent'], 0)
+
+        NotificationDelivery.objects.filter(id=delivery.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.process_due()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self):
+        self._send_message()
+
+        with patch('communications.notification_service.EmailNotificationService.send',
+                   side_effect=ConnectionError('SMTP down')):
+            counts = outbox.process_due()
+
+        self.assertEqual(counts['failed'], 1)
+        self.assertEqual(NotificationDelivery.objects.get(channel='email').status, 'failed')
+
+    def test_unconfigured_channel_fails_without_retry(self):
+        outbox.enqueue([outbox.delivery('sms', '+254700000000', {'body': 'Hi'}, self.user)])
+
+        with patch('communications.notification_service.SMSNotificationService.send',
+                   side_effect=ChannelUnavailable('Twilio is not configured')):
+            counts = outbox.process_due(channels=['sms'])
+
+        self.assertEqual(counts['failed'], 1)
+        delivery = NotificationDelivery.objects.get(channel='sms')
+        self.assertEqual(delivery.status, 'failed')
+        self.assertEqual(delivery.attempts, 1)
+
+    def test_expired_lease_is_claimed_again(self):
+        outbox.enqueue([outbox.delivery('email', 'user1@test.com', {'subject': 'Hi', 'body': 'Hi'}, self.user)])
+        NotificationDelivery.objects.update(
+            status='sending', next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(outbox.process_due()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_process_notifications_command(self):
+        self._send_message()
+
+        call_command('process_notifications', '--channel', 'email', verbosity=0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(NotificationDelivery.objects.get(channel='email').status, 'sent')
+
+
+class NotifyManyTests(TestCase):
+    def setUp(self):
+        from accounts.roles import ensure_group
+
+        agent_group = ensure_group('agent')
+        self.agents = [User.objects.create_user(username=f'agent{i}', password='testpassword123') for i in range(3)]
+        for agent in self.agents:
+            agent.groups.add(agent_group)
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword123') for i in range(2)]
+
+    def test_notify_many_bulk_creates_in_batches(self):
+        from communications.models import Notification
+        from communications.notification_service import get_notification_service
+
+        everyone = self.agents + self.users
+        with self.assertNumQueries(2):
+            created = get_notification_service().notify_many(
+                everyone, 'Maintenance', 'Down at 22:00', batch_size=3
+            )
+
+        self.assertEqual(created, 5)
+        self.assertEqual(
+            set(Notification.objects.filter(title='Maintenance').values_list('user_id', flat=True)),
+            {u.id for u in everyone}
+        )
+
+    def test_notify_many_broadcasts_to_online_users_only(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from communications import presence
+        from communications.models import Notification
+        from communications.notification_service import get_notification_service
+
+        online, offline = self.users
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'notifications_{online.id}', channel_name)
+        async_to_sync(channel_layer.group_add)(f'notifications_{offline.id}', channel_name)
+        presence.connect(online.id, channel_name)
+        self.addCleanup(presence.disconnect, online.id, channel_name)
+
+        get_notification_service().notify_many(
+            User.objects.filter(id__in=[online.id, offline.id]), 'Hello', 'Welcome', data={'k': 'v'}
+        )
+
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        notification = Notification.objects.get(user=online)
+        self.assertEqual(event['type'], 'notification.message')
+        self.assertEqual(event['message']['id'], str(notification.id))
+        self.assertEqual(event['message']['user'], online.id)
+        self.assertEqual(event['message']['title'], 'Hello')
+        self.assertEqual(event['message']['data'], {'k': 'v'})
+        self.assertFalse(event['message']['is_read'])
+        # Nothing was sent to the offline user's group, so the channel is drained
+        self.assertNotIn(channel_name, channel_layer.channels)
+
+    def test_broadcast_command_filters_agents_by_city(self):
+        from communications.models import Notification
+        from properties.models import Property
+
+        Property.objects.create(
+            owner=self.agents[0], title='Flat', description='Nice', price=1000,
+            type='Apartment', rooms=2, bedrooms=1, bathrooms=1, city='Nairobi'
+        )
+        Property.objects.create(
+            owner=self.agents[1], title='House', description='Nice', price=2000,
+            type='House', rooms=4, bedrooms=3, bathrooms=2, city='Mombasa'
+        )
+
+        call_command(
+            'broadcast_notification', '--title', 'Agents meetup', '--message', 'Friday',
+            '--role', 'agent', '--city', 'nairobi', verbosity=0
+        )
+        self.assertEqual(
+            list(Notification.objects.filter(title='Agents meetup').values_list('user_id', flat=True)),
+            [self.agents[0].id]
+        )
+
+        call_command('broadcast_notification', '--title', 'Users', '--message', 'Hi', '--role', 'user', verbosity=0)
+        self.assertEqual(Notification.objects.filter(title='Users').count(), len(self.users))
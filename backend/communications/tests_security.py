@@ -2,7 +2,7 @@
 Tests for messaging rate limiting and encryption features
 """
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from rest_framework.test import APIClient
@@ -76,6 +76,46 @@ class RateLimitingTests(TestCase):
         cache.clear()  # Clear expired entries
         self.assertTrue(limiter.allow_message(self.user.id, self.conversation.id))
     
+    def test_sliding_window_counter(self):
+        """Test that the previous window's hits are weighted by their overlap"""
+        from communications.throttles import LocalRateLimiter
+        limiter = LocalRateLimiter()
+        
+        # 4 hits allowed in the first 10s window, then throttled
+        results = [limiter.hit('sliding-test', 4, 10, now=5)[0] for _ in range(5)]
+        self.assertEqual(results, [True, True, True, True, False])
+        
+        # Halfway into the next window the previous 4 hits count as 2
+        results = [limiter.hit('sliding-test', 4, 10, now=15)[0] for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+    
+    def test_check_rate_survives_redis_errors(self):
+        """Test that a Redis outage falls back to the cache limiter instead of failing requests"""
+        from unittest import mock
+        from redis.exceptions import ConnectionError as RedisConnectionError
+        from communications import throttles
+
+        broken = mock.Mock()
+        broken.hit.side_effect = RedisConnectionError('Connection refused')
+        with mock.patch.object(throttles, 'get_rate_limiter', return_value=broken):
+            results = [throttles.check_rate('redis-down-test', 2, 60)[0] for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_http_message_throttle_reports_wait(self):
+        """Test that the HTTP message throttle uses the shared limiter"""
+        from unittest import mock
+        from communications.throttles import MessageRateThrottle
+        self.client.force_authenticate(user=self.user)
+        url = f'/api/v1/communications/conversations/{self.conversation.id}/send_message/'
+        
+        with mock.patch.object(MessageRateThrottle, 'rate', '2/min'):
+            for i in range(2):
+                self.assertEqual(self.client.post(url, {'text': f'Hi {i}'}).status_code, status.HTTP_201_CREATED)
+            response = self.client.post(url, {'text': 'One too many'})
+        
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+    
     def test_rate_limit_per_user(self):
         """Test that rate limits are per-user"""
         limiter = WebSocketRateLimit(max_messages=3, window=10)
@@ -157,6 +197,130 @@ class EncryptionTests(TestCase):
         self.assertEqual(encrypted, "")
         self.assertEqual(decrypted, "")
     
+    def test_decrypt_many_decrypts_each_ciphertext_once(self):
+        """Test that batch decryption reuses cached plaintext"""
+        from unittest import mock
+        encryptor = get_encryptor()
+        encryptor.clear_cache()
+        messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.user, text=f"Message {i}")
+            for i in range(3)
+        ]
+        items = [(m.id, m.text_encrypted) for m in messages]
+
+        with mock.patch.object(encryptor, 'decrypt', wraps=encryptor.decrypt) as decrypt:
+            first = encryptor.decrypt_many(items)
+            second = encryptor.decrypt_many(items)
+
+        self.assertEqual(first, {m.id: f"Message {i}" for i, m in enumerate(messages)})
+        self.assertEqual(second, first)
+        self.assertEqual(decrypt.call_count, 3)
+
+    def test_decrypt_cache_is_bounded(self):
+        """Test that the plaintext cache evicts least recently used entries"""
+        encryptor = get_encryptor()
+        encryptor.clear_cache()
+        items = [(i, encryptor.encrypt(f"Message {i}")) for i in range(5)]
+
+        original_size, encryptor.cache_size = encryptor.cache_size, 2
+        try:
+            encryptor.decrypt_many(items)
+            self.assertEqual([key[0] for key in encryptor._cache], [3, 4])
+        finally:
+            encryptor.cache_size = original_size
+
+    @override_settings(MESSAGE_ENCRYPTED_ONLY=True)
+    def test_message_stored_encrypted_only(self):
+        """Test that saved messages keep no plaintext copy in the database"""
+        message = Message.objects.create(
+            conversation=self.conversation,
+            sender=self.user,
+            text="Meet at the site at 10"
+        )
+
+        self.assertEqual(message.text, "Meet at the site at 10")
+        stored = Message.objects.values('text', 'text_encrypted').get(pk=message.pk)
+        self.assertEqual(stored['text'], "")
+        self.assertTrue(stored['text_encrypted'].startswith('gA'))
+        self.assertEqual(Message.objects.get(pk=message.pk).decrypted_text, "Meet at the site at 10")
+
+    @override_settings(MESSAGE_ENCRYPTED_ONLY=True)
+    def test_post_save_receivers_see_plaintext_in_encrypted_only_mode(self):
+        """Test that clearing the plaintext column does not hide the text from signal receivers"""
+        from django.db.models.signals import post_save
+        seen = []
+
+        def receiver(sender, instance, created, **kwargs):
+            seen.append((instance.text, Message.objects.values_list('text', flat=True).get(pk=instance.pk)))
+
+        post_save.connect(receiver, sender=Message)
+        try:
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, text="Gate code 4411")
+            message.save()
+        finally:
+            post_save.disconnect(receiver, sender=Message)
+
+        self.assertEqual(seen, [("Gate code 4411", ""), ("Gate code 4411", "")])
+
+    def test_message_keeps_plaintext_column_by_default(self):
+        """Test that the plaintext copy is only dropped when encrypted-only storage is enabled"""
+        message = Message.objects.create(conversation=self.conversation, sender=self.user, text="Hello")
+        self.assertEqual(Message.objects.values_list('text', flat=True).get(pk=message.pk), "Hello")
+        self.assertTrue(message.is_encrypted)
+
+    def test_encrypt_message_storage_command_keeps_unreadable_rows(self):
+        """Test that ciphertext from another key is re-encrypted from plaintext, never blanked"""
+        from io import StringIO
+        from cryptography.fernet import Fernet
+        from django.core.management import call_command
+        encryptor = get_encryptor()
+        foreign_token = Fernet(Fernet.generate_key()).encrypt(b"Other key").decode()
+        recoverable = Message(
+            conversation=self.conversation, sender=self.user,
+            text="Other key", text_encrypted=foreign_token, is_encrypted=True
+        )
+        lost = Message(
+            conversation=self.conversation, sender=self.user,
+            text="", text_encrypted=foreign_token, is_encrypted=True
+        )
+        super(Message, recoverable).save()
+        super(Message, lost).save()
+
+        out = StringIO()
+        call_command('encrypt_message_storage', stdout=out)
+
+        recoverable = Message.objects.get(pk=recoverable.pk)
+        self.assertEqual(recoverable.text, "")
+        self.assertEqual(encryptor.decrypt(recoverable.text_encrypted), "Other key")
+        self.assertEqual(Message.objects.get(pk=lost.pk).text_encrypted, foreign_token)
+        self.assertIn('skipped 1', out.getvalue())
+
+    def test_encrypt_message_storage_command(self):
+        """Test that the migration command compacts legacy and plaintext rows"""
+        import base64
+        from io import StringIO
+        from django.core.management import call_command
+        encryptor = get_encryptor()
+        legacy = Message(
+            conversation=self.conversation,
+            sender=self.user,
+            text="Legacy message",
+            text_encrypted=base64.b64encode(encryptor.encrypt("Legacy message").encode()).decode(),
+            is_encrypted=True
+        )
+        plain = Message(conversation=self.conversation, sender=self.agent, text="Plain message")
+        super(Message, legacy).save()
+        super(Message, plain).save()
+
+        call_command('encrypt_message_storage', batch_size=1, stdout=StringIO())
+
+        for message, text in ((legacy, "Legacy message"), (plain, "Plain message")):
+            message = Message.objects.get(pk=message.pk)
+            self.assertEqual(message.text, "")
+            self.assertTrue(message.is_encrypted)
+            self.assertTrue(message.text_encrypted.startswith('gA'))
+            self.assertEqual(encryptor.decrypt(message.text_encrypted), text)
+
     def test_backward_compatibility(self):
         """Test that old unencrypted messages still work"""
         # Create message without triggering auto-encryption
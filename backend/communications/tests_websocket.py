@@ -2,7 +2,7 @@
 WebSocket consumer tests for real-time communications
 """
 import json
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from channels.testing import WebsocketCommunicator
 from channels.db import database_sync_to_async
@@ -36,6 +36,9 @@ class ChatConsumerTests(TransactionTestCase):
     def setUp(self):
         """Set up test fixtures"""
         import asyncio
+        from communications import connection_cache
+        # Ids are reused between tests, so start from an empty handshake cache
+        connection_cache.clear()
         self.user1, self.user2, self.conversation = asyncio.run(self.async_setup())
     
     async def test_chat_consumer_connect(self):
@@ -150,6 +153,7 @@ class ChatConsumerTests(TransactionTestCase):
         connected, _ = await communicator.connect()
         self.assertFalse(connected)
     
+    @override_settings(MESSAGE_ENCRYPTED_ONLY=True)
     async def test_message_encryption(self):
         """Test that messages are encrypted"""
         communicator = WebsocketCommunicator(
@@ -176,8 +180,9 @@ class ChatConsumerTests(TransactionTestCase):
         
         # Verify message is stored
         message = await database_sync_to_async(lambda: Message.objects.latest('id'))()
-        # Encryption removed, so content should match
-        self.assertEqual(message.text, test_content)
+        # Only ciphertext is stored; the content round-trips through it
+        self.assertEqual(message.text, '')
+        self.assertEqual(message.decrypted_text, test_content)
         
         await communicator.disconnect()
     
@@ -231,6 +236,90 @@ class ChatConsumerTests(TransactionTestCase):
         
         await communicator.disconnect()
 
+    async def _open_chat(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{self.conversation.id}/")
+        communicator.scope["user"] = user
+        communicator.scope['url_route'] = {'kwargs': {'conversation_id': str(self.conversation.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'user_status')
+        return communicator
+    
+    async def test_typing_indicators_are_coalesced(self):
+        """Test that keystroke-level typing events are only broadcast on change"""
+        typist = await self._open_chat(self.user1)
+        watcher = await self._open_chat(self.user2)
+        
+        for _ in range(5):
+            await typist.send_json_to({'type': 'typing', 'is_typing': True})
+        await typist.send_json_to({'type': 'typing', 'is_typing': False})
+        
+        started = await watcher.receive_json_from()
+        stopped = await watcher.receive_json_from()
+        self.assertEqual((started['is_typing'], stopped['is_typing']), (True, False))
+        self.assertTrue(await watcher.receive_nothing())
+        
+        await typist.disconnect()
+        await watcher.disconnect()
+    
+    async def test_read_receipts_are_batched_into_high_water_marks(self):
+        """Test that a burst of read receipts is persisted and broadcast as one mark"""
+        from unittest import mock
+        messages = []
+        for i in range(3):
+            message = await database_sync_to_async(Message.objects.create)(
+                conversation=self.conversation, sender=self.user1, text=f'Message {i}'
+            )
+            await database_sync_to_async(MessageNotification.objects.create)(user=self.user2, message=message)
+            messages.append(message)
+        
+        with mock.patch.object(ChatConsumer, 'read_receipt_flush_interval', 0.1):
+            reader = await self._open_chat(self.user2)
+            for message in messages:
+                await reader.send_json_to({'type': 'read', 'message_id': message.id})
+            
+            first = await reader.receive_json_from()
+            last = await reader.receive_json_from()
+            self.assertEqual((first['message_id'], last['message_id']), (messages[0].id, messages[2].id))
+            self.assertTrue(last['up_to'])
+            self.assertTrue(await reader.receive_nothing(timeout=0.3))
+            await reader.disconnect()
+        
+        unread = await database_sync_to_async(
+            lambda: MessageNotification.objects.filter(user=self.user2, is_read=False).count()
+        )()
+        self.assertEqual(unread, 0)
+    
+    async def test_presence_is_broadcast_once_per_transition(self):
+        """Test that several tabs count as one presence and only transitions are sent"""
+        chat = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/{self.conversation.id}/")
+        chat.scope["user"] = self.user1
+        chat.scope['url_route'] = {'kwargs': {'conversation_id': str(self.conversation.id)}}
+        connected, _ = await chat.connect()
+        self.assertTrue(connected)
+        initial = await chat.receive_json_from()
+        self.assertEqual(initial, {'type': 'user_status', 'user_id': self.user2.id, 'is_online': False})
+
+        tabs = []
+        for _ in range(2):
+            tab = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+            tab.scope["user"] = self.user2
+            connected, _ = await tab.connect()
+            self.assertTrue(connected)
+            tabs.append(tab)
+
+        online = await chat.receive_json_from()
+        self.assertEqual(online, {'type': 'user_status', 'user_id': self.user2.id, 'is_online': True})
+        self.assertTrue(await chat.receive_nothing())
+
+        await tabs[0].disconnect()
+        self.assertTrue(await chat.receive_nothing())
+        await tabs[1].disconnect()
+        offline = await chat.receive_json_from()
+        self.assertEqual(offline, {'type': 'user_status', 'user_id': self.user2.id, 'is_online': False})
+
+        await chat.disconnect()
+
 
 class NotificationConsumerTests(TransactionTestCase):
     """Test NotificationConsumer WebSocket functionality"""
@@ -275,6 +364,59 @@ class NotificationConsumerTests(TransactionTestCase):
         connected, subprotocol = await communicator.connect()
         self.assertFalse(connected)
 
+    async def _pending_payment(self, user, checkout_request_id='ws_CO_1'):
+        from properties.models import Payment
+
+        return await database_sync_to_async(Payment.objects.create)(
+            user=user, method='mpesa', amount=100, transaction_id=checkout_request_id, status='pending'
+        )
+
+    async def test_payment_status_is_pushed_when_callback_resolves_payment(self):
+        """Test that a completed payment is pushed instead of polled"""
+        from properties.payments import ingest_callback
+
+        payment = await self._pending_payment(self.user)
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+
+        await database_sync_to_async(ingest_callback)({
+            'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'Completed',
+            'MpesaReceiptNumber': 'ABC12345',
+        })
+
+        response = json.loads(await communicator.receive_from())
+        self.assertEqual(response['type'], 'payment_status')
+        self.assertEqual(response['payment']['id'], payment.id)
+        self.assertEqual(response['payment']['status'], 'completed')
+        self.assertEqual(response['payment']['mpesa_receipt_number'], 'ABC12345')
+
+        # A duplicate callback is not pushed again
+        await database_sync_to_async(ingest_callback)({
+            'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'Completed',
+        })
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.disconnect()
+
+    async def test_payment_status_request_returns_own_payments_only(self):
+        """Test that a late socket can ask for a payment's current status"""
+        other = await database_sync_to_async(User.objects.create_user)(username='other', password='testpass123')
+        own_payment = await self._pending_payment(self.user)
+        other_payment = await self._pending_payment(other, 'ws_CO_2')
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), "/ws/notifications/")
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+
+        await communicator.send_to(text_data=json.dumps({'type': 'payment_status', 'payment_id': own_payment.id}))
+        response = json.loads(await communicator.receive_from())
+        self.assertEqual(response['payment']['status'], 'pending')
+
+        await communicator.send_to(text_data=json.dumps({'type': 'payment_status', 'payment_id': other_payment.id}))
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.disconnect()
+
 
 class WebSocketIntegrationTests(TestCase):
     """Integration tests for WebSocket with REST API"""
@@ -311,13 +453,13 @@ class WebSocketIntegrationTests(TestCase):
         self.assertEqual(response.status_code, 201)
         
         # Verify notification was created for other user
-        self.assertTrue(
-            MessageNotification.objects.filter(
-                user=self.user2,
-                message__text='Test message',
-                is_read=False
-            ).exists()
-        )
+        notification = MessageNotification.objects.filter(
+            user=self.user2,
+            message__conversation=self.conversation,
+            is_read=False
+        ).first()
+        self.assertIsNotNone(notification)
+        self.assertEqual(notification.message.decrypted_text, 'Test message')
     
     def test_message_encryption_key_generation(self):
         """Test that encryption keys are properly generated"""
@@ -334,3 +476,61 @@ class WebSocketIntegrationTests(TestCase):
         # Should be able to decrypt
         decrypted = encryption.decrypt_message(encrypted)
         self.assertEqual(decrypted, test_message)
+
+    def test_presence_connections_expire_without_heartbeat(self):
+        """Test that a connection that stops heartbeating no longer counts as online"""
+        from communications.presence import LocalPresenceStore
+
+        store = LocalPresenceStore()
+        self.assertTrue(store.connect(self.user1.id, 'tab-1', ttl=60))
+        self.assertFalse(store.connect(self.user1.id, 'tab-2', ttl=0))
+        self.assertEqual(store.online([self.user1.id, self.user2.id]), {self.user1.id})
+
+        # tab-2 already expired, so closing tab-1 takes the user offline
+        self.assertTrue(store.disconnect(self.user1.id, 'tab-1'))
+        self.assertEqual(store.online([self.user1.id]), set())
+
+    def test_handshake_lookups_are_cached(self):
+        """Test that repeat WebSocket handshakes resolve user and membership from cache"""
+        from asgiref.sync import async_to_sync
+        from rest_framework_simplejwt.tokens import AccessToken
+        from communications import connection_cache
+        from communications.middleware import get_user
+
+        connection_cache.clear()
+        token = str(AccessToken.for_user(self.user1))
+        with self.assertNumQueries(3):
+            self.assertEqual(connection_cache.get_user(self.user1.id), self.user1)
+            self.assertEqual(connection_cache.get_conversation(self.conversation.id)['agent_id'], self.user2.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(get_user)(token), self.user1)
+            connection_cache.get_conversation(self.conversation.id)
+            # Already active, so opening the chat writes nothing
+            self.assertFalse(connection_cache.mark_conversation_active(self.conversation.id))
+
+        # Saving the conversation drops its entry
+        self.conversation.is_active = False
+        self.conversation.save()
+        self.assertTrue(connection_cache.mark_conversation_active(self.conversation.id))
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.is_active)
+
+    def test_send_chat_message_uses_one_transaction_without_lookups(self):
+        """Test that the WebSocket send path only writes once caches are warm"""
+        from communications import connection_cache
+        from communications.messaging import send_chat_message
+        from communications.models import Notification
+
+        connection_cache.clear()
+        sender = connection_cache.get_user(self.user1.id)
+        send_chat_message(self.conversation.id, sender, 'Warm up')
+
+        with self.assertNumQueries(7):
+            sent = send_chat_message(self.conversation.id, sender, 'Hello there')
+
+        self.assertEqual(sent.payload['text'], 'Hello there')
+        self.assertEqual(sent.payload['sender_role'], 'user')
+        self.assertEqual(sent.recipient, self.user2)
+        self.assertTrue(MessageNotification.objects.filter(message=sent.message, user=self.user2).exists())
+        self.assertEqual(Notification.objects.get(id=sent.notification['id']).user, self.user2)
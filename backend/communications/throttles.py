@@ -1,17 +1,135 @@
 from rest_framework.throttling import UserRateThrottle
+from django.conf import settings
 from django.core.cache import cache
 from rest_framework.exceptions import Throttled
+from redis.exceptions import RedisError
+import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Sliding-window counter: the previous fixed window's count is weighted by
+# how much of it still overlaps the sliding window, plus the current count.
+# Checks and increments in one atomic round trip.
+SLIDING_WINDOW_SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current >= tonumber(ARGV[2]) then
+    return {0, previous, current}
+end
+current = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return {1, previous, current}
+"""
+
+
+class LocalRateLimiter:
+    """Sliding-window counter on the Django cache, serialized by a process lock"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        current_window = int(now // window)
+        previous_key = f"ratelimit:{key}:{current_window - 1}"
+        current_key = f"ratelimit:{key}:{current_window}"
+        weight = 1 - (now % window) / window
+        with self._lock:
+            counts = cache.get_many([previous_key, current_key])
+            previous = counts.get(previous_key, 0)
+            current = counts.get(current_key, 0)
+            if previous * weight + current >= limit:
+                return False, previous, current
+            current += 1
+            cache.set(current_key, current, int(window * 2) + 1)
+            return True, previous, current
+
+
+class RedisRateLimiter:
+    """Sliding-window counter shared by all workers, one Lua call per hit"""
+
+    def __init__(self, client):
+        self.script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def hit(self, key, limit, window, now):
+        current_window = int(now // window)
+        weight = 1 - (now % window) / window
+        allowed, previous, current = self.script(
+            keys=[f"ratelimit:{key}:{current_window - 1}", f"ratelimit:{key}:{current_window}"],
+            args=[repr(weight), limit, int(window * 2) + 1],
+        )
+        return bool(allowed), int(previous), int(current)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+# Used while Redis is unreachable; the cache it counts on ignores Redis errors
+_fallback_limiter = LocalRateLimiter()
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter (Redis when configured)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = _create_limiter()
+    return _limiter
+
+
+def _create_limiter():
+    if getattr(settings, 'REDIS_URL', None):
+        try:
+            from django_redis import get_redis_connection
+            return RedisRateLimiter(get_redis_connection('default'))
+        except Exception as e:
+            logger.warning(f"Redis rate limiter unavailable, using cache fallback: {e}")
+    return LocalRateLimiter()
+
+
+def check_rate(key, limit, window):
+    """
+    Count one hit against ``limit`` hits per ``window`` seconds for ``key``
+
+    Returns:
+        (allowed, wait) where wait is the seconds until a hit would be allowed
+    """
+    now = time.time()
+    try:
+        allowed, previous, current = get_rate_limiter().hit(key, limit, window, now)
+    except RedisError as e:
+        logger.warning(f"Redis rate limiter unavailable, using cache fallback: {e}")
+        allowed, previous, current = _fallback_limiter.hit(key, limit, window, now)
+    if allowed:
+        return True, 0
+    elapsed = now % window
+    if current < limit and previous:
+        # Wait until enough of the previous window has slid out
+        wait = window * (1 - (limit - current) / previous) - elapsed
+    else:
+        wait = window - elapsed
+    return False, max(wait, 0)
+
+
 class MessageRateThrottle(UserRateThrottle):
-    """Throttle for sending messages via HTTP API"""
+    """Throttle for sending messages via HTTP API (sliding-window counter)"""
     scope = 'messages'
     rate = '60/min'
 
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self._wait = check_rate(self.key, self.num_requests, self.duration)
+        return allowed
+
+    def wait(self):
+        return self._wait
+
 
 class ConversationRateThrottle(UserRateThrottle):
     """Throttle for creating conversations"""
@@ -48,22 +166,10 @@ class WebSocketRateLimit:
             Throttled: If rate limit exceeded
         """
         key = f"ws_rate:{user_id}:{conversation_id}"
-        now = time.time()
-        
-        # Get recent messages
-        messages = cache.get(key, [])
-        
-        # Remove old messages outside window
-        messages = [t for t in messages if now - t < self.window]
-        
-        # Check limit
-        if len(messages) >= self.max_messages:
-            wait_time = int(self.window - (now - messages[0]))
+        allowed, wait = check_rate(key, self.max_messages, self.window)
+        if not allowed:
+            wait_time = int(wait) + 1
             logger.warning(f"Rate limit exceeded for user {user_id} in conversation {conversation_id}")
             raise Throttled(wait=wait_time, detail=f"Rate limit exceeded. Please wait {wait_time} seconds.")
         
-        # Add current message
-        messages.append(now)
-        cache.set(key, messages, self.window + 5)
-        
         return True
@@ -3,7 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Q
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.exceptions import MethodNotAllowed, ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Conversation, Message, MessageNotification, Notification
 from .serializers import (
@@ -12,6 +12,8 @@ from .serializers import (
 )
 from communications.notification_service import get_notification_service
 from .throttles import MessageRateThrottle, ConversationRateThrottle
+from utils.pagination import FeedPagination
+from .read_state import mark_conversation_read, mark_message_read, mark_messages_read, unread_total
 import logging
 from django.utils import timezone
 from channels.layers import get_channel_layer
@@ -21,6 +23,13 @@ logger = logging.getLogger(__name__)
 
 
 # Views from messaging app
+
+class ConversationFeedPagination(FeedPagination):
+    """Keyset pages of the inbox, most recently updated first; unpaginated without ?cursor=."""
+    ordering = ('-updated_at', '-id')
+    fallback_class = None
+
+
 class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
@@ -28,8 +37,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
     search_fields = ['user__username', 'agent__username', 'property__title']
     ordering_fields = ['created_at', 'updated_at']
     ordering = ['-updated_at']
-    pagination_class = None
+    pagination_class = ConversationFeedPagination
     http_method_names = ['get', 'head', 'options', 'post', 'patch', 'put']
+    message_window_size = 50
+    max_message_window_size = 200
     
     def get_throttles(self):
         """Apply specific throttles based on action"""
@@ -54,10 +65,13 @@ class ConversationViewSet(viewsets.ModelViewSet):
         user = self.request.user
         queryset = Conversation.objects.filter(
             Q(user=user) | Q(agent=user)
-        ).select_related('user', 'agent', 'property').prefetch_related('messages')
+        ).select_related('user', 'agent', 'property')
         
         if self.action == 'list':
             queryset = queryset.exclude(hidden_by=user)
+        
+        if self.action in ('list', 'retrieve', 'active'):
+            queryset = ConversationSerializer.prepare_inbox_queryset(queryset, user)
             
         return queryset
     
@@ -72,23 +86,72 @@ class ConversationViewSet(viewsets.ModelViewSet):
     def _get_other_participant(self, user, conversation):
         return conversation.agent if conversation.user == user else conversation.user
 
+    def _message_window(self, conversation, params):
+        """
+        Return ``(messages, has_more)`` for one window of history, oldest first.
+
+        Without cursors this is the latest ``limit`` messages; ``before=<id>``
+        scrolls back from a message and ``since=<id>`` catches up after it.
+        Windows are keyset lookups on (created_at, id), so their cost does not
+        depend on how long the conversation is.
+        """
+        if 'before' in params and 'since' in params:
+            raise ValidationError({'detail': "Use either 'before' or 'since', not both."})
+        try:
+            limit = int(params.get('limit', self.message_window_size))
+            anchor_id = int(params.get('before', params.get('since', 0)))
+        except (TypeError, ValueError):
+            raise ValidationError({'detail': "'limit', 'before' and 'since' must be integers."})
+        limit = min(max(limit, 1), self.max_message_window_size)
+
+        messages = conversation.messages.select_related(
+            'sender__profile', 'reply_to__sender'
+        ).prefetch_related('sender__groups')
+        newest_first = 'since' not in params
+        if anchor_id:
+            anchor = conversation.messages.filter(pk=anchor_id).values('created_at', 'id').first()
+            if anchor is None:
+                raise ValidationError({'detail': 'Message not found in this conversation.'})
+            lookup = 'lt' if newest_first else 'gt'
+            messages = messages.filter(
+                Q(**{f'created_at__{lookup}': anchor['created_at']})
+                | Q(created_at=anchor['created_at'], **{f'id__{lookup}': anchor['id']})
+            )
+        ordering = ('-created_at', '-id') if newest_first else ('created_at', 'id')
+
+        # One extra row tells whether another window exists
+        window = list(messages.order_by(*ordering)[:limit + 1])
+        has_more = len(window) > limit
+        window = window[:limit]
+        if newest_first:
+            window.reverse()
+        return window, has_more
+
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """Get messages in a conversation"""
+        """
+        Get a window of messages in a conversation
+
+        Query params: ``limit`` (default 50, max 200), and ``before`` or
+        ``since`` (a message id). The ``X-Has-More`` header tells whether
+        older (or, with ``since``, newer) messages remain.
+        """
         try:
             conversation = self.get_object()
             if not self._is_participant(request.user, conversation):
                  return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-            messages = conversation.messages.all().order_by('created_at')
-            serializer = MessageSerializer(messages, many=True)
+            messages, has_more = self._message_window(conversation, request.query_params)
             
-            # Mark messages as read for the current user (messages sent by OTHER party)
-            conversation.messages.filter(
-                read_at__isnull=True
-            ).exclude(sender=request.user).update(read_at=timezone.now())
+            # Mark only the returned window as read for the current user
+            mark_messages_read(conversation, request.user, messages)
             
-            return Response(serializer.data)
+            serializer = MessageSerializer(messages, many=True)
+            response = Response(serializer.data)
+            response['X-Has-More'] = 'true' if has_more else 'false'
+            return response
+        except ValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error fetching messages: {e}")
             return Response(
@@ -178,9 +241,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """Mark all messages in conversation as read"""
         try:
             conversation = self.get_object()
-            conversation.messages.filter(
-                read_at__isnull=True
-            ).exclude(sender=request.user).update(read_at=timezone.now())
+            mark_conversation_read(conversation, request.user)
             
             return Response({
                 'status': 'success',
@@ -369,16 +430,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
     def unread_count(self, request):
         """Get total unread message count for the user"""
         try:
-            user = request.user
-            # Count messages where user is a participant but NOT sender, and read_at is Null
-            # This requires joining Conversation.
-            # OR simple approach:
-            
-            count = Message.objects.filter(
-                Q(conversation__user=user) | Q(conversation__agent=user),
-                read_at__isnull=True
-            ).exclude(sender=user).count()
-            
+            # Sum of the per-conversation counters kept by communications.read_state
+            count = unread_total(request.user)
             
             return Response({'unread_count': count})
         except Exception as e:
@@ -428,6 +481,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
 
 
+class MessageFeedPagination(FeedPagination):
+    """Keyset pages of message history in chronological order; unpaginated without ?cursor=."""
+    ordering = ('created_at', 'id')
+    fallback_class = None
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
@@ -436,7 +495,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at']
     ordering_fields = ['created_at']
     ordering = ['created_at']
-    pagination_class = None
+    pagination_class = MessageFeedPagination
     http_method_names = ['get', 'post', 'delete', 'head', 'options']
 
     def get_queryset(self):
@@ -579,9 +638,7 @@ class MessageViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if not message.read_at:
-                message.read_at = timezone.now()
-                message.save()
+            mark_message_read(message, request.user)
             
             return Response({'status': 'Message marked as read'})
         except Exception as e:
@@ -617,6 +674,8 @@ class NotificationViewSet(viewsets.ModelViewSet):
     """
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # ?cursor= switches to keyset pagination on (created_at, id); limit/offset otherwise
+    pagination_class = FeedPagination
     
     def get_queryset(self):
         """
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     AgentProfile, Property, MediaProperty, PropertyFeature, PropertyVisit,
-    Payment, SupportTicket, TicketMessage, TicketAttachment, PropertyLike,
+    Payment, MpesaCallbackEvent, SupportTicket, TicketMessage, TicketAttachment, PropertyLike,
     AgentRating
 )
 
@@ -80,6 +80,14 @@ class PaymentAdmin(admin.ModelAdmin):
     flag_payment.short_description = "Cancel selected payments"
 
 
+@admin.register(MpesaCallbackEvent)
+class MpesaCallbackEventAdmin(admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'payment', 'result_code', 'received_at', 'processed_at')
+    search_fields = ('checkout_request_id', 'merchant_request_id')
+    list_filter = ('result_code', 'received_at')
+    raw_id_fields = ('payment',)
+
+
 class TicketMessageInline(admin.TabularInline):
     model = TicketMessage
     extra = 0
@@ -6,11 +6,12 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.db.models import Count, Avg
 from django.contrib.auth import get_user_model
-from datetime import datetime, timedelta
-from collections import defaultdict
+from django.utils import timezone
+from datetime import timedelta
 
 from properties.models import Property, AgentRating, AgentProfile
 from accounts.permissions import IsAdmin
+from utils.time_buckets import bucket_counts
 
 User = get_user_model()
 
@@ -56,20 +57,16 @@ def user_growth(request):
     """
     Get user growth data grouped by month
     """
-    # Get users from the last 12 months
-    twelve_months_ago = datetime.now() - timedelta(days=365)
-    users = User.objects.filter(date_joined__gte=twelve_months_ago).values('date_joined')
-    
-    # Group by month
-    month_counts = defaultdict(int)
-    for user in users:
-        month_key = user['date_joined'].strftime('%b %Y')
-        month_counts[month_key] += 1
+    # Get users from the last 12 months, counted per month in the database
+    twelve_months_ago = timezone.now() - timedelta(days=365)
+    month_counts = bucket_counts(
+        User.objects.filter(date_joined__gte=twelve_months_ago), 'date_joined', 'month'
+    )
     
     # Convert to list format for charts
     growth_data = [
-        {'month': month, 'users': count}
-        for month, count in sorted(month_counts.items(), key=lambda x: datetime.strptime(x[0], '%b %Y'))
+        {'month': month.strftime('%b %Y'), 'users': count}
+        for month, count in month_counts
     ]
     
     return Response(growth_data)
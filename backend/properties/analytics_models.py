@@ -30,7 +30,7 @@ class PropertyViewEvent(models.Model):
         related_name='property_view_events'
     )
     device_type = models.CharField(max_length=10, choices=DEVICE_TYPES, default='unknown')
-    viewed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    viewed_at = models.DateTimeField(default=timezone.now, db_index=True)
     session_id = models.CharField(max_length=100, blank=True, null=True)
     location_city = models.CharField(max_length=100, blank=True, null=True)
     
@@ -76,6 +76,36 @@ class PropertyEngagement(models.Model):
         self.save(update_fields=['total_likes', 'updated_at'])
 
 
+class PropertyDailyStats(models.Model):
+    """
+    Daily aggregated views and inquiries per property, maintained by the
+    rollup job (properties.analytics_rollup).
+    """
+    property = models.ForeignKey(
+        'properties.Property',
+        on_delete=models.CASCADE,
+        related_name='daily_stats'
+    )
+    date = models.DateField(db_index=True)
+    views = models.PositiveIntegerField(default=0)
+    mobile_views = models.PositiveIntegerField(default=0)
+    desktop_views = models.PositiveIntegerField(default=0)
+    tablet_views = models.PositiveIntegerField(default=0)
+    inquiries = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'properties'
+        ordering = ['-date']
+        unique_together = ['property', 'date']
+        indexes = [
+            models.Index(fields=['property', '-date']),
+        ]
+    
+    def __str__(self):
+        return f"Stats for {self.property.title} on {self.date}"
+
+
 class AgentLeadMetrics(models.Model):
     """
     Daily aggregated lead metrics per agent for performance tracking.
@@ -92,6 +122,10 @@ class AgentLeadMetrics(models.Model):
         default=0,
         help_text="Average response time in minutes"
     )
+    total_response_seconds = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Sum of response times in seconds this day"
+    )
     total_responses = models.PositiveIntegerField(
         default=0,
         help_text="Number of responses sent this day"
@@ -184,17 +218,20 @@ class WeeklyEngagementPattern(models.Model):
     def __str__(self):
         return f"{self.agent.username} - {self.day_of_week} (Week of {self.week_start_date})"
     
-    def calculate_activity_level(self):
-        """Calculate activity level based on views and inquiries"""
-        total_activity = self.total_views + (self.total_inquiries * 10)
+    @staticmethod
+    def activity_level_for(total_views, total_inquiries):
+        """Return the activity level for the given views and inquiries"""
+        total_activity = total_views + (total_inquiries * 10)
         
         if total_activity >= 100:
-            self.activity_level = 'Very High'
+            return 'Very High'
         elif total_activity >= 50:
-            self.activity_level = 'High'
+            return 'High'
         elif total_activity >= 20:
-            self.activity_level = 'Medium'
-        else:
-            self.activity_level = 'Low'
-        
+            return 'Medium'
+        return 'Low'
+    
+    def calculate_activity_level(self):
+        """Calculate activity level based on views and inquiries"""
+        self.activity_level = self.activity_level_for(self.total_views, self.total_inquiries)
         self.save(update_fields=['activity_level'])
@@ -0,0 +1,252 @@
+"""
+Incremental daily rollups backing the agent analytics dashboard.
+
+Raw ``PropertyViewEvent``/``PropertyVisit``/``Message`` rows are aggregated
+per day into ``PropertyDailyStats`` (per property), ``AgentLeadMetrics`` and
+``WeeklyEngagementPattern`` (per agent). Every rollup recomputes whole days
+and upserts the result, so re-running a window is idempotent and the job only
+needs to revisit the last day or two on each run.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from properties.analytics_models import (
+    AgentLeadMetrics, PropertyDailyStats, PropertyViewEvent, WeeklyEngagementPattern,
+)
+from properties.models import PropertyVisit
+from utils.time_buckets import truncate
+
+# Days before today revisited by an incremental run (covers late view flushes)
+DEFAULT_LOOKBACK_DAYS = 1
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _datetime_range(start_date, end_date):
+    """Return aware datetimes covering ``start_date`` to ``end_date`` inclusive."""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def rollup_property_stats(start_date, end_date, properties=None):
+    """
+    Recompute ``PropertyDailyStats`` for each day in the range.
+
+    ``properties`` optionally restricts the rollup to a Property queryset.
+    Returns the number of rows written.
+    """
+    start, end = _datetime_range(start_date, end_date)
+    views = PropertyViewEvent.objects.filter(viewed_at__gte=start, viewed_at__lt=end)
+    visits = PropertyVisit.objects.filter(created_at__gte=start, created_at__lt=end)
+    if properties is not None:
+        views = views.filter(property__in=properties.values('id'))
+        visits = visits.filter(property__in=properties.values('id'))
+
+    rows = {}
+
+    def row_for(property_id, day):
+        key = (property_id, day)
+        if key not in rows:
+            rows[key] = PropertyDailyStats(property_id=property_id, date=day)
+        return rows[key]
+
+    view_counts = views.annotate(day=truncate('viewed_at', 'day')).values(
+        'property_id', 'day', 'device_type'
+    ).annotate(count=Count('id')).order_by()
+    for item in view_counts:
+        row = row_for(item['property_id'], item['day'])
+        row.views += item['count']
+        if item['device_type'] in ('mobile', 'desktop', 'tablet'):
+            field = f"{item['device_type']}_views"
+            setattr(row, field, getattr(row, field) + item['count'])
+
+    visit_counts = visits.annotate(day=truncate('created_at', 'day')).values(
+        'property_id', 'day'
+    ).annotate(count=Count('id')).order_by()
+    for item in visit_counts:
+        row_for(item['property_id'], item['day']).inquiries = item['count']
+
+    PropertyDailyStats.objects.bulk_create(
+        rows.values(),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['property', 'date'],
+        update_fields=['views', 'mobile_views', 'desktop_views', 'tablet_views', 'inquiries', 'updated_at'],
+    )
+    return len(rows)
+
+
+def response_time_stats(start, end, agent_ids=None):
+    """
+    Measure agent reply latency for replies sent between ``start`` and ``end``.
+
+    A reply's latency is the time since the latest client message before it
+    in the same conversation. Messages are streamed once in
+    (conversation, created_at) order instead of looking up the previous
+    message per reply. Returns ``{(agent_id, date): (total_seconds, replies)}``.
+    """
+    from communications.models import Conversation, Message
+
+    conversations = Conversation.objects.filter(
+        messages__created_at__gte=start, messages__created_at__lt=end
+    )
+    if agent_ids is not None:
+        conversations = conversations.filter(agent_id__in=agent_ids)
+    conversation_ids = conversations.values('id')
+
+    # Latest client message before the window, so the first reply in it can be timed
+    last_client_message = dict(
+        Message.objects.filter(
+            conversation__in=conversation_ids, created_at__lt=start
+        ).exclude(
+            sender_id=F('conversation__agent_id')
+        ).values('conversation_id').annotate(last=Max('created_at')).values_list(
+            'conversation_id', 'last'
+        ).order_by()
+    )
+
+    stats = defaultdict(lambda: [0.0, 0])
+    messages = Message.objects.filter(
+        conversation__in=conversation_ids, created_at__gte=start, created_at__lt=end
+    ).order_by('conversation_id', 'created_at', 'id').values_list(
+        'conversation_id', 'conversation__agent_id', 'sender_id', 'created_at'
+    )
+    for conversation_id, agent_id, sender_id, created_at in messages.iterator(chunk_size=2000):
+        if sender_id != agent_id:
+            last_client_message[conversation_id] = created_at
+        elif conversation_id in last_client_message:
+            day_stats = stats[(agent_id, timezone.localdate(created_at))]
+            day_stats[0] += (created_at - last_client_message[conversation_id]).total_seconds()
+            day_stats[1] += 1
+    return {key: tuple(value) for key, value in stats.items()}
+
+
+def rollup_agent_metrics(start_date, end_date, agent_ids=None):
+    """
+    Recompute ``AgentLeadMetrics`` (messages received, conversations started,
+    replies and their average response time) for each day in the range.
+
+    Returns the number of rows written.
+    """
+    from communications.models import Conversation, Message
+
+    start, end = _datetime_range(start_date, end_date)
+    messages = Message.objects.filter(created_at__gte=start, created_at__lt=end)
+    conversations = Conversation.objects.filter(created_at__gte=start, created_at__lt=end)
+    if agent_ids is not None:
+        messages = messages.filter(conversation__agent_id__in=agent_ids)
+        conversations = conversations.filter(agent_id__in=agent_ids)
+
+    rows = {}
+
+    def row_for(agent_id, day):
+        key = (agent_id, day)
+        if key not in rows:
+            rows[key] = AgentLeadMetrics(agent_id=agent_id, date=day)
+        return rows[key]
+
+    message_counts = messages.exclude(
+        sender_id=F('conversation__agent_id')
+    ).annotate(
+        day=truncate('created_at', 'day'),
+        agent_id=F('conversation__agent_id'),
+    ).values('agent_id', 'day').annotate(count=Count('id')).order_by()
+    for item in message_counts:
+        row_for(item['agent_id'], item['day']).new_messages = item['count']
+
+    conversation_counts = conversations.annotate(day=truncate('created_at', 'day')).values(
+        'agent_id', 'day'
+    ).annotate(count=Count('id')).order_by()
+    for item in conversation_counts:
+        row_for(item['agent_id'], item['day']).conversations_started = item['count']
+
+    for (agent_id, day), (total_seconds, replies) in response_time_stats(start, end, agent_ids).items():
+        row = row_for(agent_id, day)
+        row.total_responses = replies
+        row.total_response_seconds = round(total_seconds)
+        row.response_time_minutes = round(total_seconds / replies / 60)
+
+    AgentLeadMetrics.objects.bulk_create(
+        rows.values(),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['agent', 'date'],
+        update_fields=[
+            'new_messages', 'conversations_started', 'total_responses',
+            'total_response_seconds', 'response_time_minutes', 'updated_at',
+        ],
+    )
+    return len(rows)
+
+
+def rollup_weekly_patterns(start_date, end_date, agent_ids=None):
+    """
+    Recompute ``WeeklyEngagementPattern`` for every week touching the range
+    from ``PropertyDailyStats``.
+
+    Agents listed in ``agent_ids`` get rows even for weeks without activity.
+    Returns the number of rows written.
+    """
+    first_week = start_date - timedelta(days=start_date.weekday())
+    last_week = end_date - timedelta(days=end_date.weekday())
+    stats = PropertyDailyStats.objects.filter(
+        date__gte=first_week, date__lt=last_week + timedelta(days=7)
+    )
+    if agent_ids is not None:
+        stats = stats.filter(property__owner_id__in=agent_ids)
+
+    day_totals = {}
+    weeks = set()
+    for item in stats.values('property__owner_id', 'date').annotate(
+        views_total=Sum('views'), inquiries_total=Sum('inquiries')
+    ).order_by():
+        agent_id, day = item['property__owner_id'], item['date']
+        day_totals[(agent_id, day)] = (item['views_total'] or 0, item['inquiries_total'] or 0)
+        weeks.add((agent_id, day - timedelta(days=day.weekday())))
+
+    week = first_week
+    while week <= last_week:
+        weeks.update((agent_id, week) for agent_id in agent_ids or ())
+        week += timedelta(days=7)
+
+    rows = []
+    for agent_id, week_start in weeks:
+        for offset, day_name in enumerate(DAYS_OF_WEEK):
+            views, inquiries = day_totals.get((agent_id, week_start + timedelta(days=offset)), (0, 0))
+            rows.append(WeeklyEngagementPattern(
+                agent_id=agent_id,
+                week_start_date=week_start,
+                day_of_week=day_name,
+                total_views=views,
+                total_inquiries=inquiries,
+                activity_level=WeeklyEngagementPattern.activity_level_for(views, inquiries),
+            ))
+
+    WeeklyEngagementPattern.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['agent', 'week_start_date', 'day_of_week'],
+        update_fields=['total_views', 'total_inquiries', 'activity_level'],
+    )
+    return len(rows)
+
+
+def run_rollups(start_date=None, end_date=None):
+    """
+    Bring every rollup up to date for the given days (inclusive).
+
+    Defaults to an incremental run over the last ``DEFAULT_LOOKBACK_DAYS``
+    days plus today. Returns a dict of rows written per table.
+    """
+    end_date = end_date or timezone.localdate()
+    start_date = start_date or end_date - timedelta(days=DEFAULT_LOOKBACK_DAYS)
+    return {
+        'property_daily_stats': rollup_property_stats(start_date, end_date),
+        'agent_lead_metrics': rollup_agent_metrics(start_date, end_date),
+        'weekly_engagement_patterns': rollup_weekly_patterns(start_date, end_date),
+    }
@@ -1,18 +1,18 @@
 """
 Analytics service layer for agent dashboard metrics calculations.
 """
-from datetime import datetime, timedelta
-from django.db.models import Count, Sum, Avg, Q, F
+from datetime import timedelta
+from django.db.models import Count, Sum, Q, Max
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from collections import defaultdict
 
-from properties.models import Property, PropertyVisit, PropertyLike
+from properties.models import Property, PropertyVisit
 from properties.analytics_models import (
-    PropertyViewEvent, PropertyEngagement, AgentLeadMetrics, 
-    GeographicInsight, WeeklyEngagementPattern
+    PropertyViewEvent, PropertyDailyStats, AgentLeadMetrics, WeeklyEngagementPattern
 )
 from communications.models import Message, Conversation
+from utils.time_buckets import truncate, weekday
 
 User = get_user_model()
 
@@ -33,142 +33,136 @@ class AgentAnalyticsService:
         """
         Get overview metrics for agent's listings.
         
+        Windowed views and inquiries are read from the daily rollups
+        (properties.analytics_rollup), so the cost doesn't grow with traffic.
+        
         Returns:
             dict: Contains total_listings, active, inactive, views, inquiries
         """
         agent_properties = Property.objects.filter(owner=self.agent)
         
-        # Calculate date range
-        end_date = timezone.now()
-        start_date_7d = end_date - timedelta(days=7)
-        start_date_30d = end_date - timedelta(days=30)
-        
-        # Total listings
-        total_listings = agent_properties.count()
-        
-        # Active vs inactive
-        active_listings = agent_properties.filter(is_published=True, archived_at__isnull=True).count()
+        # Calculate date range (both windows include today)
+        today = timezone.localdate()
+        start_date_7d = today - timedelta(days=6)
+        start_date_30d = today - timedelta(days=29)
+        
+        # Total, active listings and lifetime views (view_count on Property)
+        listing_totals = agent_properties.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_published=True, archived_at__isnull=True)),
+            views=Sum('view_count'),
+        )
+        total_listings = listing_totals['total']
+        active_listings = listing_totals['active']
         inactive_listings = total_listings - active_listings
+        total_views = listing_totals['views'] or 0
         
-        # Views (use view_count from Property model)
-        total_views = agent_properties.aggregate(total=Sum('view_count'))['total'] or 0
-        
-        # Views from events (7-day and 30-day)
-        views_7d = PropertyViewEvent.objects.filter(
+        # Views and inquiries (PropertyVisit) from the daily rollups
+        window_totals = PropertyDailyStats.objects.filter(
             property__owner=self.agent,
-            viewed_at__gte=start_date_7d
-        ).count()
+            date__gte=start_date_30d
+        ).aggregate(
+            views_7d=Sum('views', filter=Q(date__gte=start_date_7d)),
+            views_30d=Sum('views'),
+            inquiries_7d=Sum('inquiries', filter=Q(date__gte=start_date_7d)),
+            inquiries_30d=Sum('inquiries'),
+        )
         
-        views_30d = PropertyViewEvent.objects.filter(
-            property__owner=self.agent,
-            viewed_at__gte=start_date_30d
-        ).count()
-        
-        # Inquiries (PropertyVisit represents inquiries)
         total_inquiries = PropertyVisit.objects.filter(property__owner=self.agent).count()
         
-        inquiries_7d = PropertyVisit.objects.filter(
-            property__owner=self.agent,
-            created_at__gte=start_date_7d
-        ).count()
-        
-        inquiries_30d = PropertyVisit.objects.filter(
-            property__owner=self.agent,
-            created_at__gte=start_date_30d
-        ).count()
-        
         return {
             'total_listings': total_listings,
             'active_listings': active_listings,
             'inactive_listings': inactive_listings,
             'total_views': total_views,
-            'views_7d': views_7d,
-            'views_30d': views_30d,
+            'views_7d': window_totals['views_7d'] or 0,
+            'views_30d': window_totals['views_30d'] or 0,
             'total_inquiries': total_inquiries,
-            'inquiries_7d': inquiries_7d,
-            'inquiries_30d': inquiries_30d,
+            'inquiries_7d': window_totals['inquiries_7d'] or 0,
+            'inquiries_30d': window_totals['inquiries_30d'] or 0,
         }
     
-    def get_property_performance(self, property_id=None, days=30):
+    def get_property_performance(self, property_id=None, days=30, interval='day'):
         """
         Get detailed performance metrics for properties.
         
         Args:
             property_id: Optional specific property ID, otherwise all agent's properties
             days: Number of days to analyze
+            interval: Bucket size of views_over_time ('day', 'week' or 'month')
         
         Returns:
             list: Property performance data
         """
-        agent_properties = Property.objects.filter(owner=self.agent)
+        agent_properties = Property.objects.filter(owner=self.agent).select_related(
+            'engagement_metrics'
+        ).annotate(
+            likes_total=Count('likes', distinct=True),
+            contact_attempts_total=Count('visits', distinct=True),
+        ).order_by('id')
         
         if property_id:
             agent_properties = agent_properties.filter(id=property_id)
         
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=days)
+        start_date = timezone.localdate() - timedelta(days=days - 1)
         
+        # Daily rollups for every property, grouped in the database
+        daily_stats = PropertyDailyStats.objects.filter(
+            property__owner=self.agent,
+            date__gte=start_date
+        )
+        if property_id:
+            daily_stats = daily_stats.filter(property_id=property_id)
+        
+        # Views over time, one row per property and bucket
+        views_over_time = defaultdict(list)
+        for item in daily_stats.annotate(bucket=truncate('date', interval)).values(
+            'property_id', 'bucket'
+        ).annotate(views_total=Sum('views')).filter(views_total__gt=0).order_by('property_id', 'bucket'):
+            views_over_time[item['property_id']].append(
+                {'date': item['bucket'].isoformat(), 'views': item['views_total']}
+            )
+        
+        # Views and devices per day of the week, one row per property and weekday
+        by_weekday = defaultdict(list)
+        for item in daily_stats.annotate(day=weekday('date')).values('property_id', 'day').annotate(
+            views_total=Sum('views'),
+            mobile=Sum('mobile_views'),
+            desktop=Sum('desktop_views'),
+            tablet=Sum('tablet_views'),
+        ).order_by():
+            by_weekday[item['property_id']].append(item)
+        
+        day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         performance_data = []
         
         for prop in agent_properties:
-            # Views over time (daily breakdown)
-            views_by_day = PropertyViewEvent.objects.filter(
-                property=prop,
-                viewed_at__gte=start_date
-            ).extra(
-                select={'day': 'DATE(viewed_at)'}
-            ).values('day').annotate(
-                count=Count('id')
-            ).order_by('day')
-            
-            views_over_time = [
-                {'date': item['day'].isoformat(), 'views': item['count']}
-                for item in views_by_day
-            ]
-            
-            # Device breakdown
-            device_breakdown = PropertyViewEvent.objects.filter(
-                property=prop,
-                viewed_at__gte=start_date
-            ).values('device_type').annotate(count=Count('id'))
+            weekdays = by_weekday.get(prop.id, [])
             
-            device_data = {item['device_type']: item['count'] for item in device_breakdown}
+            # Top traffic days (days of the week with most views)
+            top_days = sorted(
+                (item for item in weekdays if item['views_total']),
+                key=lambda item: item['views_total'],
+                reverse=True
+            )[:3]
+            top_traffic_days = [day_names[item['day']] for item in top_days]
             
             # Engagement metrics
-            engagement = PropertyEngagement.objects.filter(property=prop).first()
-            
-            # Likes count
-            likes_count = PropertyLike.objects.filter(property=prop).count()
-            
-            # Contact attempts (PropertyVisit)
-            contact_attempts = PropertyVisit.objects.filter(property=prop).count()
-            
-            # Top traffic days (days with most views)
-            top_days = PropertyViewEvent.objects.filter(
-                property=prop,
-                viewed_at__gte=start_date
-            ).extra(
-                select={'day_name': "strftime('%%w', viewed_at)"}
-            ).values('day_name').annotate(
-                count=Count('id')
-            ).order_by('-count')[:3]
-            
-            day_names = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
-            top_traffic_days = [day_names[int(item['day_name'])] for item in top_days if item['day_name']]
+            engagement = getattr(prop, 'engagement_metrics', None)
             
             performance_data.append({
                 'property_id': prop.id,
                 'title': prop.title,
-                'views_over_time': views_over_time,
+                'views_over_time': views_over_time.get(prop.id, []),
                 'total_views': prop.view_count,
-                'likes': likes_count,
+                'likes': prop.likes_total,
                 'shares': engagement.total_shares if engagement else 0,
-                'contact_attempts': contact_attempts,
+                'contact_attempts': prop.contact_attempts_total,
                 'top_traffic_days': top_traffic_days,
                 'device_breakdown': {
-                    'mobile': device_data.get('mobile', 0),
-                    'desktop': device_data.get('desktop', 0),
-                    'tablet': device_data.get('tablet', 0),
+                    'mobile': sum(item['mobile'] for item in weekdays),
+                    'desktop': sum(item['desktop'] for item in weekdays),
+                    'tablet': sum(item['tablet'] for item in weekdays),
                 }
             })
         
@@ -204,29 +198,8 @@ class AgentAnalyticsService:
             created_at__gte=start_date_30d
         ).count()
         
-        # Calculate average response time
-        agent_responses = Message.objects.filter(
-            conversation__agent=self.agent,
-            sender=self.agent,
-            created_at__gte=start_date_30d
-        ).select_related('conversation')
-        
-        total_response_time = 0
-        response_count = 0
-        
-        for response in agent_responses:
-            # Find the previous message in the conversation
-            prev_message = Message.objects.filter(
-                conversation=response.conversation,
-                created_at__lt=response.created_at
-            ).exclude(sender=self.agent).order_by('-created_at').first()
-            
-            if prev_message:
-                time_diff = response.created_at - prev_message.created_at
-                total_response_time += time_diff.total_seconds()
-                response_count += 1
-        
-        avg_response_time = total_response_time / response_count if response_count > 0 else 0
+        # Average response time, from the daily AgentLeadMetrics rollups
+        avg_response_time = self._average_response_time(timezone.localdate(start_date_30d))
         avg_response_time_str = self._format_response_time(avg_response_time)
         
         # Most inquired property
@@ -299,24 +272,30 @@ class AgentAnalyticsService:
         week_start = today - timedelta(days=today.weekday())
         
         # Get or calculate this week's patterns
-        patterns = WeeklyEngagementPattern.objects.filter(
-            agent=self.agent,
-            week_start_date=week_start
-        ).order_by('day_of_week')
+        patterns = {
+            pattern.day_of_week: pattern
+            for pattern in WeeklyEngagementPattern.objects.filter(
+                agent=self.agent,
+                week_start_date=week_start
+            )
+        }
         
         # If no patterns exist, calculate them
-        if not patterns.exists():
+        if not patterns:
             self._calculate_weekly_patterns(week_start)
-            patterns = WeeklyEngagementPattern.objects.filter(
-                agent=self.agent,
-                week_start_date=week_start
-            ).order_by('day_of_week')
+            patterns = {
+                pattern.day_of_week: pattern
+                for pattern in WeeklyEngagementPattern.objects.filter(
+                    agent=self.agent,
+                    week_start_date=week_start
+                )
+            }
         
         days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         heatmap_data = []
         
         for day in days:
-            pattern = patterns.filter(day_of_week=day).first()
+            pattern = patterns.get(day)
             heatmap_data.append({
                 'day': day,
                 'level': pattern.activity_level if pattern else 'Low'
@@ -399,11 +378,8 @@ class AgentAnalyticsService:
             })
         
         # Pending conversations
-        from communications.models import Message
-        pending_messages = Message.objects.filter(
-            conversation__agent=self.agent,
-            read_at__isnull=True
-        ).exclude(sender=self.agent).count()
+        from communications.read_state import unread_total
+        pending_messages = unread_total(self.agent, conversation__agent=self.agent)
         
         if pending_messages > 0:
             quick_wins.append({
@@ -433,6 +409,27 @@ class AgentAnalyticsService:
         
         return quick_wins
     
+    def _average_response_time(self, start_date):
+        """
+        Average response time in seconds since ``start_date`` across all
+        replies. Days from the latest stored rollup (or ``start_date``)
+        through today are recomputed first, so the figure stays current
+        between rollup_analytics runs.
+        """
+        from properties.analytics_rollup import rollup_agent_metrics
+        
+        metrics = AgentLeadMetrics.objects.filter(agent=self.agent, date__gte=start_date)
+        latest = metrics.aggregate(latest=Max('date'))['latest']
+        rollup_agent_metrics(latest or start_date, timezone.localdate(), agent_ids=[self.agent.id])
+        
+        totals = metrics.aggregate(
+            seconds=Sum('total_response_seconds'),
+            responses=Sum('total_responses'),
+        )
+        if not totals['responses']:
+            return 0
+        return totals['seconds'] / totals['responses']
+    
     def _format_response_time(self, seconds):
         """Format response time in human-readable format"""
         if seconds < 60:
@@ -449,43 +446,14 @@ class AgentAnalyticsService:
     
     def _calculate_weekly_patterns(self, week_start):
         """Calculate weekly engagement patterns for the agent"""
-        week_end = week_start + timedelta(days=7)
+        from properties.analytics_rollup import rollup_property_stats, rollup_weekly_patterns
         
-        days_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        week_end = week_start + timedelta(days=6)
         
-        for i, day_name in enumerate(days_of_week):
-            day_date = week_start + timedelta(days=i)
-            next_day = day_date + timedelta(days=1)
-            
-            # Count views for this day
-            views = PropertyViewEvent.objects.filter(
-                property__owner=self.agent,
-                viewed_at__gte=day_date,
-                viewed_at__lt=next_day
-            ).count()
-            
-            # Count inquiries for this day
-            inquiries = PropertyVisit.objects.filter(
-                property__owner=self.agent,
-                created_at__gte=day_date,
-                created_at__lt=next_day
-            ).count()
-            
-            # Create or update pattern
-            pattern, created = WeeklyEngagementPattern.objects.get_or_create(
-                agent=self.agent,
-                week_start_date=week_start,
-                day_of_week=day_name,
-                defaults={
-                    'total_views': views,
-                    'total_inquiries': inquiries
-                }
-            )
-            
-            if not created:
-                pattern.total_views = views
-                pattern.total_inquiries = inquiries
-                pattern.save()
-            
-            # Calculate activity level
-            pattern.calculate_activity_level()
+        # Roll up this week for the agent's properties only, then derive the pattern
+        rollup_property_stats(
+            week_start,
+            week_end,
+            properties=Property.objects.filter(owner=self.agent)
+        )
+        rollup_weekly_patterns(week_start, week_end, agent_ids=[self.agent.id])
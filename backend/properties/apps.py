@@ -5,3 +5,7 @@ class PropertiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'properties'
     verbose_name = 'Properties'
+
+    def ready(self):
+        """Import signal handlers when app is ready"""
+        import properties.signals  # noqa
@@ -1,6 +1,57 @@
 import django_filters
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ValidationError
+from utils.geo import EARTH_RADIUS_KM, bbox_prefixes, radius_bbox
 from .models import Property
 
+DEFAULT_NEAR_RADIUS_KM = 5
+MAX_NEAR_RADIUS_KM = 200
+
+
+def _parse_floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except (TypeError, ValueError):
+        numbers = []
+    if len(numbers) != count:
+        raise ValidationError({name: f'Expected {count} comma-separated numbers.'})
+    return numbers
+
+
+def _validate_lat_lng(lat, lng, name):
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValidationError({name: 'Coordinates are out of range.'})
+
+
+def within_bbox(queryset, min_lat, min_lng, max_lat, max_lng):
+    """Filter to properties inside a box, using the geohash index to narrow candidates."""
+    queryset = queryset.filter(
+        latitude__gte=min_lat, latitude__lte=max_lat,
+        longitude__gte=min_lng, longitude__lte=max_lng,
+    )
+    prefixes = bbox_prefixes(min_lat, min_lng, max_lat, max_lng)
+    if prefixes:
+        cells = Q()
+        for prefix in prefixes:
+            cells |= Q(geohash__startswith=prefix)
+        queryset = queryset.filter(cells)
+    return queryset
+
+
+def distance_km_expression(lat, lng):
+    """Haversine distance in km from (lat, lng) to each property's coordinates."""
+    lat_field = Cast(F('latitude'), FloatField())
+    lng_field = Cast(F('longitude'), FloatField())
+    half_dlat = Radians(lat_field - Value(lat)) / 2
+    half_dlng = Radians(lng_field - Value(lng)) / 2
+    a = (
+        Power(Sin(half_dlat), 2)
+        + Cos(Radians(Value(lat))) * Cos(Radians(lat_field)) * Power(Sin(half_dlng), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a))
+
+
 class PropertyFilter(django_filters.FilterSet):
     min_price = django_filters.NumberFilter(field_name="price", lookup_expr='gte')
     max_price = django_filters.NumberFilter(field_name="price", lookup_expr='lte')
@@ -11,13 +62,40 @@ class PropertyFilter(django_filters.FilterSet):
     bathrooms = django_filters.NumberFilter(lookup_expr='gte')
     amenities = django_filters.CharFilter(method='filter_amenities')
     agent = django_filters.CharFilter(field_name='owner__username', lookup_expr='icontains')
+    # bbox=min_lat,min_lng,max_lat,max_lng (south, west, north, east)
+    bbox = django_filters.CharFilter(method='filter_bbox')
+    # near=lat,lng with optional radius=<km>; results are sorted by distance
+    near = django_filters.CharFilter(method='filter_near')
     
     class Meta:
         model = Property
-        fields = ['min_price', 'max_price', 'property_type', 'listing_type', 'city', 'bedrooms', 'bathrooms', 'amenities', 'status', 'is_published', 'owner']
+        fields = ['min_price', 'max_price', 'property_type', 'listing_type', 'city', 'bedrooms', 'bathrooms', 'amenities', 'status', 'is_published', 'owner', 'bbox', 'near']
 
     def filter_amenities(self, queryset, name, value):
         amenities_list = value.split(',')
         for amenity in amenities_list:
             queryset = queryset.filter(property_features__features__icontains=amenity.strip())
         return queryset
+
+    def filter_bbox(self, queryset, name, value):
+        min_lat, min_lng, max_lat, max_lng = _parse_floats(value, 4, name)
+        _validate_lat_lng(min_lat, min_lng, name)
+        _validate_lat_lng(max_lat, max_lng, name)
+        if min_lat > max_lat or min_lng > max_lng:
+            raise ValidationError({name: 'Expected min_lat,min_lng,max_lat,max_lng.'})
+        return within_bbox(queryset, min_lat, min_lng, max_lat, max_lng)
+
+    def filter_near(self, queryset, name, value):
+        lat, lng = _parse_floats(value, 2, name)
+        _validate_lat_lng(lat, lng, name)
+        try:
+            radius = float(self.data.get('radius', DEFAULT_NEAR_RADIUS_KM))
+        except (TypeError, ValueError):
+            raise ValidationError({'radius': 'Radius must be a number of kilometres.'})
+        if not 0 < radius <= MAX_NEAR_RADIUS_KM:
+            raise ValidationError({'radius': f'Radius must be between 0 and {MAX_NEAR_RADIUS_KM} km.'})
+
+        queryset = within_bbox(queryset, *radius_bbox(lat, lng, radius))
+        return queryset.annotate(
+            distance_km=distance_km_expression(lat, lng)
+        ).filter(distance_km__lte=radius).order_by('distance_km')
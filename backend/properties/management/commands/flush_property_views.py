@@ -0,0 +1,46 @@
+"""
+Django management command to write buffered property views to the database.
+Only needed with REDIS_URL set (the in-process buffer is flushed by the web
+workers themselves). Run under a process manager:
+    python manage.py flush_property_views --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.view_tracking import flush_views
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered property view counts and view events to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep flushing until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds between flushes when running with --loop (default: 5)',
+        )
+        parser.add_argument(
+            '--max-events',
+            type=int,
+            default=5000,
+            help='Maximum number of view events written per flush (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            properties_updated, events_created = flush_views(max_events=options['max_events'])
+            if properties_updated or events_created or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'✓ Updated view counts for {properties_updated} properties, '
+                    f'created {events_created} view events'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+"""
+Django management command to apply side effects of completed M-Pesa payments.
+Callbacks normally apply them in the background right after acknowledging
+Safaricom; this picks up events a crashed or restarted worker left behind:
+    python manage.py process_payment_events --loop --interval 30
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.payments import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply subscription changes for completed payments whose callbacks were not fully processed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep processing until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=30.0,
+            help='Seconds between sweeps when running with --loop (default: 30)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Maximum number of events applied per sweep (default: 100)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            applied = process_pending_events(limit=options['batch_size'])
+            if applied or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'✓ Applied {applied} payment events'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
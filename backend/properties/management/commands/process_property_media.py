@@ -0,0 +1,54 @@
+"""
+Django management command to generate renditions for pending property photos.
+Uploads are normally processed by the web workers right after they commit;
+this backfills photos uploaded before the pipeline existed and picks up any
+left pending by a restarted worker:
+    python manage.py process_property_media
+    python manage.py process_property_media --loop --interval 60
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.media import process_pending_media
+
+
+class Command(BaseCommand):
+    help = 'Generate resized JPEG/WebP renditions for pending property photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep processing until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds between passes when running with --loop (default: 60)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Maximum number of photos processed per batch (default: 50)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            ready = failed = 0
+            # Drain the pending backlog batch by batch
+            while True:
+                counts = process_pending_media(limit=options['batch_size'])
+                ready += counts['ready']
+                failed += counts['failed']
+                if counts['ready'] + counts['failed'] < options['batch_size']:
+                    break
+            if ready or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'✓ Processed {ready} photos, {failed} failed'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+"""
+Django management command to rebuild the property full-text search index.
+Run after bulk imports that bypass model signals (e.g. bulk_create).
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from properties import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all properties'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of properties fetched per batch',
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING(
+                f'Full-text search is not available on {connection.vendor}; nothing to do.'
+            ))
+            return
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {search.SEARCH_TABLE}")
+            count = search.rebuild_index(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Indexed {count} properties.'))
@@ -0,0 +1,68 @@
+"""
+Django management command to resolve M-Pesa payments stuck in pending.
+Queries Daraja for payments whose callback never arrived, with bounded
+concurrency and within MPESA_STATUS_QUERY_RATE. Run under a process manager:
+    python manage.py reconcile_payments --loop --interval 60
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from properties.payments import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Query Safaricom for stale pending M-Pesa payments and apply the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep reconciling until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds between sweeps when running with --loop (default: 60)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of payments read and updated per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Status queries in flight at once (default: 4)',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            help='Only payments pending for at least this many seconds (default: MPESA_RECONCILE_MIN_AGE)',
+        )
+        parser.add_argument(
+            '--expire-after',
+            type=int,
+            default=24 * 60 * 60,
+            help='Cancel payments still unresolved after this many seconds (default: 86400, 0 to disable)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            totals = reconcile_payments(
+                batch_size=options['batch_size'],
+                min_age=options['min_age'],
+                concurrency=options['concurrency'],
+                expire_after=options['expire_after'] or None,
+            )
+            if totals['checked'] or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"✓ Checked {totals['checked']} payments: {totals['completed']} completed, "
+                    f"{totals['cancelled']} cancelled, {totals['expired']} expired"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
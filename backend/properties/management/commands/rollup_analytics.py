@@ -0,0 +1,66 @@
+"""
+Django management command to refresh the agent analytics rollups.
+Dashboards read these tables, so keep it running under a process manager
+(each pass only revisits yesterday and today):
+    python manage.py rollup_analytics --loop --interval 900
+or from cron:
+    */15 * * * * python manage.py rollup_analytics
+Backfill history once with: python manage.py rollup_analytics --since 2024-01-01
+"""
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from properties.analytics_rollup import DEFAULT_LOOKBACK_DAYS, run_rollups
+
+
+class Command(BaseCommand):
+    help = 'Update daily per-property and per-agent analytics aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=DEFAULT_LOOKBACK_DAYS,
+            help=f'Number of days before today to recompute (default: {DEFAULT_LOOKBACK_DAYS})',
+        )
+        parser.add_argument(
+            '--since',
+            help='Recompute every day from this date (YYYY-MM-DD) until today',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep rolling up until interrupted',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=900.0,
+            help='Seconds between passes when running with --loop (default: 900)',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+
+        while True:
+            end_date = timezone.localdate()
+            start_date = since or end_date - timedelta(days=max(options['days'], 0))
+
+            written = run_rollups(start_date, end_date)
+
+            self.stdout.write(self.style.SUCCESS(f'✓ Rolled up analytics from {start_date} to {end_date}:'))
+            for table, count in written.items():
+                self.stdout.write(f'  - {table}: {count} rows')
+            if not options['loop']:
+                break
+            # A --since backfill only needs to run once; later passes are incremental
+            since = None
+            time.sleep(options['interval'])
@@ -0,0 +1,206 @@
+"""
+Resized renditions for property photos.
+
+Uploads are stored as-is and answered right away. After the upload's
+transaction commits, ``schedule_processing`` hands the new rows to a small
+thread pool; Pillow releases the GIL while decoding, resizing and encoding.
+For each photo, ``process_media`` writes:
+
+- a JPEG and a WebP file per rendition in ``RENDITIONS``, bounded by the
+  long-edge size in pixels (images are never upscaled);
+- the original's dimensions and a BlurHash placeholder.
+
+Each worker claims a row before rendering it: the row moves to
+``processing`` with a ``PROCESSING_LEASE``, so the web pool and the
+``process_property_media`` command never render the same photo at once.
+Rows left ``processing`` by a crashed worker become due again when the
+lease runs out.
+
+Serializers fall back to the original image until ``processing_status`` is
+``ready``. The command also backfills photos uploaded before the pipeline
+existed.
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from utils import blurhash
+
+from .models import MediaProperty
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': 320,
+    'card': 800,
+    'full': 1920,
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+BLURHASH_SIZE = 32
+RENDITION_PATH = 'property_images/renditions/{id}/{name}.{ext}'
+PROCESSING_LEASE = 600
+ORIENTATION_TAG = 0x0112
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _store(path, data):
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(data))
+
+
+def render(media):
+    """Write ``media``'s renditions; returns the fields to update"""
+    with media.Images.open('rb') as original:
+        image = Image.open(original)
+        width, height = image.size
+        # EXIF orientations 5-8 are rotated by 90 degrees
+        if image.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEGs can be decoded straight at a reduced scale
+        image.draft('RGB', (RENDITIONS['full'], RENDITIONS['full']))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    renditions = {}
+    for name, long_edge in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+        resized = image.copy()
+        resized.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        renditions[name] = {
+            'jpeg': _store(RENDITION_PATH.format(id=media.id, name=name, ext='jpg'), _encode(resized, 'jpeg')),
+            'webp': _store(RENDITION_PATH.format(id=media.id, name=name, ext='webp'), _encode(resized, 'webp')),
+            'width': resized.width,
+            'height': resized.height,
+        }
+        # Each smaller rendition is resized from the previous one
+        image = resized
+
+    placeholder = image.copy()
+    placeholder.thumbnail((BLURHASH_SIZE, BLURHASH_SIZE))
+    return {
+        'renditions': renditions,
+        'width': width,
+        'height': height,
+        'blurhash': blurhash.encode(placeholder),
+        'processing_status': 'ready',
+    }
+
+
+def _claim(media_ids=None, limit=None):
+    """Atomically take due rows (all of ``media_ids``, or up to ``limit``); returns their ids"""
+    now = timezone.now()
+    due = Q(processing_status='pending') | Q(processing_status='processing', processing_lease_until__lt=now)
+    with transaction.atomic():
+        candidates = MediaProperty.objects.select_for_update(skip_locked=True).filter(due)
+        if media_ids is not None:
+            candidates = candidates.filter(id__in=media_ids)
+        ids = list(candidates.order_by('id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        MediaProperty.objects.filter(id__in=ids).update(
+            processing_status='processing',
+            processing_lease_until=now + timedelta(seconds=PROCESSING_LEASE),
+        )
+    return ids
+
+
+def process_media(media_id):
+    """
+    Generate renditions for one MediaProperty; returns its new processing status,
+    or None if the row is gone or another worker holds it
+    """
+    if not _claim([media_id]):
+        return None
+    return _process_claimed(media_id)
+
+
+def _process_claimed(media_id):
+    media = MediaProperty.objects.filter(id=media_id).first()
+    if media is None:
+        return None
+    if not media.Images:
+        fields = {'processing_status': 'ready'}
+    else:
+        try:
+            fields = render(media)
+        except Exception as e:
+            logger.error(f"Failed to process property image {media_id}: {e}", exc_info=True)
+            fields = {'processing_status': 'failed'}
+    MediaProperty.objects.filter(id=media_id).update(processing_lease_until=None, **fields)
+    return fields['processing_status']
+
+
+def process_pending_media(limit=50):
+    """Claim and process up to ``limit`` due uploads; returns ``{status: count}``"""
+    media_ids = _claim(limit=limit)
+    counts = {'ready': 0, 'failed': 0}
+    if not media_ids:
+        return counts
+    with ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix='media-cli') as pool:
+        for status in pool.map(_process_claimed_in_thread, media_ids):
+            if status in counts:
+                counts[status] += 1
+    return counts
+
+
+def _workers():
+    return getattr(settings, 'MEDIA_PROCESSING_WORKERS', 2)
+
+
+def _process_in_thread(media_id):
+    try:
+        return process_media(media_id)
+    finally:
+        connection.close()
+
+
+def _process_claimed_in_thread(media_id):
+    try:
+        return _process_claimed(media_id)
+    finally:
+        connection.close()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_workers(), thread_name_prefix='media')
+    return _executor
+
+
+def schedule_processing(media_ids):
+    """Process ``media_ids`` in the background once the current transaction commits"""
+    media_ids = list(media_ids)
+    if not media_ids:
+        return
+
+    def submit():
+        executor = _get_executor()
+        for media_id in media_ids:
+            executor.submit(_process_in_thread, media_id)
+
+    transaction.on_commit(submit)
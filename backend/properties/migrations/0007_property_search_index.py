@@ -0,0 +1,33 @@
+# Generated manually for the property full-text search index
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from properties import search
+
+    search.create_index(schema_editor)
+
+    # Backfill existing listings
+    Property = apps.get_model('properties', 'Property')
+    db_alias = schema_editor.connection.alias
+    if search.is_supported(schema_editor.connection):
+        for prop in Property.objects.using(db_alias).select_related('owner').iterator(chunk_size=500):
+            search.index_property(prop)
+
+
+def drop_search_index(apps, schema_editor):
+    from properties import search
+
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0006_propertyengagement_agentleadmetrics_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
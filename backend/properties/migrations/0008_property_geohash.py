@@ -0,0 +1,36 @@
+# Generated by Django 5.1 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+def backfill_geohash(apps, schema_editor):
+    from utils.geo import encode_geohash
+
+    Property = apps.get_model('properties', 'Property')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    located = Property.objects.using(db_alias).filter(latitude__isnull=False, longitude__isnull=False)
+    for prop in located.only('id', 'latitude', 'longitude').iterator(chunk_size=500):
+        prop.geohash = encode_geohash(float(prop.latitude), float(prop.longitude))
+        batch.append(prop)
+        if len(batch) >= 500:
+            Property.objects.using(db_alias).bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Property.objects.using(db_alias).bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0007_property_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
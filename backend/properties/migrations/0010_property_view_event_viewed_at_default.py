@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-17 03:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0009_feed_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='propertyviewevent',
+            name='viewed_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-17 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0010_property_view_event_viewed_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('mobile_views', models.PositiveIntegerField(default=0)),
+                ('desktop_views', models.PositiveIntegerField(default=0)),
+                ('tablet_views', models.PositiveIntegerField(default=0)),
+                ('inquiries', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='properties.property')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['property', '-date'], name='properties__propert_c61437_idx')],
+                'unique_together': {('property', 'date')},
+            },
+        ),
+    ]
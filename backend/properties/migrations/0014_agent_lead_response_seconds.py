@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-17 05:23
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_response_seconds(apps, schema_editor):
+    # Best available estimate until the days are rolled up again
+    AgentLeadMetrics = apps.get_model('properties', 'AgentLeadMetrics')
+    AgentLeadMetrics.objects.using(schema_editor.connection.alias).update(
+        total_response_seconds=F('response_time_minutes') * 60 * F('total_responses')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0013_media_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agentleadmetrics',
+            name='total_response_seconds',
+            field=models.PositiveBigIntegerField(default=0, help_text='Sum of response times in seconds this day'),
+        ),
+        migrations.RunPython(backfill_response_seconds, migrations.RunPython.noop),
+    ]
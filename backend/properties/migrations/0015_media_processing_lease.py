@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-17 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0014_agent_lead_response_seconds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaproperty',
+            name='processing_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mediaproperty',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+    ]
@@ -2,16 +2,18 @@ from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as _
 from datetime import timedelta
 import uuid
 from features.models import SubscriptionPlan
+from utils.geo import encode_geohash
 from .validators import FileTypeValidator
 
 # Import analytics models to register them with Django
 from .analytics_models import (
-    PropertyViewEvent, PropertyEngagement, AgentLeadMetrics,
+    PropertyViewEvent, PropertyEngagement, PropertyDailyStats, AgentLeadMetrics,
     GeographicInsight, WeeklyEngagementPattern
 )
 
@@ -85,6 +87,8 @@ class Property(models.Model):
     latitude = models.DecimalField(max_digits=20, decimal_places=12, null=True, blank=True)
     longitude = models.DecimalField(max_digits=20, decimal_places=12, null=True, blank=True)
     google_place_id = models.CharField(max_length=255, blank=True, null=True)
+    # Geohash of latitude/longitude, kept in sync on save to index map queries
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
     
     # Publishing & Business Logic
     is_published = models.BooleanField(default=False)
@@ -100,11 +104,28 @@ class Property(models.Model):
     archived_at = models.DateTimeField(null=True, blank=True, help_text="When property was archived")
     auto_archive_days = models.IntegerField(default=7, help_text="Days before auto-archiving sold/rented properties")
 
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of the public feed
+            models.Index(fields=['-created_at', '-id'], name='property_feed_idx'),
+        ]
+
     def get_lat_lng(self):
         """Return persisted latitude and longitude, if available."""
         if self.latitude is not None and self.longitude is not None:
             return str(self.latitude), str(self.longitude)
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'latitude', 'longitude'} & set(update_fields):
+            if self.latitude is not None and self.longitude is not None:
+                self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+            else:
+                self.geohash = ''
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
 
 class PropertyVisit(models.Model):
     """
@@ -185,8 +206,32 @@ class MediaProperty(models.Model):
         validators=[validate_video]
     )
     caption = models.TextField(max_length=100, blank=True)
+
+    # Filled in by properties.media after upload
+    PROCESSING_STATUS = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUS, default='pending', db_index=True)
+    # A 'processing' row whose lease has run out is picked up again
+    processing_lease_until = models.DateTimeField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    blurhash = models.CharField(max_length=64, blank=True, default='')
+    # {rendition name: {'jpeg': path, 'webp': path, 'width': px, 'height': px}}
+    renditions = models.JSONField(default=dict, blank=True)
+
     class Meta:
         app_label = 'properties'
+
+    def rendition_url(self, name, fmt='jpeg'):
+        """URL of a generated rendition, or of the original image until it is ready"""
+        path = (self.renditions or {}).get(name, {}).get(fmt)
+        if path:
+            return default_storage.url(path)
+        return self.Images.url if self.Images else None
         
 class PropertyFeature(models.Model):
     features = models.CharField(max_length=100)
@@ -231,7 +276,7 @@ class Payment(models.Model):
     )
     method = models.CharField(max_length=20, choices=PAYMENT_METHODS)
     amount = models.DecimalField(max_digits=12, decimal_places=2)
-    transaction_id = models.CharField(max_length=128, blank=True)
+    transaction_id = models.CharField(max_length=128, blank=True, db_index=True)
     status = models.CharField(max_length=32, choices=PAYMENT_STATUS)
     raw_payload = models.JSONField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -244,6 +289,33 @@ class Payment(models.Model):
         return f"{self.method} {self.amount} {self.status}"
 
 
+class MpesaCallbackEvent(models.Model):
+    """
+    One row per STK push callback from Safaricom, keyed by CheckoutRequestID.
+
+    The unique key makes retried and duplicate callbacks no-ops. Side effects
+    of a completed payment (subscription activation) are applied after the
+    callback is acknowledged; ``processed_at`` stays empty until they are.
+    """
+    checkout_request_id = models.CharField(max_length=128, unique=True)
+    merchant_request_id = models.CharField(max_length=128, blank=True)
+    result_code = models.IntegerField()
+    result_desc = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField()
+    payment = models.ForeignKey(
+        Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='callback_events'
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        app_label = 'properties'
+        ordering = ['-received_at']
+
+    def __str__(self):
+        return f"{self.checkout_request_id} ({self.result_code})"
+
+
 # Models from support app
 class SupportTicket(models.Model):
     PRIORITY_CHOICES = (
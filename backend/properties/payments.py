@@ -0,0 +1,406 @@
+"""
+M-Pesa payment state transitions.
+
+Callbacks from Safaricom are written to ``MpesaCallbackEvent`` first. Its
+unique CheckoutRequestID turns retried and duplicate callbacks into no-ops.
+The payment then moves out of ``pending`` with a conditional
+``UPDATE ... WHERE status = 'pending'``, so only the first result counts and
+no row locks are held while Safaricom waits for its acknowledgement.
+
+Side effects of a completed payment (activating or extending the agent's
+subscription) run after the callback's transaction commits, on a small
+background pool. ``processed_at`` is set in the same transaction as the side
+effects, so each event is applied once. The ``process_payment_events``
+command picks up anything a crashed worker left behind.
+
+Payments whose callback never arrives are resolved by ``reconcile_payments``
+(the ``reconcile_payments`` command). It queries Daraja for stale pending
+payments with bounded concurrency, within the ``MPESA_STATUS_QUERY_RATE``
+limit that all workers share, and applies the results in bulk. Status
+queries record an event just as callbacks do, so side effects follow the
+same path.
+
+Every resolved payment is pushed to its owner's ``payments_<user id>``
+channel group (joined by communications.consumers.NotificationConsumer), so
+checkout pages don't have to poll ``payment_status``.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from communications.throttles import check_rate
+from utils.mpesa_daraja import MpesaDarajaError, get_mpesa_service
+
+from .models import AgentProfile, MpesaCallbackEvent, Payment
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_PERIOD = timedelta(days=30)
+SIDE_EFFECT_WORKERS = 2
+STATUS_QUERY_RATE_KEY = 'mpesa:status_query'
+# Fields needed to transition a payment and publish its new status
+TRANSITION_FIELDS = (
+    'id', 'user_id', 'status', 'raw_payload', 'property_id', 'transaction_id', 'amount', 'method'
+)
+
+
+def payment_group(user_id):
+    """Channel-layer group that receives ``payment_status`` events for ``user_id``'s payments"""
+    return f'payments_{user_id}'
+
+
+def payment_status_payload(payment):
+    """Public status of a payment, as returned by payment_status and pushed over WebSockets"""
+    raw_payload = payment.raw_payload if isinstance(payment.raw_payload, dict) else {}
+    return {
+        'id': payment.id,
+        'status': payment.status,
+        'transaction_id': payment.transaction_id,
+        'mpesa_receipt_number': (raw_payload.get('callback') or {}).get('MpesaReceiptNumber'),
+        'amount': str(payment.amount),
+        'method': payment.method,
+        'property_id': payment.property_id,
+    }
+
+
+def publish_status(payments):
+    """Push each payment's status to its owner's open sockets"""
+    from communications.notification_service import NotificationService
+
+    NotificationService.broadcast_many([
+        (payment_group(payment.user_id), {'type': 'payment.status', 'payment': payment_status_payload(payment)})
+        for payment in payments
+    ])
+
+
+def get_status_for_user(payment_id, user_id):
+    """Status payload of ``user_id``'s payment ``payment_id``, or None"""
+    payment = Payment.objects.filter(id=payment_id, user_id=user_id).only(*TRANSITION_FIELDS).first()
+    return payment_status_payload(payment) if payment else None
+
+
+def transition_payment(payment, new_status, details):
+    """
+    Move ``payment`` out of ``pending``, merging ``details`` into raw_payload.
+
+    Returns False without writing if the payment already left ``pending``
+    (another callback, a status query or reconciliation got there first).
+    """
+    if payment.status != 'pending':
+        return False
+    raw_payload = {**(payment.raw_payload or {}), **details}
+    updated = Payment.objects.filter(id=payment.id, status='pending').update(
+        status=new_status, raw_payload=raw_payload
+    )
+    if updated:
+        payment.status, payment.raw_payload = new_status, raw_payload
+    return bool(updated)
+
+
+def extend_subscription(user_id, now=None):
+    """Activate ``user_id``'s agent subscription, extending it if still running"""
+    now = now or timezone.now()
+    return AgentProfile.objects.filter(user_id=user_id).update(
+        subscription_active=True,
+        subscription_expires=Case(
+            When(subscription_expires__gt=now, then=F('subscription_expires') + SUBSCRIPTION_PERIOD),
+            default=Value(now + SUBSCRIPTION_PERIOD),
+            output_field=models.DateTimeField(),
+        ),
+    )
+
+
+def ingest_callback(callback_data):
+    """
+    Record an STK push callback and apply its result to the payment.
+
+    Returns one of ``'duplicate'``, ``'unmatched'`` (no payment yet),
+    ``'stale'`` (payment already resolved) or the payment's new status.
+    """
+    checkout_request_id = callback_data['CheckoutRequestID']
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                event = MpesaCallbackEvent.objects.create(
+                    checkout_request_id=checkout_request_id,
+                    merchant_request_id=callback_data.get('MerchantRequestID') or '',
+                    result_code=int(callback_data.get('ResultCode', -1)),
+                    result_desc=(callback_data.get('ResultDesc') or '')[:255],
+                    payload=callback_data,
+                )
+        except IntegrityError:
+            logger.info(f"Duplicate M-Pesa callback ignored: {checkout_request_id}")
+            return 'duplicate'
+
+        payment = Payment.objects.filter(transaction_id=checkout_request_id).only(*TRANSITION_FIELDS).first()
+        if payment is None:
+            logger.warning(f"Payment not found for CheckoutRequestID: {checkout_request_id}")
+            return 'unmatched'
+        return apply_callback_event(event, payment)
+
+
+def apply_callback_event(event, payment):
+    """Apply a recorded callback to its payment and queue any side effects"""
+    callback_data = event.payload
+    if event.result_code == 0:
+        new_status = 'completed'
+        details = {
+            'callback': callback_data,
+            'mpesa_receipt_number': callback_data.get('MpesaReceiptNumber'),
+            'transaction_date': callback_data.get('TransactionDate'),
+        }
+    else:
+        new_status = 'cancelled'
+        details = {'callback': callback_data, 'error': event.result_desc}
+
+    transitioned = transition_payment(payment, new_status, details)
+    has_side_effects = transitioned and new_status == 'completed' and payment.property_id
+    MpesaCallbackEvent.objects.filter(id=event.id).update(
+        payment=payment, processed_at=None if has_side_effects else timezone.now()
+    )
+    if has_side_effects:
+        transaction.on_commit(lambda: schedule_side_effects(event.id))
+    if transitioned:
+        transaction.on_commit(lambda: publish_status([payment]))
+
+    if not transitioned:
+        logger.info(f"Callback for already resolved payment {payment.id} ignored")
+        return 'stale'
+    logger.info(f"Payment {new_status}: Payment ID {payment.id}, CheckoutRequestID: {event.checkout_request_id}")
+    return new_status
+
+
+def apply_early_callback(payment):
+    """
+    Apply a callback that arrived before ``payment`` was saved.
+
+    Safaricom can answer an STK push before the view that sent it has
+    stored the Payment, leaving the callback unmatched.
+    """
+    event = MpesaCallbackEvent.objects.filter(
+        checkout_request_id=payment.transaction_id, payment__isnull=True
+    ).first()
+    if event is None:
+        return None
+    return apply_callback_event(event, payment)
+
+
+def apply_side_effects(event_id):
+    """Apply a completed payment's side effects once; returns False if already done"""
+    with transaction.atomic():
+        claimed = MpesaCallbackEvent.objects.filter(id=event_id, processed_at__isnull=True).update(
+            processed_at=timezone.now()
+        )
+        if not claimed:
+            return False
+        owner_id = MpesaCallbackEvent.objects.filter(id=event_id).values_list(
+            'payment__property__owner_id', flat=True
+        ).first()
+        if owner_id and extend_subscription(owner_id):
+            logger.info(f"Agent subscription activated: User ID {owner_id}")
+    return True
+
+
+def process_pending_events(limit=100):
+    """Apply side effects of up to ``limit`` events; returns how many were applied"""
+    event_ids = list(
+        MpesaCallbackEvent.objects.filter(processed_at__isnull=True, payment__isnull=False)
+        .order_by('received_at')
+        .values_list('id', flat=True)[:limit]
+    )
+    applied = 0
+    for event_id in event_ids:
+        try:
+            applied += apply_side_effects(event_id)
+        except Exception as e:
+            logger.error(f"Failed to apply payment event {event_id}: {e}", exc_info=True)
+    return applied
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=SIDE_EFFECT_WORKERS, thread_name_prefix='payment-events'
+                )
+    return _executor
+
+
+def _run_side_effects(event_id):
+    try:
+        apply_side_effects(event_id)
+    except Exception as e:
+        # Left unprocessed for the process_payment_events sweep
+        logger.error(f"Failed to apply payment event {event_id}: {e}", exc_info=True)
+    finally:
+        connection.close()
+
+
+def schedule_side_effects(event_id):
+    """Apply an event's side effects in the background"""
+    _get_executor().submit(_run_side_effects, event_id)
+
+
+def _run_pending_events():
+    try:
+        process_pending_events()
+    finally:
+        connection.close()
+
+
+def schedule_pending_events():
+    """Apply all outstanding events' side effects in the background"""
+    _get_executor().submit(_run_pending_events)
+
+
+class StatusQueryThrottled(Exception):
+    """No status query slot became free within the caller's ``max_wait``"""
+
+
+def query_status(checkout_request_id, service=None, max_wait=None):
+    """
+    Ask Daraja for an STK push result, waiting for a slot in the shared rate limit.
+
+    ``max_wait`` bounds the wait in seconds (None waits as long as needed, for
+    workers); StatusQueryThrottled is raised when no slot frees up in time.
+
+    Returns the response, or None if the query failed (Daraja answers with
+    an error while the customer has not responded yet).
+    """
+    rate = getattr(settings, 'MPESA_STATUS_QUERY_RATE', 5)
+    deadline = None if max_wait is None else time.monotonic() + max_wait
+    while True:
+        allowed, wait = check_rate(STATUS_QUERY_RATE_KEY, rate, 1)
+        if allowed:
+            break
+        wait = max(wait, 0.05)
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise StatusQueryThrottled(checkout_request_id)
+        time.sleep(wait)
+    try:
+        return (service or get_mpesa_service()).query_payment_status(checkout_request_id)
+    except MpesaDarajaError as e:
+        logger.info(f"Status query for {checkout_request_id} unresolved: {e}")
+        return None
+
+
+def status_from_query(response):
+    """Map a status query response to 'completed'/'cancelled', or None while undecided"""
+    try:
+        result_code = int(response['ResultCode'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return 'completed' if result_code == 0 else 'cancelled'
+
+
+def apply_query_results(results):
+    """
+    Apply ``(payment, response)`` status query results in bulk.
+
+    Payments that already left ``pending`` are skipped. Returns
+    ``{'completed': n, 'cancelled': n}``.
+    """
+    resolved = {}
+    for payment, response in results:
+        new_status = status_from_query(response) if response else None
+        if new_status:
+            resolved[payment.id] = (new_status, response)
+    counts = {'completed': 0, 'cancelled': 0}
+    if not resolved:
+        return counts
+
+    now = timezone.now()
+    with transaction.atomic():
+        pending = list(
+            Payment.objects.select_for_update(skip_locked=True)
+            .filter(id__in=resolved, status='pending')
+            .only(*TRANSITION_FIELDS)
+        )
+        events = []
+        for payment in pending:
+            new_status, response = resolved[payment.id]
+            payment.status = new_status
+            payment.raw_payload = {**(payment.raw_payload or {}), 'status_query': response}
+            has_side_effects = new_status == 'completed' and payment.property_id
+            events.append(MpesaCallbackEvent(
+                checkout_request_id=payment.transaction_id,
+                merchant_request_id=response.get('MerchantRequestID') or '',
+                result_code=int(response['ResultCode']),
+                result_desc=(response.get('ResultDesc') or '')[:255],
+                payload={'source': 'status_query', **response},
+                payment=payment,
+                processed_at=None if has_side_effects else now,
+            ))
+            counts[new_status] += 1
+        Payment.objects.bulk_update(pending, ['status', 'raw_payload'])
+        # A callback recorded meanwhile already owns the CheckoutRequestID
+        MpesaCallbackEvent.objects.bulk_create(events, ignore_conflicts=True)
+        if counts['completed']:
+            transaction.on_commit(schedule_pending_events)
+        transaction.on_commit(lambda: publish_status(pending))
+    return counts
+
+
+def reconcile_payments(batch_size=100, min_age=None, concurrency=4, expire_after=None):
+    """
+    Resolve M-Pesa payments that are still pending ``min_age`` seconds after creation.
+
+    Payments are read in primary key batches and queried ``concurrency`` at
+    a time. If ``expire_after`` (seconds) is given, payments older than that
+    which Daraja still cannot resolve are cancelled.
+
+    Returns ``{'checked': n, 'completed': n, 'cancelled': n, 'expired': n}``.
+    """
+    if min_age is None:
+        min_age = getattr(settings, 'MPESA_RECONCILE_MIN_AGE', 60)
+    now = timezone.now()
+    stale = Payment.objects.filter(
+        method='mpesa', status='pending', created_at__lte=now - timedelta(seconds=min_age)
+    ).exclude(transaction_id='').only(*TRANSITION_FIELDS, 'created_at').order_by('id')
+    service = get_mpesa_service()
+    totals = {'checked': 0, 'completed': 0, 'cancelled': 0, 'expired': 0}
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='payment-reconcile') as pool:
+        while True:
+            batch = list(stale.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            responses = list(pool.map(lambda p: query_status(p.transaction_id, service), batch))
+            totals['checked'] += len(batch)
+            for new_status, n in apply_query_results(zip(batch, responses)).items():
+                totals[new_status] += n
+
+            if expire_after is not None:
+                expire_before = now - timedelta(seconds=expire_after)
+                unresolved = [
+                    p for p, response in zip(batch, responses)
+                    if p.created_at <= expire_before and not (response and status_from_query(response))
+                ]
+                if unresolved:
+                    with transaction.atomic():
+                        expired = list(
+                            Payment.objects.select_for_update(skip_locked=True)
+                            .filter(id__in=[p.id for p in unresolved], status='pending')
+                            .only(*TRANSITION_FIELDS)
+                        )
+                        Payment.objects.filter(id__in=[p.id for p in expired]).update(status='cancelled')
+                        for payment in expired:
+                            payment.status = 'cancelled'
+                        transaction.on_commit(lambda expired=expired: publish_status(expired))
+                    totals['expired'] += len(expired)
+    return totals
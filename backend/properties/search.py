@@ -0,0 +1,177 @@
+"""
+Full-text search index for property listings.
+
+The index lives in a side table maintained alongside ``Property``:
+
+- PostgreSQL: ``properties_property_search`` holds a weighted ``tsvector``
+  per property with a GIN index.
+- SQLite: ``properties_property_search`` is an FTS5 virtual table keyed by
+  the property id (its ``rowid``).
+
+Other database backends have no index; ``search_properties`` then falls back
+to ``icontains`` matching so the endpoint keeps working.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'properties_property_search'
+# 'simple' avoids English-only stemming for mixed English/Kiswahili listings
+SEARCH_CONFIG = 'simple'
+# Property fields copied into the index; saves touching none of them skip reindexing
+INDEXED_FIELDS = ('title', 'description', 'city', 'adress', 'owner', 'owner_id')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(conn=None):
+    """Return True when the database backend has a search index."""
+    conn = conn or connection
+    return conn.vendor in ('postgresql', 'sqlite')
+
+
+def create_index(schema_editor):
+    """Create the search table for the current backend (used by migrations)."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "property_id bigint PRIMARY KEY REFERENCES properties_property(id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, location, description, owner_name, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_index(schema_editor):
+    """Drop the search table for the current backend (used by migrations)."""
+    if is_supported(schema_editor.connection):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def _document_fields(prop):
+    owner = prop.owner
+    owner_name = f"{owner.first_name} {owner.last_name}".strip() if owner else ''
+    location = f"{prop.city or ''} {prop.adress or ''}".strip()
+    return prop.title or '', location, prop.description or '', owner_name
+
+
+def index_property(prop):
+    """Insert or refresh the search document for a single property."""
+    if not is_supported():
+        return
+    title, location, description, owner_name = _document_fields(prop)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (property_id, document) VALUES (%s, "
+                "setweight(to_tsvector(%s, %s), 'A') || setweight(to_tsvector(%s, %s), 'B') || "
+                "setweight(to_tsvector(%s, %s), 'C') || setweight(to_tsvector(%s, %s), 'D')) "
+                "ON CONFLICT (property_id) DO UPDATE SET document = EXCLUDED.document",
+                [prop.pk, SEARCH_CONFIG, title, SEARCH_CONFIG, location,
+                 SEARCH_CONFIG, description, SEARCH_CONFIG, owner_name],
+            )
+        else:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [prop.pk])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, location, description, owner_name) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [prop.pk, title, location, description, owner_name],
+            )
+
+
+def remove_property(property_id):
+    """Delete the search document for a property."""
+    if not is_supported():
+        return
+    column = 'property_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {column} = %s", [property_id])
+
+
+def rebuild_index(queryset=None, batch_size=500):
+    """(Re)index every property in ``queryset``; returns the number indexed."""
+    from .models import Property
+
+    if not is_supported():
+        return 0
+    queryset = queryset if queryset is not None else Property.objects.all()
+    count = 0
+    for prop in queryset.select_related('owner').iterator(chunk_size=batch_size):
+        index_property(prop)
+        count += 1
+    return count
+
+
+def _fts5_query(terms):
+    # Quote every token so user input can never be parsed as FTS5 syntax;
+    # the last token is a prefix match to support search-as-you-type.
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_properties(queryset, query, fallback_fields=()):
+    """
+    Restrict ``queryset`` to properties matching ``query``, ranked by relevance.
+
+    Matching rows are annotated with ``search_rank`` (higher is better) and
+    ordered by it. On backends without an index the ``fallback_fields`` are
+    matched with ``icontains`` and every row gets the same rank.
+    """
+    terms = _TOKEN_RE.findall(query or '')
+    if not terms:
+        return queryset
+
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        ts_query = "websearch_to_tsquery(%s, %s)"
+        matches = RawSQL(
+            f"SELECT property_id FROM {SEARCH_TABLE} WHERE document @@ {ts_query}",
+            [SEARCH_CONFIG, ' '.join(terms)],
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank(document, {ts_query}) FROM {SEARCH_TABLE} "
+            f"WHERE property_id = {table}.id",
+            [SEARCH_CONFIG, ' '.join(terms)],
+            output_field=FloatField(),
+        )
+    elif connection.vendor == 'sqlite':
+        match = _fts5_query(terms)
+        matches = RawSQL(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+            [match],
+        )
+        # bm25() is lower-is-better; negate it so higher ranks sort first.
+        # Column weights favour title, then location, description and owner.
+        rank = RawSQL(
+            f"SELECT -bm25({SEARCH_TABLE}, 10.0, 5.0, 2.0, 1.0) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {table}.id",
+            [match],
+            output_field=FloatField(),
+        )
+    else:
+        condition = Q()
+        for term in terms:
+            term_q = Q()
+            for field in fallback_fields:
+                term_q |= Q(**{f"{field}__icontains": term})
+            condition &= term_q
+        return queryset.filter(condition).annotate(
+            search_rank=Value(1.0, output_field=FloatField())
+        )
+
+    return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by(
+        F('search_rank').desc(nulls_last=True), '-created_at'
+    )
@@ -1,5 +1,6 @@
 from decimal import Decimal
 import bleach
+from django.db.models import Count, Exists, OuterRef, Prefetch, Value, BooleanField
 from rest_framework import serializers
 
 from .models import (
@@ -8,16 +9,34 @@ from .models import (
     PropertyLike
 )
 from accounts.models import Profile
+from . import media as media_pipeline
 from utils.google_maps import geocode_address, build_maps_url
 
 
 class MediaPropertySerializer(serializers.ModelSerializer):
     Images = serializers.ImageField(required=False, allow_null=True)
     videos = serializers.FileField(required=False, allow_null=True)
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = MediaProperty
-        fields = ['id', 'Images', 'videos', 'caption']
+        fields = [
+            'id', 'Images', 'videos', 'caption', 'processing_status',
+            'width', 'height', 'blurhash', 'renditions',
+        ]
+        read_only_fields = ['processing_status', 'width', 'height', 'blurhash']
+
+    def get_renditions(self, obj):
+        """Absolute URLs of the generated JPEG/WebP renditions, keyed by name"""
+        request = self.context.get('request')
+        renditions = {}
+        for name, rendition in (obj.renditions or {}).items():
+            urls = {}
+            for fmt in ('jpeg', 'webp'):
+                url = obj.rendition_url(name, fmt)
+                urls[fmt] = request.build_absolute_uri(url) if request else url
+            renditions[name] = {**urls, 'width': rendition.get('width'), 'height': rendition.get('height')}
+        return renditions
 
 
 class PropertyFeatureSerializer(serializers.ModelSerializer):
@@ -38,10 +57,12 @@ class SerializerProperty(serializers.ModelSerializer):
     property_features = PropertyFeatureSerializer(many=True, required=False)
     agent = serializers.SerializerMethodField()
     main_image_url = serializers.SerializerMethodField()
+    main_image_blurhash = serializers.SerializerMethodField()
     address = serializers.CharField(source='adress', required=False, allow_blank=True)
     maps_url = serializers.SerializerMethodField()
     like_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
 
     class Meta:
         model = Property
@@ -51,10 +72,33 @@ class SerializerProperty(serializers.ModelSerializer):
             'latitude', 'longitude', 'google_place_id', 'maps_url',
             'is_published', 'is_paid', 'parking', 'year_built',
             'featured_until', 'view_count', 'owner', 'created_at', 'updated_at',
-            'media', 'property_features', 'agent', 'main_image_url',
-            'like_count', 'is_liked'
+            'media', 'property_features', 'agent', 'main_image_url', 'main_image_blurhash',
+            'like_count', 'is_liked', 'distance_km'
         ]
-        read_only_fields = ['owner', 'created_at', 'updated_at', 'view_count', 'google_place_id', 'maps_url', 'like_count', 'is_liked']
+        read_only_fields = ['owner', 'created_at', 'updated_at', 'view_count', 'google_place_id', 'maps_url', 'like_count', 'is_liked', 'distance_km']
+
+    @staticmethod
+    def prepare_list_queryset(queryset, request=None):
+        """Annotate a Property queryset with everything the list view serializes.
+
+        Like counts, the per-user liked flag and the ordered media gallery are
+        loaded up front so a page costs a fixed number of queries regardless of
+        its size. The serializer falls back to per-object queries for instances
+        that were not loaded through this helper.
+        """
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            is_liked = Exists(PropertyLike.objects.filter(property=OuterRef('pk'), user=user))
+        else:
+            is_liked = Value(False, output_field=BooleanField())
+
+        return queryset.select_related('owner', 'owner__profile').prefetch_related(
+            Prefetch('MediaProperty', queryset=MediaProperty.objects.order_by('id')),
+            'property_features',
+        ).annotate(
+            annotated_like_count=Count('likes', distinct=True),
+            annotated_is_liked=is_liked,
+        )
 
     def validate(self, data):
         """Sanitize description field."""
@@ -101,18 +145,35 @@ class SerializerProperty(serializers.ModelSerializer):
                 'profile_picture': None,
             }
 
+    def _get_main_media(self, obj):
+        # Prefer first MediaProperty image
+        first = getattr(obj, 'MediaProperty', None)
+        if first is None:
+            return None
+        # Use the prefetched gallery when available to avoid a query per row
+        if 'MediaProperty' in getattr(obj, '_prefetched_objects_cache', {}):
+            return next(iter(first.all()), None)
+        return first.first()
+
     def get_main_image_url(self, obj):
+        """Card-sized rendition of the first image (the original until it is processed)"""
         try:
-            # Prefer first MediaProperty image
-            first = getattr(obj, 'MediaProperty', None)
-            if first is not None:
-                first_item = first.first()
-                if first_item and getattr(first_item, 'Images', None):
-                    return self._get_absolute_url(first_item.Images)
+            first_item = self._get_main_media(obj)
+            if first_item and getattr(first_item, 'Images', None):
+                url = first_item.rendition_url('card')
+                request = self.context.get('request')
+                return request.build_absolute_uri(url) if request else url
         except Exception:
             return None
         return None
 
+    def get_main_image_blurhash(self, obj):
+        try:
+            first_item = self._get_main_media(obj)
+        except Exception:
+            return None
+        return (first_item.blurhash or None) if first_item else None
+
     def get_maps_url(self, obj):
         result = obj.get_lat_lng()
         if result is None:
@@ -124,15 +185,25 @@ class SerializerProperty(serializers.ModelSerializer):
 
     def get_like_count(self, obj):
         """Return the total number of likes for this property"""
+        # Use annotated value if available to avoid extra query
+        if hasattr(obj, 'annotated_like_count'):
+            return obj.annotated_like_count
         return obj.likes.count()
 
     def get_is_liked(self, obj):
         """Return whether the current user has liked this property"""
+        if hasattr(obj, 'annotated_is_liked'):
+            return obj.annotated_is_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
         return False
 
+    def get_distance_km(self, obj):
+        """Return distance from the ?near= point when the queryset was filtered by location"""
+        distance = getattr(obj, 'distance_km', None)
+        return round(distance, 3) if distance is not None else None
+
     def create(self, validated_data, owner=None):
         media_data = validated_data.pop('media', [])
         features_data = validated_data.pop('property_features', [])
@@ -166,19 +237,20 @@ class SerializerProperty(serializers.ModelSerializer):
         if new_images_count > 10:
             raise serializers.ValidationError({"media": "Maximum of 10 images allowed per property."})
         
+        media_items = []
         if request is not None:
             # Handle Images
             for key in file_keys:
                 files = request.FILES.getlist(key)
                 for f in files:
                     # MediaProperty model field for image is 'Images'
-                    MediaProperty.objects.create(property=property_instance, Images=f)
+                    media_items.append(MediaProperty(property=property_instance, Images=f))
             
             # Handle Videos
             for key in video_keys:
                 files = request.FILES.getlist(key)
                 for f in files:
-                    MediaProperty.objects.create(property=property_instance, videos=f)
+                    media_items.append(MediaProperty(property=property_instance, videos=f))
 
             # Features can be provided as repeated form fields
             if hasattr(request.POST, 'getlist'):
@@ -192,7 +264,8 @@ class SerializerProperty(serializers.ModelSerializer):
             img = m.get('Images')
             vid = m.get('videos')
             if img or vid:
-                MediaProperty.objects.create(property=property_instance, Images=img, videos=vid)
+                media_items.append(MediaProperty(property=property_instance, Images=img, videos=vid))
+        self._save_media(media_items)
 
         for feat in features_data:
             if isinstance(feat, dict):
@@ -264,26 +337,30 @@ class SerializerProperty(serializers.ModelSerializer):
         # Replace media if provided (note: this will remove existing media records)
         if media_data is not None:
             MediaProperty.objects.filter(property=instance).delete()
+            media_items = []
             for m in media_data:
                 img = m.get('Images')
                 vid = m.get('videos')
                 if img or vid:
-                    MediaProperty.objects.create(property=instance, Images=img, videos=vid)
+                    media_items.append(MediaProperty(property=instance, Images=img, videos=vid))
+            self._save_media(media_items)
 
         # Handle uploaded files in the incoming request (append to gallery)
         if request is not None:
             file_keys = ['MediaProperty', 'ImagesProperty', 'images', 'media']
             video_keys = ['videos', 'video']
+            media_items = []
             
             for key in file_keys:
                 files = request.FILES.getlist(key)
                 for f in files:
-                    MediaProperty.objects.create(property=instance, Images=f)
+                    media_items.append(MediaProperty(property=instance, Images=f))
             
             for key in video_keys:
                 files = request.FILES.getlist(key)
                 for f in files:
-                    MediaProperty.objects.create(property=instance, videos=f)
+                    media_items.append(MediaProperty(property=instance, videos=f))
+            self._save_media(media_items)
 
         should_refresh_coordinates = any(
             field in validated_data for field in ('adress', 'city')
@@ -292,6 +369,17 @@ class SerializerProperty(serializers.ModelSerializer):
             self._sync_coordinates(instance, validated_data)
         return instance
 
+    def _save_media(self, media_items):
+        """Insert gallery rows and resize their images after the request commits"""
+        if not media_items:
+            return
+        for item in media_items:
+            # Videos have nothing to render
+            if not item.Images:
+                item.processing_status = 'ready'
+        created = MediaProperty.objects.bulk_create(media_items)
+        media_pipeline.schedule_processing(item.id for item in created if item.Images)
+
     def _sync_coordinates(self, instance, data, save=True):
         """Use Google Maps Geocoding API to fill latitude/longitude."""
         address = data.get('adress', instance.adress)
@@ -487,5 +575,5 @@ class PropertyVisitSerializer(serializers.ModelSerializer):
     def get_property_image(self, property_obj):
         media = property_obj.MediaProperty.first()
         if media and media.Images:
-            return media.Images.url
+            return media.rendition_url('thumbnail')
         return None
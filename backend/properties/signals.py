@@ -0,0 +1,33 @@
+"""
+Signal handlers for the properties app.
+Keeps the full-text search index in sync with Property changes.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Property
+from . import search
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Property)
+def update_property_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """Refresh the search document when an indexed field may have changed."""
+    if kwargs.get('raw'):
+        return
+    # Counter/status-only saves (e.g. view_count) don't touch the search document
+    if update_fields is not None and not set(update_fields) & set(search.INDEXED_FIELDS):
+        return
+    try:
+        search.index_property(instance)
+    except Exception as e:
+        logger.error(f"Failed to index property {instance.pk} for search: {e}", exc_info=True)
+
+
+@receiver(post_delete, sender=Property)
+def remove_property_search_index(sender, instance, **kwargs):
+    try:
+        search.remove_property(instance.pk)
+    except Exception as e:
+        logger.error(f"Failed to remove property {instance.pk} from search index: {e}", exc_info=True)
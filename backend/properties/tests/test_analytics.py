@@ -0,0 +1,174 @@
+from datetime import timedelta
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from properties.analytics_models import (
+    AgentLeadMetrics, PropertyDailyStats, PropertyViewEvent, WeeklyEngagementPattern,
+)
+from properties.analytics_rollup import run_rollups
+from properties.analytics_service import AgentAnalyticsService
+from properties.models import Property, PropertyVisit
+
+pytestmark = pytest.mark.django_db
+
+
+def _record_views(prop, count, device_type="mobile", days_ago=0):
+    viewed_at = timezone.now() - timedelta(days=days_ago)
+    PropertyViewEvent.objects.bulk_create(
+        PropertyViewEvent(property=prop, device_type=device_type, viewed_at=viewed_at)
+        for _ in range(count)
+    )
+
+
+def test_rollup_aggregates_views_and_inquiries_per_day(property_obj, user):
+    _record_views(property_obj, 3, "mobile")
+    _record_views(property_obj, 2, "desktop")
+    _record_views(property_obj, 4, "tablet", days_ago=1)
+    PropertyVisit.objects.create(
+        property=property_obj, user=user, agent=property_obj.owner,
+        date=timezone.localdate(), time="10:00",
+    )
+
+    run_rollups()
+    # Re-running the same window must not double count
+    run_rollups()
+
+    today = PropertyDailyStats.objects.get(property=property_obj, date=timezone.localdate())
+    assert (today.views, today.mobile_views, today.desktop_views, today.inquiries) == (5, 3, 2, 1)
+    yesterday = PropertyDailyStats.objects.get(
+        property=property_obj, date=timezone.localdate() - timedelta(days=1)
+    )
+    assert (yesterday.views, yesterday.tablet_views) == (4, 4)
+
+    today_pattern = WeeklyEngagementPattern.objects.get(
+        agent=property_obj.owner,
+        week_start_date=timezone.localdate() - timedelta(days=timezone.localdate().weekday()),
+        day_of_week=timezone.localdate().strftime("%A"),
+    )
+    assert (today_pattern.total_views, today_pattern.total_inquiries) == (5, 1)
+
+
+def test_listing_overview_reads_rollups(property_obj):
+    _record_views(property_obj, 4)
+    _record_views(property_obj, 6, days_ago=10)
+    run_rollups(start_date=timezone.localdate() - timedelta(days=30))
+
+    overview = AgentAnalyticsService(property_obj.owner.id).get_listing_overview()
+
+    assert overview["views_7d"] == 4
+    assert overview["views_30d"] == 10
+    assert overview["total_listings"] == 1
+
+
+def test_property_performance_query_count_is_independent_of_listing_count(
+    agent_client, agent_user, property_data
+):
+    url = reverse("analytics-property-performance")
+
+    def seed(count):
+        for index in range(count):
+            prop = Property.objects.create(**{**property_data, "title": f"Listing {index}"})
+            _record_views(prop, 2)
+        run_rollups()
+
+    seed(1)
+    with CaptureQueriesContext(connection) as few:
+        response = agent_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+
+    seed(5)
+    with CaptureQueriesContext(connection) as many:
+        response = agent_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data) == 6
+    assert len(many.captured_queries) == len(few.captured_queries)
+    assert response.data[0]["device_breakdown"]["mobile"] == 2
+    assert response.data[0]["views_over_time"] == [
+        {"date": timezone.localdate().isoformat(), "views": 2}
+    ]
+
+
+def _message(conversation, sender, minutes_ago):
+    from communications.models import Message
+
+    message = Message.objects.create(conversation=conversation, sender=sender, text="hi")
+    Message.objects.filter(pk=message.pk).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+    return message
+
+
+def test_lead_insights_response_time_is_persisted_to_lead_metrics(agent_user, user):
+    from communications.models import Conversation
+
+    conversation = Conversation.objects.create(user=user, agent=agent_user)
+    _message(conversation, user, 120)
+    _message(conversation, agent_user, 110)  # 10 minute reply
+    _message(conversation, user, 60)
+    _message(conversation, user, 50)
+    _message(conversation, agent_user, 20)  # 30 minutes after the latest client message
+
+    insights = AgentAnalyticsService(agent_user.id).get_lead_insights()
+
+    assert insights["avg_response_time_seconds"] == 20 * 60
+    assert insights["avg_response_time"] == "20 minutes"
+    metrics = AgentLeadMetrics.objects.get(agent=agent_user)
+    assert (metrics.total_responses, metrics.total_response_seconds) == (2, 40 * 60)
+
+    # Later requests are served from the aggregate, however many replies there are
+    with CaptureQueriesContext(connection) as quiet:
+        AgentAnalyticsService(agent_user.id).get_lead_insights()
+    for minutes_ago in range(15, 5, -1):
+        _message(conversation, user if minutes_ago % 2 else agent_user, minutes_ago)
+    run_rollups()
+    with CaptureQueriesContext(connection) as busy:
+        AgentAnalyticsService(agent_user.id).get_lead_insights()
+    assert len(busy.captured_queries) == len(quiet.captured_queries)
+
+
+def test_lead_insights_keep_seconds_precision_and_stay_current(agent_user, user):
+    from communications.models import Conversation, Message
+
+    def message_at(sender, seconds_ago):
+        message = Message.objects.create(conversation=conversation, sender=sender, text="hi")
+        Message.objects.filter(pk=message.pk).update(created_at=timezone.now() - timedelta(seconds=seconds_ago))
+
+    conversation = Conversation.objects.create(user=user, agent=agent_user)
+    message_at(user, 300)
+    message_at(agent_user, 280)  # 20 second reply
+
+    assert AgentAnalyticsService(agent_user.id).get_lead_insights()["avg_response_time_seconds"] == 20
+
+    # A reply after the first dashboard view is picked up without a rollup run
+    message_at(user, 100)
+    message_at(agent_user, 60)  # 40 second reply
+    assert AgentAnalyticsService(agent_user.id).get_lead_insights()["avg_response_time_seconds"] == 30
+
+
+def test_property_performance_buckets_views_by_interval(agent_client, property_obj):
+    _record_views(property_obj, 2)
+    _record_views(property_obj, 3, days_ago=7)
+    run_rollups(start_date=timezone.localdate() - timedelta(days=7))
+    url = reverse("analytics-property-performance")
+
+    weekly = agent_client.get(url, {"interval": "week"}).data[0]["views_over_time"]
+    this_week = timezone.localdate() - timedelta(days=timezone.localdate().weekday())
+    assert weekly == [
+        {"date": (this_week - timedelta(days=7)).isoformat(), "views": 3},
+        {"date": this_week.isoformat(), "views": 2},
+    ]
+    assert agent_client.get(url, {"interval": "hour"}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_user_growth_groups_by_month_in_database(admin_client, user, django_user_model):
+    last_month = timezone.now().replace(day=1) - timedelta(days=1)
+    django_user_model.objects.filter(pk=user.pk).update(date_joined=last_month)
+
+    response = admin_client.get(reverse("user_growth"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data[0] == {"month": last_month.strftime("%b %Y"), "users": 1}
+    assert response.data[-1]["month"] == timezone.now().strftime("%b %Y")
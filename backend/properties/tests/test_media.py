@@ -0,0 +1,132 @@
+import io
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIRequestFactory
+
+from properties import media
+from properties.models import MediaProperty, Property
+from properties.serializers import SerializerProperty
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def make_jpeg(size=(2400, 1600), color=(200, 60, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaPipelineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.property = Property.objects.create(
+            owner=self.user, title='Prop', price=1000,
+            rooms=1, bedrooms=1, bathrooms=1, area=100, city='Nairobi'
+        )
+
+    def test_process_media_writes_renditions(self):
+        item = MediaProperty.objects.create(property=self.property, Images=make_jpeg())
+        self.assertEqual(item.processing_status, 'pending')
+
+        self.assertEqual(media.process_media(item.id), 'ready')
+
+        item.refresh_from_db()
+        self.assertEqual((item.width, item.height), (2400, 1600))
+        self.assertEqual(len(item.blurhash), 28)
+        self.assertEqual(set(item.renditions), {'thumbnail', 'card', 'full'})
+        self.assertEqual((item.renditions['card']['width'], item.renditions['card']['height']), (800, 533))
+        self.assertEqual(item.renditions['thumbnail']['width'], 320)
+        for rendition in item.renditions.values():
+            with default_storage.open(rendition['webp']) as f:
+                self.assertEqual(Image.open(f).format, 'WEBP')
+            with default_storage.open(rendition['jpeg']) as f:
+                self.assertEqual(Image.open(f).format, 'JPEG')
+
+    def test_small_images_are_not_upscaled(self):
+        item = MediaProperty.objects.create(property=self.property, Images=make_jpeg(size=(200, 100)))
+        media.process_media(item.id)
+        item.refresh_from_db()
+        self.assertEqual(item.renditions['full']['width'], 200)
+        self.assertEqual(item.renditions['thumbnail']['width'], 200)
+
+    def test_unreadable_image_is_marked_failed(self):
+        upload = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        item = MediaProperty.objects.create(property=self.property, Images=upload)
+        self.assertEqual(media.process_media(item.id), 'failed')
+        item.refresh_from_db()
+        self.assertEqual(item.renditions, {})
+
+    def test_claimed_media_is_not_processed_twice(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        held = MediaProperty.objects.create(property=self.property, Images=make_jpeg(size=(400, 300)))
+        abandoned = MediaProperty.objects.create(property=self.property, Images=make_jpeg(size=(400, 300)))
+        MediaProperty.objects.filter(id=held.id).update(
+            processing_status='processing', processing_lease_until=timezone.now() + timedelta(minutes=5)
+        )
+        MediaProperty.objects.filter(id=abandoned.id).update(
+            processing_status='processing', processing_lease_until=timezone.now() - timedelta(minutes=5)
+        )
+
+        # A worker still holding its lease keeps the row; an expired lease is picked up again
+        self.assertIsNone(media.process_media(held.id))
+        self.assertEqual(media.process_media(abandoned.id), 'ready')
+        held.refresh_from_db()
+        self.assertEqual((held.processing_status, held.renditions), ('processing', {}))
+
+    def test_upload_schedules_processing_after_commit(self):
+        request = APIRequestFactory().post(
+            '/', {'title': 'New', 'images': [make_jpeg(), make_jpeg()]}, format='multipart'
+        )
+        serializer = SerializerProperty(context={'request': request})
+        with self.captureOnCommitCallbacks() as callbacks:
+            prop = serializer.create({
+                'title': 'New', 'price': 1000, 'rooms': 1, 'bedrooms': 1,
+                'bathrooms': 1, 'area': 100, 'city': 'Nairobi',
+            }, owner=self.user)
+        self.assertEqual(prop.MediaProperty.filter(processing_status='pending').count(), 2)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_main_image_url_uses_card_rendition(self):
+        item = MediaProperty.objects.create(property=self.property, Images=make_jpeg())
+        data = SerializerProperty(self.property).data
+        self.assertEqual(data['main_image_url'], item.Images.url)
+        self.assertIsNone(data['main_image_blurhash'])
+
+        media.process_media(item.id)
+        data = SerializerProperty(Property.objects.get(id=self.property.id)).data
+        item.refresh_from_db()
+        self.assertEqual(data['main_image_url'], default_storage.url(item.renditions['card']['jpeg']))
+        self.assertEqual(data['main_image_blurhash'], item.blurhash)
+        self.assertIn('webp', data['media'][0]['renditions']['card'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ProcessPropertyMediaCommandTests(TransactionTestCase):
+    # The command processes photos on worker threads, which need committed rows
+
+    def test_command_backfills_pending_media(self):
+        user = User.objects.create_user(username='owner', password='password')
+        prop = Property.objects.create(
+            owner=user, title='Prop', price=1000,
+            rooms=1, bedrooms=1, bathrooms=1, area=100, city='Nairobi'
+        )
+        MediaProperty.objects.create(property=prop, Images=make_jpeg(size=(400, 300)))
+        MediaProperty.objects.create(property=prop, Images=make_jpeg(size=(400, 300)))
+        out = io.StringIO()
+        call_command('process_property_media', '--batch-size', '1', stdout=out)
+        self.assertIn('Processed 2 photos', out.getvalue())
+        self.assertFalse(MediaProperty.objects.filter(processing_status='pending').exists())
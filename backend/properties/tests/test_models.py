@@ -33,6 +33,20 @@ def test_property_str_and_lat_lng(property_obj):
     assert property_obj.get_lat_lng() == (None, None)
 
 
+def test_property_geohash_follows_coordinates(property_obj):
+    assert property_obj.geohash == ""
+    property_obj.latitude = "57.649110"
+    property_obj.longitude = "10.407440"
+    property_obj.save(update_fields=["latitude", "longitude"])
+    property_obj.refresh_from_db()
+    assert property_obj.geohash == "u4pruydqq"
+
+    property_obj.latitude = None
+    property_obj.save()
+    property_obj.refresh_from_db()
+    assert property_obj.geohash == ""
+
+
 def test_property_validation_requires_numeric_fields(property_data):
     property_data["rooms"] = None
     prop = Property(**property_data)
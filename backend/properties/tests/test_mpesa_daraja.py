@@ -0,0 +1,174 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from utils.mpesa_daraja import MpesaDarajaError, MpesaDarajaService
+
+
+class MockDaraja(ThreadingHTTPServer):
+    """Minimal local Daraja: OAuth, STK push and STK query over keep-alive HTTP/1.1"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), MockDarajaHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.token_requests = 0
+        self.requests = []
+        self.responses = {}  # path -> list of (status, body) to serve before the default
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def record(self, path):
+        with self.lock:
+            self.requests.append(path)
+            queued = self.responses.get(path)
+            return queued.pop(0) if queued else None
+
+
+class MockDarajaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.token_requests += 1
+            token = f'token-{self.server.token_requests}'
+        self.server.record(self.path.split('?')[0])
+        self._reply(200, {'access_token': token, 'expires_in': '3599'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        queued = self.server.record(self.path)
+        if queued:
+            return self._reply(*queued)
+        if self.headers.get('Authorization') != f'Bearer token-{self.server.token_requests}':
+            return self._reply(401, {'errorMessage': 'Invalid Access Token'})
+        if self.path.endswith('/processrequest'):
+            return self._reply(200, {
+                'MerchantRequestID': 'mr-1',
+                'CheckoutRequestID': 'ws_CO_1',
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success',
+                'CustomerMessage': 'Success',
+            })
+        self._reply(200, {'ResponseCode': '0', 'ResultCode': '0', 'ResultDesc': 'Completed'})
+
+
+STK_PATH = '/mpesa/stkpush/v1/processrequest'
+QUERY_PATH = '/mpesa/stkpushquery/v1/query'
+
+
+class MpesaDarajaServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.server = MockDaraja()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        settings_override = override_settings(
+            MPESA_API_BASE=self.server.url,
+            DAR_AFFILIATE_CONSUMER_KEY='key',
+            DAR_AFFILIATE_CONSUMER_SECRET='secret',
+            DAR_SHORTCODE='174379',
+            DAR_PASSKEY='passkey',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _stk_push(self, service):
+        return service.initiate_stk_push('0712345678', 100, 'ref', 'desc', 'https://example.com/callback')
+
+    def test_token_is_shared_between_workers(self):
+        worker_a, worker_b = MpesaDarajaService(), MpesaDarajaService()
+
+        self._stk_push(worker_a)
+        worker_b.query_payment_status('ws_CO_1')
+
+        self.assertEqual(self.server.token_requests, 1)
+
+    def test_concurrent_refresh_is_single_flight(self):
+        workers = [MpesaDarajaService() for _ in range(4)]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = list(pool.map(lambda i: workers[i % 4]._get_access_token(), range(16)))
+
+        self.assertEqual(set(tokens), {'token-1'})
+        self.assertEqual(self.server.token_requests, 1)
+
+    def test_requests_reuse_keep_alive_connections(self):
+        service = MpesaDarajaService()
+
+        for _ in range(3):
+            self._stk_push(service)
+            service.query_payment_status('ws_CO_1')
+
+        # One keep-alive connection each for token calls, status queries and STK pushes
+        self.assertEqual(self.server.connections, 3)
+
+    def test_status_query_retries_rate_limited_requests(self):
+        service = MpesaDarajaService()
+        self.server.responses[QUERY_PATH] = [(429, {}), (429, {})]
+
+        data = service.query_payment_status('ws_CO_1')
+
+        self.assertEqual(data['ResultCode'], '0')
+        self.assertEqual(self.server.requests.count(QUERY_PATH), 3)
+
+    def test_pending_status_query_is_sent_once(self):
+        service = MpesaDarajaService()
+        # Daraja's answer while the customer has not entered their PIN yet
+        self.server.responses[QUERY_PATH] = [(500, {
+            'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed',
+        })]
+
+        with self.assertRaises(MpesaDarajaError):
+            service.query_payment_status('ws_CO_1')
+
+        self.assertEqual(self.server.requests.count(QUERY_PATH), 1)
+
+    def test_stk_push_is_not_retried_after_reaching_safaricom(self):
+        service = MpesaDarajaService()
+        self.server.responses[STK_PATH] = [(500, {})]
+
+        with self.assertRaises(MpesaDarajaError):
+            self._stk_push(service)
+
+        self.assertEqual(self.server.requests.count(STK_PATH), 1)
+
+    def test_rejected_token_is_refreshed_once(self):
+        service = MpesaDarajaService()
+        service._get_access_token()
+        # Safaricom revoked the shared token
+        self.server.token_requests += 1
+
+        data = self._stk_push(service)
+
+        self.assertEqual(data['CheckoutRequestID'], 'ws_CO_1')
+        self.assertEqual(self.server.requests.count(STK_PATH), 2)
+        self.assertEqual(service._access_token, 'token-3')
@@ -4,6 +4,8 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from properties.models import Property, Payment
 from unittest.mock import patch
+from datetime import timedelta
+from django.utils import timezone
 
 class PaymentTests(TestCase):
     def setUp(self):
@@ -74,3 +76,248 @@ class PaymentTests(TestCase):
         self.assertEqual(response.status_code, 200) # JsonResponse
         payment.refresh_from_db()
         self.assertEqual(payment.status, 'completed')
+
+
+class MpesaCallbackIdempotencyTests(TestCase):
+    url = '/api/v1/properties/payments/mpesa/callback/'
+
+    def setUp(self):
+        from properties.models import AgentProfile
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='agent', password='password')
+        self.property = Property.objects.create(
+            owner=self.user, title='Prop', price=1000,
+            rooms=1, bedrooms=1, bathrooms=1, area=100, city='Nairobi'
+        )
+        self.agent_profile = AgentProfile.objects.create(user=self.user, profile=self.user.profile)
+
+    def _payment(self, checkout_request_id='ws_CO_1'):
+        return Payment.objects.create(
+            user=self.user, property=self.property, method='mpesa', amount=100,
+            transaction_id=checkout_request_id, status='pending'
+        )
+
+    def _callback(self, checkout_request_id='ws_CO_1', result_code=0):
+        payload = {'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1',
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': result_code,
+            'ResultDesc': 'Completed' if result_code == 0 else 'Cancelled by user',
+            'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 100},
+                {'Name': 'MpesaReceiptNumber', 'Value': 'ABC12345'},
+            ]},
+        }}}
+        return self.client.post(self.url, payload, format='json')
+
+    def test_duplicate_callbacks_extend_subscription_once(self):
+        from properties.models import MpesaCallbackEvent
+        from properties.payments import process_pending_events
+
+        payment = self._payment()
+        with self.captureOnCommitCallbacks() as callbacks:
+            first = self._callback()
+        second = self._callback()
+
+        self.assertEqual(first.json()['ResultCode'], 0)
+        self.assertEqual(second.json(), {'ResultCode': 0, 'ResultDesc': 'Duplicate callback ignored'})
+        self.assertEqual(MpesaCallbackEvent.objects.count(), 1)
+        # Side effects and the WebSocket status push run after the acknowledgement
+        self.assertEqual(len(callbacks), 2)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(payment.raw_payload['mpesa_receipt_number'], 'ABC12345')
+
+        self.assertEqual(process_pending_events(), 1)
+        self.assertEqual(process_pending_events(), 0)
+        self.agent_profile.refresh_from_db()
+        self.assertTrue(self.agent_profile.subscription_active)
+        expires_in = self.agent_profile.subscription_expires - timezone.now()
+        self.assertAlmostEqual(expires_in.total_seconds(), timedelta(days=30).total_seconds(), delta=60)
+
+    def test_subscription_is_extended_from_current_expiry(self):
+        from properties.payments import process_pending_events
+
+        expires = timezone.now() + timedelta(days=10)
+        self.agent_profile.subscription_expires = expires
+        self.agent_profile.save()
+        self._payment()
+
+        self._callback()
+        process_pending_events()
+
+        self.agent_profile.refresh_from_db()
+        self.assertEqual(self.agent_profile.subscription_expires, expires + timedelta(days=30))
+
+    def test_cancelled_payment_has_no_side_effects(self):
+        from properties.models import MpesaCallbackEvent
+
+        payment = self._payment()
+
+        self._callback(result_code=1032)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'cancelled')
+        self.assertIsNotNone(MpesaCallbackEvent.objects.get().processed_at)
+        self.agent_profile.refresh_from_db()
+        self.assertFalse(self.agent_profile.subscription_active)
+
+    def test_resolved_payment_is_not_changed(self):
+        payment = self._payment()
+        Payment.objects.filter(id=payment.id).update(status='cancelled')
+
+        response = self._callback()
+
+        self.assertEqual(response.json()['ResultDesc'], 'Callback received')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'cancelled')
+
+    def test_callback_before_payment_is_applied_on_create(self):
+        from properties.models import MpesaCallbackEvent
+
+        # Safaricom answers before the STK push view stored the payment
+        self._callback()
+        self.assertIsNone(MpesaCallbackEvent.objects.get().payment)
+
+        self.client.force_authenticate(user=self.user)
+        url = f'/api/v1/properties/payments/mpesa/stk/{self.property.id}/'
+        with patch('utils.mpesa_daraja.get_mpesa_service') as mock_get_service:
+            mock_get_service.return_value.initiate_stk_push.return_value = {
+                'CheckoutRequestID': 'ws_CO_1', 'CustomerMessage': 'Success', 'ResponseCode': '0'
+            }
+            response = self.client.post(url, {'phone': '254700000000', 'amount': 100}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Payment.objects.get().status, 'completed')
+        self.assertEqual(MpesaCallbackEvent.objects.get().payment_id, Payment.objects.get().id)
+
+
+class ReconcilePaymentsTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from properties.models import AgentProfile
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='agent', password='password')
+        self.property = Property.objects.create(
+            owner=self.user, title='Prop', price=1000,
+            rooms=1, bedrooms=1, bathrooms=1, area=100, city='Nairobi'
+        )
+        self.agent_profile = AgentProfile.objects.create(user=self.user, profile=self.user.profile)
+        self.results = {}
+        patcher = patch('properties.payments.get_mpesa_service')
+        self.service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.service.query_payment_status.side_effect = self._query
+
+    def _query(self, checkout_request_id):
+        from utils.mpesa_daraja import MpesaDarajaError
+
+        result = self.results.get(checkout_request_id)
+        if result is None:
+            raise MpesaDarajaError('The transaction is being processed')
+        return {'CheckoutRequestID': checkout_request_id, 'ResultCode': result, 'ResultDesc': 'Done'}
+
+    def _payment(self, checkout_request_id, age=timedelta(minutes=5), result=None):
+        payment = Payment.objects.create(
+            user=self.user, property=self.property, method='mpesa', amount=100,
+            transaction_id=checkout_request_id, status='pending'
+        )
+        Payment.objects.filter(id=payment.id).update(created_at=timezone.now() - age)
+        if result is not None:
+            self.results[checkout_request_id] = result
+        return payment
+
+    def test_reconcile_resolves_stale_payments(self):
+        from properties.payments import process_pending_events, reconcile_payments
+
+        paid = self._payment('ws_CO_paid', result='0')
+        cancelled = self._payment('ws_CO_cancelled', result='1032')
+        waiting = self._payment('ws_CO_waiting')
+        fresh = self._payment('ws_CO_fresh', age=timedelta(0), result='0')
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            totals = reconcile_payments(batch_size=2, min_age=60, concurrency=2)
+
+        self.assertEqual(totals, {'checked': 3, 'completed': 1, 'cancelled': 1, 'expired': 0})
+        expected_statuses = [
+            (paid, 'completed'), (cancelled, 'cancelled'), (waiting, 'pending'), (fresh, 'pending'),
+        ]
+        for payment, expected in expected_statuses:
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, expected, payment.transaction_id)
+        self.assertEqual(paid.raw_payload['status_query']['ResultCode'], '0')
+        self.assertEqual(self.service.query_payment_status.call_count, 3)
+
+        # Subscription side effects go through the event log; the status push follows commit too
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(process_pending_events(), 1)
+        self.agent_profile.refresh_from_db()
+        self.assertTrue(self.agent_profile.subscription_active)
+
+    def test_reconcile_expires_unresolvable_payments(self):
+        from properties.payments import reconcile_payments
+
+        old = self._payment('ws_CO_old', age=timedelta(days=2))
+        recent = self._payment('ws_CO_recent')
+
+        totals = reconcile_payments(min_age=60, expire_after=24 * 60 * 60)
+
+        self.assertEqual(totals['expired'], 1)
+        old.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual(old.status, 'cancelled')
+        self.assertEqual(recent.status, 'pending')
+
+    def test_reconcile_skips_payments_resolved_by_callback(self):
+        from properties.payments import apply_query_results
+
+        payment = self._payment('ws_CO_1', result='0')
+        stale_copy = Payment.objects.get(id=payment.id)
+        Payment.objects.filter(id=payment.id).update(status='cancelled')
+
+        counts = apply_query_results([(stale_copy, self._query('ws_CO_1'))])
+
+        self.assertEqual(counts, {'completed': 0, 'cancelled': 0})
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'cancelled')
+
+    def test_status_polling_queries_safaricom_once_per_interval(self):
+        payment = self._payment('ws_CO_1')
+        self.client.force_authenticate(user=self.user)
+        url = f'/api/v1/properties/payments/status/{payment.id}/?query_safaricom=true'
+
+        for _ in range(3):
+            response = self.client.get(url)
+            self.assertEqual(response.data['status'], 'pending')
+
+        self.assertEqual(self.service.query_payment_status.call_count, 1)
+
+    def test_status_polling_does_not_wait_for_the_rate_limit(self):
+        from properties import payments
+
+        payment = self._payment('ws_CO_1')
+        self.client.force_authenticate(user=self.user)
+        url = f'/api/v1/properties/payments/status/{payment.id}/?query_safaricom=true'
+
+        with patch.object(payments, 'check_rate', return_value=(False, 0.5)), \
+                patch.object(payments.time, 'sleep', side_effect=AssertionError('request waited')):
+            response = self.client.get(url)
+        self.assertEqual(response.data['status'], 'pending')
+        self.service.query_payment_status.assert_not_called()
+
+        # The throttled poll does not hold the per-payment query slot
+        self.client.get(url)
+        self.assertEqual(self.service.query_payment_status.call_count, 1)
+
+    def test_reconcile_command(self):
+        from django.core.management import call_command
+
+        self._payment('ws_CO_1', result='0')
+
+        call_command('reconcile_payments', '--min-age', '60', verbosity=0)
+
+        self.assertEqual(Payment.objects.get().status, 'completed')
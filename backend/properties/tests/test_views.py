@@ -1,11 +1,16 @@
 from datetime import timedelta
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 
-from properties.models import Payment, PropertyVisit, SupportTicket
+from properties.models import (
+    MediaProperty, Payment, Property, PropertyLike, PropertyVisit, SupportTicket,
+)
+from properties import view_tracking
 from properties.serializers import SerializerProperty
 
 pytestmark = pytest.mark.django_db
@@ -20,6 +25,147 @@ def test_property_list_returns_properties(api_client, property_obj):
     assert any(item["title"] == property_obj.title for item in response.data['results'])
 
 
+def _seed_published_properties(property_data, count, liker):
+    for index in range(count):
+        prop = Property.objects.create(**{**property_data, "title": f"Listing {index}", "is_published": True})
+        MediaProperty.objects.create(property=prop, Images=f"property_images/{index}-a.jpg")
+        MediaProperty.objects.create(property=prop, Images=f"property_images/{index}-b.jpg")
+        PropertyLike.objects.create(property=prop, user=liker)
+
+
+def test_property_list_query_count_is_independent_of_page_size(auth_client, user, property_data):
+    url = reverse("property-list-create")
+    _seed_published_properties(property_data, 2, user)
+    with CaptureQueriesContext(connection) as small_page:
+        response = auth_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data["results"]) == 2
+
+    _seed_published_properties(property_data, 18, user)
+    with CaptureQueriesContext(connection) as large_page:
+        response = auth_client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data["results"]) == 20
+    assert len(large_page.captured_queries) == len(small_page.captured_queries)
+
+    first = response.data["results"][0]
+    index = first["title"].split()[-1]
+    assert first["like_count"] == 1
+    assert first["is_liked"] is True
+    assert first["main_image_url"].endswith(f"property_images/{index}-a.jpg")
+
+
+def test_property_list_full_text_search_ranks_title_matches_first(api_client, property_data):
+    Property.objects.create(**{**property_data, "title": "Quiet apartment", "description": "Close to the beach", "is_published": True})
+    Property.objects.create(**{**property_data, "title": "Beach villa", "description": "Sea views", "is_published": True})
+    Property.objects.create(**{**property_data, "title": "City office", "description": "Downtown", "is_published": True})
+
+    response = api_client.get(reverse("property-list-create"), {"q": "beach"})
+
+    assert response.status_code == status.HTTP_200_OK
+    titles = [item["title"] for item in response.data["results"]]
+    assert titles == ["Beach villa", "Quiet apartment"]
+
+
+def test_property_search_index_follows_updates_and_deletes(api_client, property_data):
+    prop = Property.objects.create(**{**property_data, "title": "Garden cottage", "is_published": True})
+    url = reverse("property-list-create")
+
+    prop.title = "Hilltop cottage"
+    prop.save()
+    assert api_client.get(url, {"q": "garden"}).data["results"] == []
+    assert len(api_client.get(url, {"q": "hilltop"}).data["results"]) == 1
+
+    prop.delete()
+    assert api_client.get(url, {"q": "hilltop"}).data["results"] == []
+
+
+def _create_located_property(property_data, title, lat, lng):
+    return Property.objects.create(
+        **{**property_data, "title": title, "latitude": lat, "longitude": lng, "is_published": True}
+    )
+
+
+def test_property_list_bbox_filter(api_client, property_data):
+    _create_located_property(property_data, "Kariakoo", "-6.8190", "39.2740")
+    _create_located_property(property_data, "Arusha", "-3.3869", "36.6830")
+
+    response = api_client.get(reverse("property-list-create"), {"bbox": "-7.0,39.0,-6.6,39.5"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["title"] for item in response.data["results"]] == ["Kariakoo"]
+
+
+def test_property_list_near_filter_sorts_by_distance(api_client, property_data):
+    _create_located_property(property_data, "Further", "-6.8050", "39.2883")
+    _create_located_property(property_data, "Closer", "-6.7930", "39.2800")
+    _create_located_property(property_data, "Out of range", "-6.9500", "39.4000")
+
+    response = api_client.get(
+        reverse("property-list-create"), {"near": "-6.7924,39.2083", "radius": "10"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    results = response.data["results"]
+    assert [item["title"] for item in results] == ["Closer", "Further"]
+    assert results[0]["distance_km"] < results[1]["distance_km"] <= 10
+
+
+def test_property_list_near_filter_rejects_bad_input(api_client):
+    url = reverse("property-list-create")
+    assert api_client.get(url, {"near": "north"}).status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.get(url, {"near": "-6.79,39.20", "radius": "0"}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_property_feed_cursor_pagination_is_stable_under_inserts(api_client, property_data):
+    for index in range(5):
+        Property.objects.create(**{**property_data, "title": f"Listing {index}", "is_published": True})
+    url = reverse("property-list-create")
+
+    first = api_client.get(url, {"cursor": "", "page_size": 2})
+    assert first.status_code == status.HTTP_200_OK
+    assert "next" in first.data and "count" not in first.data
+    seen = [item["id"] for item in first.data["results"]]
+
+    # A listing published mid-scroll must not shift later pages
+    Property.objects.create(**{**property_data, "title": "Fresh", "is_published": True})
+
+    next_url = first.data["next"]
+    while next_url:
+        page = api_client.get(next_url)
+        assert page.status_code == status.HTTP_200_OK
+        seen.extend(item["id"] for item in page.data["results"])
+        next_url = page.data["next"]
+
+    older = Property.objects.exclude(title="Fresh").order_by("-created_at", "-id")
+    assert seen == list(older.values_list("id", flat=True))
+
+
+def test_property_feed_rejects_malformed_cursor(api_client):
+    response = api_client.get(reverse("property-list-create"), {"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize("position", [["x", "y"], [timezone.now().isoformat(), "abc"], [None, 1]])
+def test_property_feed_rejects_cursor_with_invalid_values(api_client, position):
+    import base64
+    import json
+    cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+    response = api_client.get(reverse("property-list-create"), {"cursor": cursor})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_property_feed_cursor_rejects_other_orderings(api_client, property_data):
+    Property.objects.create(**{**property_data, "is_published": True})
+    url = reverse("property-list-create")
+    assert api_client.get(url, {"cursor": "", "ordering": "price"}).status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.get(url, {"cursor": "", "near": "-1.28,36.82"}).status_code == status.HTTP_400_BAD_REQUEST
+    # The feed's own order is still accepted, and ordering without a cursor is unaffected
+    assert api_client.get(url, {"cursor": "", "ordering": "-created_at"}).status_code == status.HTTP_200_OK
+    response = api_client.get(url, {"ordering": "price"})
+    assert response.status_code == status.HTTP_200_OK
+
+
 def test_property_create_assigns_owner(agent_client, agent_user, property_payload, monkeypatch):
     monkeypatch.setattr(SerializerProperty, "_sync_coordinates", lambda *args, **kwargs: None)
     url = reverse("property-list-create")
@@ -45,6 +191,65 @@ def test_property_delete_by_owner_succeeds(agent_client, agent_user, property_ob
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
 
+@pytest.fixture
+def view_buffer(monkeypatch, settings):
+    settings.PROPERTY_VIEW_FLUSH_INTERVAL = 3600
+    settings.PROPERTY_VIEW_FLUSH_THRESHOLD = 1000
+    buffer = view_tracking.LocalViewBuffer()
+    monkeypatch.setattr(view_tracking, "_buffer", buffer)
+    return buffer
+
+
+def test_track_view_buffers_increments_until_flush(api_client, property_obj, view_buffer):
+    url = reverse("track_property_view", args=[property_obj.id])
+    for _ in range(3):
+        response = api_client.post(url, HTTP_USER_AGENT="Mozilla/5.0 (iPhone; Mobile)")
+        assert response.status_code == status.HTTP_200_OK
+    assert response.data["view_count"] == 3
+
+    property_obj.refresh_from_db()
+    assert property_obj.view_count == 0
+
+    assert view_tracking.flush_views() == (1, 3)
+    property_obj.refresh_from_db()
+    assert property_obj.view_count == 3
+    assert list(property_obj.view_events.values_list("device_type", flat=True)) == ["mobile"] * 3
+
+
+def test_track_view_counts_authenticated_viewers_once(auth_client, user, property_obj, view_buffer):
+    url = reverse("track_property_view", args=[property_obj.id])
+    auth_client.post(url)
+    auth_client.post(url)
+    view_tracking.flush_views()
+
+    property_obj.refresh_from_db()
+    assert property_obj.view_count == 1
+    assert property_obj.view_events.filter(viewer=user).count() == 2
+
+
+def test_track_view_flushes_past_threshold_off_the_request_thread(
+    api_client, property_obj, view_buffer, settings, monkeypatch
+):
+    import threading
+
+    flushed_on = []
+    monkeypatch.setattr(view_tracking, "flush_views", lambda buffer: flushed_on.append(threading.current_thread()))
+    monkeypatch.setattr(view_tracking, "_flush_future", None)
+    settings.PROPERTY_VIEW_FLUSH_THRESHOLD = 2
+    url = reverse("track_property_view", args=[property_obj.id])
+    api_client.post(url)
+    api_client.post(url)
+
+    view_tracking._flush_future.result(timeout=5)
+    assert len(flushed_on) == 1
+    assert flushed_on[0] is not threading.current_thread()
+
+
+def test_track_view_missing_property_returns_404(api_client, view_buffer):
+    response = api_client.post(reverse("track_property_view", args=[999999]))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_property_visit_requires_authentication(api_client, property_obj, user):
     url = reverse("propertyvisit-list-create")
     payload = {
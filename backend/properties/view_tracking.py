@@ -0,0 +1,294 @@
+"""
+Buffered property view counting.
+
+Views are accumulated outside the database and written back in bulk:
+
+- With ``REDIS_URL`` set, counters live in Redis (``INCR`` per property plus
+  a set of dirty property ids) and view events are queued in a Redis list,
+  so every web/ASGI worker shares one buffer. Draining uses MULTI blocks
+  rather than GETDEL/LPOP-with-count, so Redis 3.2 or later is enough.
+- Without Redis, an in-process buffer is used instead.
+
+``flush_views`` drains the buffer, applies counters with a single
+``UPDATE ... SET view_count = view_count + n`` per distinct increment and
+writes ``PropertyViewEvent`` rows with ``bulk_create``. Web workers trigger it
+at most once per flush interval, or when the buffer grows past a threshold,
+on a background thread so the request that crossed the threshold does not
+pay for the write. The ``flush_property_views`` management command also
+runs it.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+COUNT_KEY = 'property_views:count:{}'
+DIRTY_KEY = 'property_views:dirty'
+EVENTS_KEY = 'property_views:events'
+FLUSH_LOCK_KEY = 'property_views:flush_lock'
+FLUSH_LOCK_TIMEOUT = 60
+
+
+def _flush_interval():
+    return getattr(settings, 'PROPERTY_VIEW_FLUSH_INTERVAL', 10)
+
+
+def _flush_threshold():
+    return getattr(settings, 'PROPERTY_VIEW_FLUSH_THRESHOLD', 500)
+
+
+class LocalViewBuffer:
+    """Thread-safe in-process buffer used when Redis is not configured."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._events = []
+
+    def add(self, property_id, count_view, event):
+        """Buffer a view; returns the number of events waiting to be flushed."""
+        with self._lock:
+            if count_view:
+                self._counts[property_id] += 1
+            self._events.append(event)
+            return len(self._events)
+
+    def pending_count(self, property_id):
+        with self._lock:
+            return self._counts.get(property_id, 0)
+
+    def drain(self, max_events):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            events, self._events = self._events[:max_events], self._events[max_events:]
+        return counts, events
+
+    def restore(self, counts, events):
+        with self._lock:
+            self._counts.update(counts)
+            self._events[:0] = events
+
+    def acquire_flush(self):
+        return self._flush_lock.acquire(blocking=False)
+
+    def release_flush(self):
+        self._flush_lock.release()
+
+
+class RedisViewBuffer:
+    """Buffer shared by all workers, backed by Redis counters and a list."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, property_id, count_view, event):
+        pipe = self.client.pipeline(transaction=False)
+        if count_view:
+            pipe.incr(COUNT_KEY.format(property_id))
+            pipe.sadd(DIRTY_KEY, property_id)
+        pipe.rpush(EVENTS_KEY, json.dumps(event))
+        return pipe.execute()[-1]
+
+    def pending_count(self, property_id):
+        return int(self.client.get(COUNT_KEY.format(property_id)) or 0)
+
+    def drain(self, max_events):
+        counts = Counter()
+        property_ids = self.client.spop(DIRTY_KEY, count=max_events) or []
+        if property_ids:
+            # GET and DEL run in one MULTI, so an INCR racing with the drain is
+            # either included here or left for the next flush (its SADD
+            # re-marks the id)
+            pipe = self.client.pipeline(transaction=True)
+            for property_id in property_ids:
+                key = COUNT_KEY.format(int(property_id))
+                pipe.get(key)
+                pipe.delete(key)
+            values = pipe.execute()[::2]
+            for property_id, value in zip(property_ids, values):
+                if value:
+                    counts[int(property_id)] = int(value)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(EVENTS_KEY, 0, max_events - 1)
+        pipe.ltrim(EVENTS_KEY, max_events, -1)
+        raw_events = pipe.execute()[0]
+        return counts, [json.loads(raw) for raw in raw_events]
+
+    def restore(self, counts, events):
+        pipe = self.client.pipeline(transaction=False)
+        for property_id, count in counts.items():
+            pipe.incrby(COUNT_KEY.format(property_id), count)
+            pipe.sadd(DIRTY_KEY, property_id)
+        if events:
+            pipe.lpush(EVENTS_KEY, *[json.dumps(event) for event in reversed(events)])
+        pipe.execute()
+
+    def acquire_flush(self):
+        return bool(self.client.set(FLUSH_LOCK_KEY, '1', nx=True, ex=FLUSH_LOCK_TIMEOUT))
+
+    def release_flush(self):
+        self.client.delete(FLUSH_LOCK_KEY)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flush_executor = None
+_flush_future = None
+
+
+def get_view_buffer():
+    """Return the process-wide view buffer (Redis when configured)."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = _create_buffer()
+    return _buffer
+
+
+def _create_buffer():
+    if getattr(settings, 'REDIS_URL', None):
+        try:
+            from django_redis import get_redis_connection
+            return RedisViewBuffer(get_redis_connection('default'))
+        except Exception as e:
+            logger.warning(f"Redis view buffer unavailable, using in-process buffer: {e}")
+    return LocalViewBuffer()
+
+
+def get_device_type(user_agent):
+    """Classify a User-Agent string into PropertyViewEvent.DEVICE_TYPES."""
+    if not user_agent:
+        return 'unknown'
+    ua = user_agent.lower()
+    if 'ipad' in ua or 'tablet' in ua:
+        return 'tablet'
+    if 'mobi' in ua or 'android' in ua or 'iphone' in ua:
+        return 'mobile'
+    return 'desktop'
+
+
+def record_view(property_id, viewer_id=None, count_view=True, device_type='unknown', session_id=None):
+    """
+    Buffer a view of ``property_id``.
+
+    ``count_view`` controls whether ``Property.view_count`` is incremented
+    (repeat views by the same user are recorded as events only).
+    """
+    buffer = get_view_buffer()
+    event = {
+        'property_id': property_id,
+        'viewer_id': viewer_id,
+        'device_type': device_type,
+        'session_id': session_id,
+        'viewed_at': timezone.now().isoformat(),
+    }
+    try:
+        buffered = buffer.add(property_id, count_view, event)
+    except Exception as e:
+        logger.error(f"Failed to buffer property view: {e}")
+        return
+    _maybe_flush(buffer, buffered)
+
+
+def pending_views(property_id):
+    """Return increments for ``property_id`` not yet written to the database."""
+    try:
+        return get_view_buffer().pending_count(property_id)
+    except Exception:
+        return 0
+
+
+def _get_flush_executor():
+    global _flush_executor
+    if _flush_executor is None:
+        with _buffer_lock:
+            if _flush_executor is None:
+                _flush_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='view-flush')
+    return _flush_executor
+
+
+def _maybe_flush(buffer, buffered):
+    global _last_flush, _flush_future
+    if buffered < _flush_threshold() and time.monotonic() - _last_flush < _flush_interval():
+        return
+    if _flush_future is not None and not _flush_future.done():
+        return
+    _last_flush = time.monotonic()
+    _flush_future = _get_flush_executor().submit(_flush_in_background, buffer)
+
+
+def _flush_in_background(buffer):
+    try:
+        flush_views(buffer)
+    except Exception as e:
+        logger.error(f"Failed to flush property views: {e}", exc_info=True)
+    finally:
+        connection.close()
+
+
+def flush_views(buffer=None, max_events=5000):
+    """
+    Write buffered views to the database.
+
+    Returns a ``(properties_updated, events_created)`` tuple. Drained data is
+    put back into the buffer if the write fails, so views are not lost.
+    """
+    from .models import Property, PropertyViewEvent
+
+    buffer = buffer or get_view_buffer()
+    if not buffer.acquire_flush():
+        return 0, 0
+    try:
+        counts, events = buffer.drain(max_events)
+        if not counts and not events:
+            return 0, 0
+        try:
+            with transaction.atomic():
+                # One UPDATE per distinct increment instead of one per property
+                by_increment = defaultdict(list)
+                for property_id, count in counts.items():
+                    by_increment[count].append(property_id)
+                for count, property_ids in by_increment.items():
+                    Property.objects.filter(pk__in=property_ids).update(
+                        view_count=F('view_count') + count
+                    )
+
+                # Skip events whose property or viewer was deleted meanwhile
+                existing_properties = set(Property.objects.filter(
+                    pk__in={event['property_id'] for event in events}
+                ).values_list('pk', flat=True))
+                existing_viewers = set(get_user_model().objects.filter(
+                    pk__in={event['viewer_id'] for event in events if event.get('viewer_id')}
+                ).values_list('pk', flat=True))
+                rows = [
+                    PropertyViewEvent(
+                        property_id=event['property_id'],
+                        viewer_id=event['viewer_id'] if event.get('viewer_id') in existing_viewers else None,
+                        device_type=event.get('device_type') or 'unknown',
+                        session_id=event.get('session_id'),
+                        viewed_at=parse_datetime(event['viewed_at']) or timezone.now(),
+                    )
+                    for event in events
+                    if event['property_id'] in existing_properties
+                ]
+                PropertyViewEvent.objects.bulk_create(rows, batch_size=500)
+        except Exception:
+            buffer.restore(counts, events)
+            raise
+        return len(counts), len(rows)
+    finally:
+        buffer.release_flush()
@@ -15,6 +15,7 @@ from django.contrib.auth.decorators import login_required
 import json
 from django_filters.rest_framework import DjangoFilterBackend
 from utils.google_maps import geocode_address, build_maps_url
+from utils.pagination import FeedPagination
 
 from .models import (
     PropertyVisit, Property, Payment, SupportTicket, TicketMessage, TicketAttachment, AgentProfile,
@@ -26,6 +27,7 @@ from .serializers import (
     CreateSupportTicketSerializer, TicketMessageSerializer, TicketAttachmentSerializer,
     AgentRatingSerializer, CreateAgentRatingSerializer
 )
+from . import payments
 from accounts.permissions import IsAdmin
 
 
@@ -39,13 +41,27 @@ class PropertyListCreateView(generics.ListCreateAPIView):
     filterset_class = PropertyFilter
     search_fields = ['title', 'description', 'city', 'adress', 'owner__first_name', 'owner__last_name']
     ordering_fields = ['price', 'created_at', 'view_count']
+    # ?cursor= switches the feed to keyset pagination on (created_at, id); limit/offset otherwise
+    pagination_class = FeedPagination
 
     def get_queryset(self):
+        queryset = self._get_visible_queryset()
+        # Ranked full-text mode: ?q=<terms> uses the search index instead of SearchFilter scans
+        query = self.request.query_params.get('q')
+        if query:
+            from .search import search_properties
+            queryset = search_properties(queryset, query, fallback_fields=self.search_fields)
+        return queryset
+
+    def _get_visible_queryset(self):
         """Filter properties based on user role and archived status."""
         user = self.request.user
         owner_filter = self.request.query_params.get('owner')
         
         base_qs = Property.objects.select_related('owner', 'owner__profile').prefetch_related('MediaProperty', 'property_features')
+        # List mode: precompute likes and main image so a page costs a fixed number of queries
+        if self.request.method in permissions.SAFE_METHODS:
+            base_qs = SerializerProperty.prepare_list_queryset(Property.objects.all(), self.request)
         
         # Admins see all properties including archived
         if user.is_authenticated and user.is_superuser:
@@ -546,6 +562,8 @@ def stk_push(request, property_id):
             status='pending',
             raw_payload=response
         )
+        # Safaricom may already have called back before the payment existed
+        payments.apply_early_callback(payment)
         
         logger.info(f"STK Push initiated: Payment ID {payment.id}, CheckoutRequestID: {checkout_request_id}")
         
@@ -607,72 +625,24 @@ def mpesa_callback(request):
             return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Failed to process callback'}, status=400)
         
         checkout_request_id = callback_data.get('CheckoutRequestID')
-        result_code = int(callback_data.get('ResultCode', -1))
         result_desc = callback_data.get('ResultDesc', '')
         
         if not checkout_request_id:
             logger.warning("Callback missing CheckoutRequestID")
             return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Missing CheckoutRequestID'}, status=400)
         
-        # Find payment by CheckoutRequestID
-        try:
-            payment = Payment.objects.get(transaction_id=checkout_request_id)
-        except Payment.DoesNotExist:
-            logger.warning(f"Payment not found for CheckoutRequestID: {checkout_request_id}")
-            # Still return success to Safaricom to prevent retries
-            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Callback received'})
-        
-        # Update payment status based on result code
-        # ResultCode 0 = Success, any other code = Failed/Cancelled
-        if result_code == 0:
-            payment.status = 'completed'
-            logger.info(f"Payment completed: Payment ID {payment.id}, CheckoutRequestID: {checkout_request_id}")
-            
-            # Store receipt number and transaction details
-            payment.raw_payload = {
-                **(payment.raw_payload or {}),
-                'callback': callback_data,
-                'mpesa_receipt_number': callback_data.get('MpesaReceiptNumber'),
-                'transaction_date': callback_data.get('TransactionDate'),
-            }
-            payment.save()
-            
-            # Activate agent subscription if this is for a property payment
-            if payment.property:
-                try:
-                    agent_profile = AgentProfile.objects.filter(user=payment.property.owner).first()
-                    if agent_profile:
-                        agent_profile.subscription_active = True
-                        # Set or extend subscription expiry
-                        now = timezone.now()
-                        if agent_profile.subscription_expires and agent_profile.subscription_expires > now:
-                            # Extend existing subscription
-                            from datetime import timedelta
-                            agent_profile.subscription_expires += timedelta(days=30)
-                        else:
-                            # Set new subscription expiry
-                            from datetime import timedelta
-                            agent_profile.subscription_expires = now + timedelta(days=30)
-                        agent_profile.save()
-                        logger.info(f"Agent subscription activated: Agent ID {agent_profile.id}")
-                except Exception as e:
-                    logger.error(f"Failed to activate agent subscription: {e}", exc_info=True)
-            
-            # Return success to Safaricom
+        # Record the callback once and move the payment out of pending;
+        # subscription side effects are applied after we acknowledge
+        outcome = payments.ingest_callback(callback_data)
+        if outcome == 'duplicate':
+            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Duplicate callback ignored'})
+        if outcome == 'completed':
             return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Callback processed successfully'})
-        else:
-            # Payment failed or was cancelled
-            payment.status = 'cancelled'
-            payment.raw_payload = {
-                **(payment.raw_payload or {}),
-                'callback': callback_data,
-                'error': result_desc
-            }
-            payment.save()
-            logger.info(f"Payment cancelled/failed: Payment ID {payment.id}, Reason: {result_desc}")
-            
-            # Still return success to Safaricom to acknowledge receipt
+        if outcome == 'cancelled':
+            logger.info(f"Payment cancelled/failed: CheckoutRequestID {checkout_request_id}, Reason: {result_desc}")
             return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Callback processed'})
+        # Unknown or already resolved payments are acknowledged to prevent retries
+        return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Callback received'})
             
     except Exception as e:
         logger.error(f"Error processing M-Pesa callback: {e}", exc_info=True)
@@ -686,6 +656,9 @@ def payment_status(request, payment_id):
     """
     Return payment status so frontend can poll for completion.
     
+    Connected clients also receive the final status over the notifications
+    WebSocket (see properties.payments.publish_status).
+    
     If payment is still pending and query_safaricom=true, queries Safaricom
     for the latest status.
     """
@@ -704,57 +677,34 @@ def payment_status(request, payment_id):
     if not request.user.is_superuser and payment.user != request.user:
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
     
-    # Optionally query Safaricom for latest status if payment is still pending
+    # Optionally query Safaricom for latest status if payment is still pending.
+    # At most one upstream query per payment per MPESA_STATUS_QUERY_INTERVAL;
+    # other polls read the stored status, which callbacks and the
+    # reconcile_payments worker keep current.
     query_safaricom = request.GET.get('query_safaricom', 'false').lower() in ('true', '1', 'yes')
     
     if query_safaricom and payment.status == 'pending' and payment.method == 'mpesa' and payment.transaction_id:
-        try:
-            from utils.mpesa_daraja import get_mpesa_service, MpesaDarajaError
-            
-            mpesa_service = get_mpesa_service()
-            status_response = mpesa_service.query_payment_status(payment.transaction_id)
-            
-            # Update payment if status has changed
-            result_code = status_response.get('ResultCode')
-            if result_code == 0:
-                # Payment completed
-                payment.status = 'completed'
-                payment.raw_payload = {
-                    **payment.raw_payload,
-                    'status_query': status_response
-                }
-                payment.save()
-                logger.info(f"Payment status updated via query: Payment ID {payment.id}")
-            elif result_code in [1032, 1037]:  # Request cancelled/failed
-                payment.status = 'cancelled'
-                payment.raw_payload = {
-                    **payment.raw_payload,
-                    'status_query': status_response
-                }
-                payment.save()
-                logger.info(f"Payment cancelled via query: Payment ID {payment.id}")
-            
-        except MpesaDarajaError as e:
-            logger.warning(f"Failed to query payment status from Safaricom: {e}")
-            # Continue with current status
-        except Exception as e:
-            logger.error(f"Error querying payment status: {e}", exc_info=True)
-            # Continue with current status
-    
-    # Extract M-Pesa receipt number if available
-    mpesa_receipt = None
-    if payment.raw_payload and isinstance(payment.raw_payload, dict):
-        callback_data = payment.raw_payload.get('callback', {})
-        mpesa_receipt = callback_data.get('MpesaReceiptNumber')
+        from django.conf import settings as django_settings
+        from django.core.cache import cache
+
+        interval = getattr(django_settings, 'MPESA_STATUS_QUERY_INTERVAL', 30)
+        query_lock = f'payment_status_query:{payment.id}'
+        if cache.add(query_lock, 1, interval):
+            try:
+                # Never park the request waiting for the shared Daraja rate limit
+                status_response = payments.query_status(payment.transaction_id, max_wait=0)
+                if payments.apply_query_results([(payment, status_response)]).get('completed'):
+                    logger.info(f"Payment status updated via query: Payment ID {payment.id}")
+                payment.refresh_from_db()
+            except payments.StatusQueryThrottled:
+                # Let the next poll try again; return the stored status meanwhile
+                cache.delete(query_lock)
+            except Exception as e:
+                logger.error(f"Error querying payment status: {e}", exc_info=True)
+                # Continue with current status
     
     data = {
-        'id': payment.id,
-        'status': payment.status,
-        'transaction_id': payment.transaction_id,
-        'mpesa_receipt_number': mpesa_receipt,
-        'amount': str(payment.amount),
-        'method': payment.method,
-        'property_id': payment.property.id if payment.property else None,
+        **payments.payment_status_payload(payment),
         'raw_payload': payment.raw_payload,
     }
     return Response(data)
@@ -797,6 +747,7 @@ def agent_properties(request):
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
     
     properties = Property.objects.filter(owner=user).order_by('-created_at')
+    properties = SerializerProperty.prepare_list_queryset(properties, request)
     serializer = SerializerProperty(properties, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -1203,29 +1154,36 @@ def track_property_view(request, property_id):
     Increment view count for a property.
     For authenticated users, only count unique views.
     For anonymous users, count every view (or implement session-based tracking if needed).
+
+    Increments and view events are buffered and written in batches by
+    properties.view_tracking, so hot listings don't take a row lock per hit.
     """
-    try:
-        property_obj = Property.objects.get(id=property_id)
-        
-        if request.user.is_authenticated:
-            from .models import PropertyView
-            # Check if user has already viewed this property
-            if not PropertyView.objects.filter(property=property_obj, viewer=request.user).exists():
-                PropertyView.objects.create(property=property_obj, viewer=request.user)
-                property_obj.view_count += 1
-                property_obj.save(update_fields=['view_count'])
-        else:
-            # For anonymous users, we just increment for now
-            # Ideally we would use session or IP tracking here
-            property_obj.view_count += 1
-            property_obj.save(update_fields=['view_count'])
-        
-        return Response({
-            'view_count': property_obj.view_count,
-            'message': 'View tracked'
-        })
-    except Property.DoesNotExist:
+    from .models import PropertyView
+    from .view_tracking import get_device_type, pending_views, record_view
+
+    view_count = Property.objects.filter(id=property_id).values_list('view_count', flat=True).first()
+    if view_count is None:
         return Response({'error': 'Property not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    viewer_id = None
+    count_view = True
+    if request.user.is_authenticated:
+        viewer_id = request.user.id
+        # Only the first view by a user counts towards view_count
+        _, count_view = PropertyView.objects.get_or_create(property_id=property_id, viewer=request.user)
+
+    record_view(
+        property_id,
+        viewer_id=viewer_id,
+        count_view=count_view,
+        device_type=get_device_type(request.META.get('HTTP_USER_AGENT', '')),
+        session_id=request.session.session_key if hasattr(request, 'session') else None,
+    )
+
+    return Response({
+        'view_count': view_count + pending_views(property_id),
+        'message': 'View tracked'
+    })
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def public_stats(request):
@@ -1265,6 +1223,7 @@ def liked_properties(request):
     from .models import PropertyLike
     liked_ids = PropertyLike.objects.filter(user=request.user).values_list('property_id', flat=True)
     properties = Property.objects.filter(id__in=liked_ids).order_by('-created_at')
+    properties = SerializerProperty.prepare_list_queryset(properties, request)
     serializer = SerializerProperty(properties, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -1276,6 +1235,7 @@ def viewed_properties(request):
     from .models import PropertyView
     viewed_ids = PropertyView.objects.filter(viewer=request.user).values_list('property_id', flat=True)
     properties = Property.objects.filter(id__in=viewed_ids).order_by('-created_at')
+    properties = SerializerProperty.prepare_list_queryset(properties, request)
     serializer = SerializerProperty(properties, many=True, context={'request': request})
     return Response(serializer.data)
 
@@ -1352,6 +1312,7 @@ class AgentAnalyticsViewSet(viewsets.ViewSet):
         Query params:
             - property_id (optional): Specific property ID
             - days (optional): Number of days to analyze (default: 30)
+            - interval (optional): views_over_time bucket, day/week/month (default: day)
         """
         self._check_agent_permission(request)
         
@@ -1360,9 +1321,15 @@ class AgentAnalyticsViewSet(viewsets.ViewSet):
         service = AgentAnalyticsService(request.user.id)
         property_id = request.query_params.get('property_id')
         days = int(request.query_params.get('days', 30))
+        interval = request.query_params.get('interval', 'day')
+        if interval not in ('day', 'week', 'month'):
+            return Response(
+                {'error': 'interval must be one of: day, week, month'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
-            data = service.get_property_performance(property_id=property_id, days=days)
+            data = service.get_property_performance(property_id=property_id, days=days, interval=interval)
             return Response(data)
         except Exception as e:
             return Response(
@@ -0,0 +1,88 @@
+"""
+BlurHash encoder (https://blurha.sh).
+
+Encodes a small RGB Pillow image into a short string that clients decode
+into a blurred placeholder while the real image loads. Callers should pass a
+downscaled image (e.g. 32x32); the cost grows with pixels x components.
+"""
+import math
+
+CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _encode83(value, length):
+    result = ''
+    for i in range(1, length + 1):
+        digit = (value // 83 ** (length - i)) % 83
+        result += CHARACTERS[digit]
+    return result
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def _encode_dc(color):
+    r, g, b = (_linear_to_srgb(c) for c in color)
+    return (r << 16) + (g << 8) + b
+
+
+def _encode_ac(color, maximum_value):
+    r, g, b = (
+        int(max(0, min(18, math.floor(_sign_pow(c / maximum_value, 0.5) * 9 + 9.5))))
+        for c in color
+    )
+    return r * 19 * 19 + g * 19 + b
+
+
+def encode(image, x_components=4, y_components=3):
+    """Return the BlurHash of an RGB Pillow ``image``"""
+    if not (1 <= x_components <= 9 and 1 <= y_components <= 9):
+        raise ValueError('BlurHash components must be between 1 and 9')
+    width, height = image.size
+    pixels = [tuple(_srgb_to_linear(c) for c in pixel[:3]) for pixel in image.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                cy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_maximum = max(abs(c) for factor in ac for c in factor)
+        quantised_maximum = int(max(0, min(82, math.floor(actual_maximum * 166 - 0.5))))
+        maximum_value = (quantised_maximum + 1) / 166
+        result += _encode83(quantised_maximum, 1)
+    else:
+        maximum_value = 1
+        result += _encode83(0, 1)
+    result += _encode83(_encode_dc(dc), 4)
+    for factor in ac:
+        result += _encode83(_encode_ac(factor, maximum_value), 2)
+    return result
@@ -0,0 +1,89 @@
+"""Geohash helpers used to index and query property coordinates."""
+import math
+from typing import Iterable, Optional, Set, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precision stored on Property.geohash (~5m cells)
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode a coordinate pair as a geohash string."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        rng, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Return the (latitude, longitude) size in degrees of a geohash cell."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def _steps(start: float, stop: float, step: float) -> Iterable[float]:
+    value = start
+    while value < stop:
+        yield value
+        value += step
+    yield stop
+
+
+def bbox_prefixes(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                  max_cells: int = 32) -> Optional[Set[str]]:
+    """
+    Return the geohash prefixes of the cells covering a bounding box.
+
+    Picks the finest precision whose covering set has at most ``max_cells``
+    cells. Returns None when the box is too large to be worth indexing, in
+    which case callers should fall back to plain range filters.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        rows = math.ceil((max_lat - min_lat) / lat_step) + 1
+        cols = math.ceil((max_lng - min_lng) / lng_step) + 1
+        if rows * cols > max_cells:
+            continue
+        # Sample points no further apart than one cell so every covered cell is hit
+        return {
+            encode_geohash(lat, lng, precision)
+            for lat in _steps(min_lat, max_lat, lat_step)
+            for lng in _steps(min_lng, max_lng, lng_step)
+        }
+    return None
+
+
+def radius_bbox(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Return the (min_lat, min_lng, max_lat, max_lng) box enclosing a circle."""
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    lng_delta = min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+    return (
+        max(latitude - lat_delta, -90.0),
+        max(longitude - lng_delta, -180.0),
+        min(latitude + lat_delta, 90.0),
+        min(longitude + lng_delta, 180.0),
+    )
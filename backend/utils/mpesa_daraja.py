@@ -5,16 +5,27 @@ This module implements secure M-Pesa payment integration using
 Safaricom's official Daraja API. All security relies on Safaricom's
 official endpoints and authentication mechanisms.
 
+All workers share one OAuth token through the Django cache (Redis in
+production). Only one process refreshes it at a time, and the others wait
+for its result. Requests go through a pooled, keep-alive ``requests.Session``
+with retries, so STK pushes and status queries reuse their TLS connections.
+
 Documentation: https://developer.safaricom.co.ke/
 """
 import base64
+import hashlib
 import logging
+import threading
+import time
 from datetime import datetime
 from typing import Dict, Optional
 
 import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
@@ -24,21 +35,69 @@ logger = logging.getLogger(__name__)
 MPESA_API_BASE = getattr(
     settings, 'MPESA_API_BASE', 'https://sandbox.safaricom.co.ke'
 )
-MPESA_OAUTH_URL = (
-    f'{MPESA_API_BASE}/oauth/v1/generate?grant_type=client_credentials'
-)
-MPESA_STK_PUSH_URL = (
-    f'{MPESA_API_BASE}/mpesa/stkpush/v1/processrequest'
-)
-MPESA_QUERY_URL = (
-    f'{MPESA_API_BASE}/mpesa/stkpushquery/v1/query'
-)
+# Paths are joined to MPESA_API_BASE from settings per service instance
+OAUTH_PATH = '/oauth/v1/generate?grant_type=client_credentials'
+STK_PUSH_PATH = '/mpesa/stkpush/v1/processrequest'
+QUERY_PATH = '/mpesa/stkpushquery/v1/query'
+
+TOKEN_CACHE_KEY = 'mpesa:access_token:{}'
+TOKEN_LOCK_KEY = 'mpesa:access_token:{}:lock'
+TOKEN_EXPIRY_BUFFER = 300  # Refresh tokens 5 minutes before Safaricom expires them
+TOKEN_LOCK_TIMEOUT = 15
+TOKEN_WAIT_INTERVAL = 0.1
 
 
 class MpesaDarajaError(Exception):
     """Base exception for M-Pesa Daraja API errors"""
 
 
+def _build_session(api_base: str) -> requests.Session:
+    """
+    Session with a keep-alive connection pool and retries.
+
+    Token requests are safe to repeat, so they retry on connection errors and
+    on 429/5xx. Status queries retry connection errors and 429 only: Daraja
+    answers a query for a payment the customer has not confirmed yet with
+    HTTP 500 ("The transaction is being processed"), and retrying that would
+    stall the caller and send more queries than MPESA_STATUS_QUERY_RATE
+    allows. An STK push that reached Safaricom must not be sent again (the
+    customer would get a second PIN prompt), so that URL only retries
+    connection failures.
+    """
+    pool_size = getattr(settings, 'MPESA_HTTP_POOL_SIZE', 10)
+    retries = getattr(settings, 'MPESA_HTTP_RETRIES', 3)
+    idempotent = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    throttled_only = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429,),
+        allowed_methods=frozenset(['POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    connect_only = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=0.5)
+
+    session = requests.Session()
+    session.headers['Content-Type'] = 'application/json'
+    session.mount(api_base, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=idempotent))
+    session.mount(
+        f'{api_base}{QUERY_PATH}',
+        HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=throttled_only)
+    )
+    session.mount(
+        f'{api_base}{STK_PUSH_PATH}',
+        HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=connect_only)
+    )
+    return session
+
+
 class MpesaDarajaService:
     """
     M-Pesa Daraja API Service
@@ -58,19 +117,28 @@ class MpesaDarajaService:
         self.business_shortcode = getattr(settings, 'DAR_SHORTCODE', None)
         self.passkey = getattr(settings, 'DAR_PASSKEY', None)
         self.callback_url = getattr(settings, 'MPESA_CALLBACK_URL', None)
+        self.api_base = getattr(settings, 'MPESA_API_BASE', MPESA_API_BASE).rstrip('/')
         
         if not all([self.consumer_key, self.consumer_secret, self.business_shortcode, self.passkey]):
             logger.warning("M-Pesa Daraja credentials not fully configured")
         
         self._access_token = None
         self._token_expires_at = None
+        self._token_lock = threading.Lock()
+        self.session = _build_session(self.api_base)
+
+        # Tokens are per consumer key; keep the key itself out of the cache key
+        key_id = hashlib.sha256((self.consumer_key or '').encode()).hexdigest()[:16]
+        self._token_cache_key = TOKEN_CACHE_KEY.format(key_id)
+        self._token_lock_key = TOKEN_LOCK_KEY.format(key_id)
 
     def _get_access_token(self) -> str:
         """
         Get OAuth access token from Safaricom.
         
-        Uses Basic Authentication as per Safaricom's security requirements.
-        Token is cached until expiration.
+        Looks in this instance first, then in the shared cache. On a miss,
+        one thread in one process fetches a new token (single flight) while
+        the rest wait for it to appear in the cache.
         
         Returns:
             str: Access token for API requests
@@ -85,7 +153,53 @@ class MpesaDarajaService:
         
         if not self.consumer_key or not self.consumer_secret:
             raise MpesaDarajaError("M-Pesa consumer key and secret must be configured")
-        
+
+        with self._token_lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._access_token and timezone.now() < self._token_expires_at:
+                return self._access_token
+            token = self._cached_token()
+            if token:
+                return token
+
+            deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+            # add() returns None rather than False when the cache is unreachable
+            while cache.add(self._token_lock_key, 1, TOKEN_LOCK_TIMEOUT) is False:
+                # Another process is refreshing; use its token once it lands
+                time.sleep(TOKEN_WAIT_INTERVAL)
+                token = self._cached_token()
+                if token:
+                    return token
+                if time.monotonic() >= deadline:
+                    logger.warning("Timed out waiting for M-Pesa token refresh, fetching directly")
+                    return self._fetch_access_token()
+            try:
+                # The previous holder may have stored a token just before releasing
+                return self._cached_token() or self._fetch_access_token()
+            finally:
+                cache.delete(self._token_lock_key)
+
+    def _cached_token(self) -> Optional[str]:
+        """Adopt a token from the shared cache, or return None"""
+        cached = cache.get(self._token_cache_key)
+        if not cached:
+            return None
+        token, expires_at = cached
+        if timezone.now() >= expires_at:
+            return None
+        self._access_token, self._token_expires_at = token, expires_at
+        return token
+
+    def _invalidate_token(self, token: str):
+        """Drop ``token`` after Safaricom rejected it, unless it was already replaced"""
+        if self._access_token == token:
+            self._access_token = self._token_expires_at = None
+        cached = cache.get(self._token_cache_key)
+        if cached and cached[0] == token:
+            cache.delete(self._token_cache_key)
+
+    def _fetch_access_token(self) -> str:
+        """Request a new token from Safaricom and share it through the cache"""
         try:
             # Create Basic Auth header as per Safaricom documentation
             auth_string = f"{self.consumer_key}:{self.consumer_secret}"
@@ -94,11 +208,10 @@ class MpesaDarajaService:
             
             headers = {
                 'Authorization': f'Basic {auth_b64}',
-                'Content-Type': 'application/json'
             }
             
-            response = requests.get(
-                MPESA_OAUTH_URL,
+            response = self.session.get(
+                f'{self.api_base}{OAUTH_PATH}',
                 headers=headers,
                 timeout=10
             )
@@ -106,14 +219,17 @@ class MpesaDarajaService:
             
             data = response.json()
             access_token = data.get('access_token')
-            expires_in = data.get('expires_in', 3599)  # Default 1 hour
+            expires_in = int(data.get('expires_in', 3599))  # Default 1 hour
             
             if not access_token:
                 raise MpesaDarajaError("No access token received from Safaricom")
             
-            # Cache token
+            # Cache token for this process and every other worker
+            lifetime = max(expires_in - TOKEN_EXPIRY_BUFFER, 0)
             self._access_token = access_token
-            self._token_expires_at = timezone.now().replace(microsecond=0) + timezone.timedelta(seconds=expires_in - 300)  # 5 min buffer
+            self._token_expires_at = timezone.now().replace(microsecond=0) + timezone.timedelta(seconds=lifetime)
+            if lifetime:
+                cache.set(self._token_cache_key, (access_token, self._token_expires_at), lifetime)
             
             logger.info("M-Pesa access token obtained successfully")
             return access_token
@@ -125,6 +241,29 @@ class MpesaDarajaService:
             logger.error(f"Invalid response from Safaricom OAuth: {e}")
             raise MpesaDarajaError(f"Invalid response from Safaricom: {str(e)}")
 
+    def _post(self, path: str, payload: Dict, access_token: str, timeout: int) -> requests.Response:
+        """
+        POST to Daraja with a bearer token.
+
+        A 401 means the shared token was revoked or expired early; it is
+        dropped and the request is sent once more with a fresh token.
+        """
+        response = self.session.post(
+            f'{self.api_base}{path}',
+            json=payload,
+            headers={'Authorization': f'Bearer {access_token}'},
+            timeout=timeout
+        )
+        if response.status_code == 401:
+            self._invalidate_token(access_token)
+            response = self.session.post(
+                f'{self.api_base}{path}',
+                json=payload,
+                headers={'Authorization': f'Bearer {self._get_access_token()}'},
+                timeout=timeout
+            )
+        return response
+
     def _generate_password(self, timestamp: str) -> str:
         """
         Generate password for STK Push as per Safaricom documentation.
@@ -229,19 +368,9 @@ class MpesaDarajaService:
                 "TransactionDesc": transaction_description
             }
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
             logger.info(f"Initiating STK Push: {account_reference}, Amount: {amount}, Phone: {normalized_phone}")
             
-            response = requests.post(
-                MPESA_STK_PUSH_URL,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
+            response = self._post(STK_PUSH_PATH, payload, access_token, timeout=30)
             response.raise_for_status()
             
             data = response.json()
@@ -308,17 +437,7 @@ class MpesaDarajaService:
                 "CheckoutRequestID": checkout_request_id
             }
             
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.post(
-                MPESA_QUERY_URL,
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
+            response = self._post(QUERY_PATH, payload, access_token, timeout=10)
             response.raise_for_status()
             
             data = response.json()
@@ -415,12 +534,15 @@ class MpesaDarajaService:
 
 # Singleton instance
 _mpesa_service = None
+_mpesa_service_lock = threading.Lock()
 
 
 def get_mpesa_service() -> MpesaDarajaService:
     """Get singleton M-Pesa Daraja service instance."""
     global _mpesa_service
     if _mpesa_service is None:
-        _mpesa_service = MpesaDarajaService()
+        with _mpesa_service_lock:
+            if _mpesa_service is None:
+                _mpesa_service = MpesaDarajaService()
     return _mpesa_service
 
@@ -0,0 +1,179 @@
+"""
+Keyset (cursor) pagination for chronological feeds.
+
+Unlike ``LimitOffsetPagination``, a keyset page is fetched with a
+``WHERE (created_at, id) < (last_created_at, last_id)`` condition, so deep
+pages cost the same as the first one and rows inserted while a client is
+scrolling never shift the window (no duplicates on infinite scroll).
+
+A cursor only makes sense for the pagination's own ordering: requests that
+sort the queryset some other way (``?ordering=price``, search rank,
+distance) are rejected rather than silently re-sorted.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination keyed on a unique, composite ordering.
+
+    ``ordering`` must end with a unique field (``id``) so every row has a
+    distinct position; back it with a composite index in the same order.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+    unsupported_ordering_message = 'Cursor pagination cannot be combined with this ordering.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        self.check_ordering(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after_position(self.parse_position(position, queryset.model)))
+
+        # Fetch one extra row to learn whether another page exists
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def check_ordering(self, queryset):
+        """Reject querysets explicitly sorted by anything but a prefix of ``ordering``"""
+        current = tuple(queryset.query.order_by)
+        if current and current != tuple(self.ordering[:len(current)]):
+            raise ValidationError({self.cursor_query_param: self.unsupported_ordering_message})
+
+    def parse_position(self, position, model):
+        """Convert decoded cursor values to the ordering fields' Python types"""
+        values = []
+        for (field, _), value in zip(self._fields(), position):
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                values.append(model._meta.get_field(field).to_python(value))
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _after_position(self, position):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), per field direction
+        condition = Q()
+        equal = {}
+        for (field, descending), value in zip(self._fields(), position):
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, instance):
+        position = []
+        for field, _ in self._fields():
+            value = getattr(instance, field)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class FeedPagination(KeysetPagination):
+    """
+    Opt-in keyset pagination for endpoints with existing clients.
+
+    Requests carrying a ``cursor`` query parameter (empty for the first page)
+    are paginated by keyset; everything else is handled by ``fallback_class``
+    so existing limit/offset clients keep working. A ``fallback_class`` of
+    None leaves non-cursor responses unpaginated.
+    """
+    fallback_class = LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self._fallback = None
+        if self.cursor_query_param not in request.query_params:
+            if self.fallback_class is None:
+                return None
+            self._fallback = self.fallback_class()
+            return self._fallback.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self._fallback is not None:
+            return self._fallback.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        fallback = self.fallback_class().get_schema_operation_parameters(view) if self.fallback_class else []
+        return fallback + [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Keyset cursor; pass an empty value to start cursor pagination.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results per cursor page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
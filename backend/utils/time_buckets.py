@@ -0,0 +1,90 @@
+"""
+Database-side time bucketing for analytics queries.
+
+Wraps Django's ``Trunc*``/``Extract*`` functions so grouping by hour, day,
+week or month happens in SQL on every supported backend (SQLite in
+development, PostgreSQL in production) instead of in Python or through
+vendor-specific ``extra()`` SQL.
+"""
+from datetime import date, datetime, timedelta
+
+from django.db.models import Count, DateField
+from django.db.models.functions import (
+    ExtractIsoWeekDay, TruncDay, TruncHour, TruncMonth, TruncWeek,
+)
+
+BUCKETS = ('hour', 'day', 'week', 'month')
+
+
+def truncate(field, bucket):
+    """
+    Return an expression truncating ``field`` to the start of its bucket.
+
+    Hour buckets are datetimes; day, week (Monday) and month buckets are dates.
+    Truncation uses the current time zone.
+    """
+    if bucket == 'hour':
+        return TruncHour(field)
+    if bucket == 'day':
+        return TruncDay(field, output_field=DateField())
+    if bucket == 'week':
+        return TruncWeek(field, output_field=DateField())
+    if bucket == 'month':
+        return TruncMonth(field, output_field=DateField())
+    raise ValueError(f"Unknown time bucket '{bucket}', expected one of {', '.join(BUCKETS)}")
+
+
+def bucket_counts(queryset, field, bucket, aggregate=None):
+    """
+    Group ``queryset`` by ``bucket`` of ``field`` in the database.
+
+    Returns ``[(bucket_start, value), ...]`` in chronological order, where
+    ``value`` is ``aggregate`` (default: row count) over the bucket.
+    """
+    rows = queryset.annotate(bucket=truncate(field, bucket)).values('bucket').annotate(
+        value=aggregate if aggregate is not None else Count('pk')
+    ).order_by('bucket')
+    return [(row['bucket'], row['value']) for row in rows]
+
+
+def weekday(field):
+    """Return an expression for the day of the week of ``field``, Monday as 0."""
+    return ExtractIsoWeekDay(field) - 1
+
+
+def bucket_start(value, bucket):
+    """Return the start of the bucket containing the date or datetime ``value``."""
+    if bucket == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.date() if isinstance(value, datetime) else value
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown time bucket '{bucket}', expected one of {', '.join(BUCKETS)}")
+
+
+def bucket_series(start, end, bucket):
+    """Return every bucket start from ``start`` to ``end`` inclusive, oldest first."""
+    current = bucket_start(start, bucket)
+    last = bucket_start(end, bucket)
+    series = []
+    while current <= last:
+        series.append(current)
+        if bucket == 'hour':
+            current += timedelta(hours=1)
+        elif bucket == 'day':
+            current += timedelta(days=1)
+        elif bucket == 'week':
+            current += timedelta(days=7)
+        else:
+            current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return series
+
+
+def fill_buckets(counts, start, end, bucket, default=0):
+    """Zero-fill ``bucket_counts`` output so every bucket in the range is present."""
+    values = dict(counts)
+    return [(key, values.get(key, default)) for key in bucket_series(start, end, bucket)]